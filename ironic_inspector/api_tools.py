@@ -81,3 +81,27 @@ def limit_field(value):
     assert value >= 0, _('Limit cannot be negative')
     assert value <= CONF.api_max_limit, _('Limit over %s') % CONF.api_max_limit
     return value
+
+
+@request_field('fields')
+@raises_coercion_exceptions
+def fields_field(value):
+    """Fetch the field selection from flask.request.args.
+
+    The value is a comma-separated list of paths, either dotted
+    (``inventory.disks``) or JSON pointers (``/inventory/disks``).
+
+    :returns: a list of paths, each a tuple of keys
+    """
+    paths = []
+    for field in value.split(','):
+        field = field.strip()
+        if field.startswith('/'):
+            # JSON pointer, see RFC 6901
+            path = tuple(key.replace('~1', '/').replace('~0', '~')
+                         for key in field[1:].split('/'))
+        else:
+            path = tuple(field.split('.'))
+            assert all(path), _('Invalid field %s') % field
+        paths.append(path)
+    return paths
@@ -0,0 +1,88 @@
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""Check introspection rules against stored introspection data."""
+
+from __future__ import print_function
+
+import json
+import sys
+
+from oslo_config import cfg
+from oslo_log import log
+import six
+
+from ironic_inspector.common.i18n import _
+from ironic_inspector.conf import opts
+from ironic_inspector import rules
+
+LOG = log.getLogger(__name__)
+CONF = cfg.CONF
+
+_OPTS = [
+    cfg.StrOpt('rules-file',
+               dest='rules_file',
+               help=_('JSON file with the rules to evaluate, either a list '
+                      'of rules or an object with key "rules" as accepted '
+                      'by the bulk import API. The stored rules are '
+                      'evaluated if not provided.')),
+    cfg.IntOpt('batch-size',
+               dest='batch_size',
+               default=100,
+               min=1,
+               help=_('How many nodes to load introspection data for at '
+                      'once.')),
+    cfg.BoolOpt('show-nodes',
+                dest='show_nodes',
+                default=False,
+                help=_('Include UUIDs of the matched nodes in the output.')),
+]
+
+
+def _setup_logger(args=None):
+    args = [] if args is None else args
+    log.register_options(CONF)
+    opts.set_config_defaults()
+    opts.parse_args(args)
+    log.setup(CONF, 'ironic_inspector')
+
+
+def _load_rules(path):
+    with open(path) as fp:
+        rules_json = json.load(fp)
+    if isinstance(rules_json, dict):
+        rules_json = rules_json.get('rules', [])
+    return rules_json
+
+
+def main():
+    try:
+        CONF.register_cli_opts(_OPTS)
+        _setup_logger(sys.argv[1:])
+
+        rules_json = (_load_rules(CONF.rules_file)
+                      if CONF.rules_file else None)
+        result = rules.evaluate(rules_json, batch_size=CONF.batch_size)
+        if not CONF.show_nodes:
+            for rule in result['rules']:
+                del rule['nodes']
+        print(json.dumps(result, indent=2, sort_keys=True))
+    except KeyboardInterrupt:
+        print(_("... terminating rules evaluation"), file=sys.stderr)
+        return 130
+    except Exception as e:
+        print(six.text_type(e), file=sys.stderr)
+        return 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,182 @@
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Process-wide cache of the Bare Metal service ports.
+
+The cache is loaded once and then refreshed incrementally: ports are listed
+sorted by their ``created_at`` and ``updated_at`` fields in descending order,
+and the listing stops as soon as ports older than the newest already known
+one are reached. A port without a timestamp, e.g. one that was never updated,
+is never newer, so the listing also stops at it. Ironic does not report
+deleted ports, so the whole list is reloaded every
+``[ironic]port_cache_refresh_interval`` seconds. The same full reload catches
+updates that the incremental refresh misses on databases sorting ports
+without ``updated_at`` first.
+"""
+
+from eventlet import semaphore
+from oslo_config import cfg
+from oslo_log import log
+from oslo_utils import timeutils
+import six
+
+from ironic_inspector.common import ironic as ir_utils
+
+
+CONF = cfg.CONF
+LOG = log.getLogger(__name__)
+
+_FIELDS = ['uuid', 'address', 'extra', 'node_uuid', 'created_at',
+           'updated_at']
+_TIMESTAMPS = ('created_at', 'updated_at')
+
+_CACHE = None
+
+
+class Port(object):
+    """A cached Bare Metal port."""
+
+    __slots__ = ('uuid', 'address', 'extra', 'node_uuid')
+
+    def __init__(self, uuid, address, extra=None, node_uuid=None):
+        self.uuid = uuid
+        self.address = address
+        self.extra = extra or {}
+        self.node_uuid = node_uuid
+
+    def __repr__(self):
+        return '<Port %s (%s)>' % (self.uuid, self.address)
+
+
+def _timestamp(port, key):
+    value = getattr(port, key, None)
+    if not value:
+        return None
+    if isinstance(value, six.string_types):
+        value = timeutils.parse_isotime(value)
+    return timeutils.normalize_time(value)
+
+
+class PortCache(object):
+    """A cache of ports with a MAC address index."""
+
+    def __init__(self):
+        self._lock = semaphore.BoundedSemaphore()
+        self._ports = None
+        self._by_mac = {}
+        self._watermark = None
+        self._loaded_at = None
+
+    def refresh(self, ironic):
+        """Bring the cache up-to-date.
+
+        :param ironic: an ironic client instance.
+        :returns: the cache itself.
+        """
+        with self._lock:
+            if (self._ports is None or
+                    timeutils.is_older_than(
+                        self._loaded_at,
+                        CONF.ironic.port_cache_refresh_interval)):
+                self._load(ironic)
+            else:
+                self._update(ironic)
+        return self
+
+    def invalidate(self):
+        """Force a full reload on the next refresh."""
+        with self._lock:
+            self._ports = None
+
+    def ports(self):
+        """List all cached ports."""
+        return list(self._ports.values()) if self._ports else []
+
+    def macs(self):
+        """Get a set of MACs of all cached ports."""
+        return set(self._by_mac)
+
+    def get_by_mac(self, mac):
+        """Get a cached port by its MAC address or None."""
+        return self._by_mac.get(mac)
+
+    def _load(self, ironic):
+        ports = ir_utils.call_with_retries(ironic.port.list, limit=0,
+                                           fields=_FIELDS)
+        self._ports = {}
+        self._by_mac = {}
+        self._watermark = None
+        for port in ports:
+            self._store(port)
+        self._loaded_at = timeutils.utcnow()
+        LOG.debug('Loaded %d ports into the cache', len(self._ports))
+
+    def _update(self, ironic):
+        page_size = CONF.ironic.port_cache_page_size
+        since = self._watermark
+        changed = 0
+        for key in _TIMESTAMPS:
+            marker = None
+            while True:
+                page = ir_utils.call_with_retries(
+                    ironic.port.list, limit=page_size, marker=marker,
+                    sort_key=key, sort_dir='desc', fields=_FIELDS)
+                done = len(page) < page_size
+                for port in page:
+                    timestamp = _timestamp(port, key)
+                    # NOTE: ports that were never updated have no updated_at,
+                    # new ones are found by created_at. Depending on the
+                    # database they may come first, paging through them would
+                    # cost more than a full reload.
+                    if timestamp is None or (since is not None and
+                                             timestamp < since):
+                        done = True
+                        break
+                    self._store(port)
+                    changed += 1
+                if done:
+                    break
+                marker = page[-1].uuid
+        if changed:
+            LOG.debug('Updated %d ports in the cache', changed)
+
+    def _store(self, port):
+        old = self._ports.get(port.uuid)
+        if old is not None and self._by_mac.get(old.address) is old:
+            del self._by_mac[old.address]
+        new = Port(port.uuid, port.address, getattr(port, 'extra', None),
+                   getattr(port, 'node_uuid', None))
+        self._ports[new.uuid] = new
+        self._by_mac[new.address] = new
+        for key in _TIMESTAMPS:
+            timestamp = _timestamp(port, key)
+            if timestamp is not None and (self._watermark is None or
+                                          timestamp > self._watermark):
+                self._watermark = timestamp
+
+
+def cache():
+    """Get the process-wide port cache."""
+    global _CACHE
+    if _CACHE is None:
+        _CACHE = PortCache()
+    return _CACHE
+
+
+def refresh(ironic):
+    """Refresh the process-wide port cache and return it.
+
+    :param ironic: an ironic client instance.
+    :returns: PortCache instance.
+    """
+    return cache().refresh(ironic)
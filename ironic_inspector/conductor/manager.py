@@ -11,6 +11,9 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import datetime
+import gzip
+import os
 import sys
 import traceback as traceback_mod
 
@@ -22,6 +25,7 @@ from oslo_config import cfg
 from oslo_log import log
 import oslo_messaging as messaging
 from oslo_utils import reflection
+from oslo_utils import timeutils
 
 from ironic_inspector.common.i18n import _
 from ironic_inspector.common import ironic as ir_utils
@@ -82,9 +86,16 @@ class ConductorManager(object):
             spacing=CONF.clean_up_period
         )(periodic_clean_up)
 
+        callables = [(driver.get_periodic_sync_task(), None, None),
+                     (periodic_clean_up_, None, None)]
+        if CONF.purge.retention_days:
+            periodic_purge_ = periodics.periodic(
+                spacing=CONF.purge.period
+            )(periodic_purge)
+            callables.append((periodic_purge_, None, None))
+
         self._periodics_worker = periodics.PeriodicWorker(
-            callables=[(driver.get_periodic_sync_task(), None, None),
-                       (periodic_clean_up_, None, None)],
+            callables=callables,
             executor_factory=periodics.ExistingExecutor(utils.executor()),
             on_failure=self._periodics_watchdog)
         utils.executor().submit(self._periodics_worker.start)
@@ -130,15 +141,18 @@ class ConductorManager(object):
         eventlet.spawn(self.del_host)
 
     @messaging.expected_exceptions(utils.Error)
+    @db.with_request_session
     def do_introspection(self, context, node_id, token=None,
                          manage_boot=True):
         introspect.introspect(node_id, token=token, manage_boot=manage_boot)
 
     @messaging.expected_exceptions(utils.Error)
+    @db.with_request_session
     def do_abort(self, context, node_id, token=None):
         introspect.abort(node_id, token=token)
 
     @messaging.expected_exceptions(utils.Error)
+    @db.with_request_session
     def do_reapply(self, context, node_uuid, token=None, data=None):
         if not data:
             try:
@@ -156,6 +170,7 @@ class ConductorManager(object):
         process.reapply(node_uuid, data=data)
 
 
+@db.with_request_session
 def periodic_clean_up():  # pragma: no cover
     try:
         if node_cache.clean_up():
@@ -169,6 +184,43 @@ def periodic_clean_up():  # pragma: no cover
         LOG.exception('Periodic sync of node list with ironic failed')
 
 
+@db.with_request_session
+def periodic_purge():
+    try:
+        purge_finished()
+    except Exception:
+        LOG.exception('Periodic purge of finished introspection records '
+                      'failed')
+
+
+def purge_finished():
+    """Purge the records of finished introspections.
+
+    See the [purge] configuration section.
+
+    :returns: number of purged nodes
+    """
+    older_than = timeutils.utcnow() - datetime.timedelta(
+        days=CONF.purge.retention_days)
+    if not CONF.purge.archive_dir:
+        return node_cache.purge_finished(older_than,
+                                         batch_size=CONF.purge.batch_size)
+
+    path = os.path.join(CONF.purge.archive_dir,
+                        'ironic-inspector-%s.jsonl.gz' %
+                        timeutils.utcnow().strftime('%Y%m%d%H%M%S'))
+    with gzip.open(path, 'wb') as archive:
+        purged = node_cache.purge_finished(older_than,
+                                           batch_size=CONF.purge.batch_size,
+                                           archive=archive)
+    if purged:
+        LOG.info('Archived records of %(count)d nodes to %(path)s',
+                 {'count': purged, 'path': path})
+    else:
+        os.unlink(path)
+    return purged
+
+
 def sync_with_ironic():
     ironic = ir_utils.get_client()
     # TODO(yuikotakada): pagination
@@ -18,8 +18,10 @@ from ironic_inspector.conf import discovery
 from ironic_inspector.conf import dnsmasq_pxe_filter
 from ironic_inspector.conf import iptables
 from ironic_inspector.conf import ironic
+from ironic_inspector.conf import nftables
 from ironic_inspector.conf import pci_devices
 from ironic_inspector.conf import processing
+from ironic_inspector.conf import purge
 from ironic_inspector.conf import pxe_filter
 from ironic_inspector.conf import service_catalog
 from ironic_inspector.conf import swift
@@ -34,8 +36,10 @@ default.register_opts(CONF)
 dnsmasq_pxe_filter.register_opts(CONF)
 iptables.register_opts(CONF)
 ironic.register_opts(CONF)
+nftables.register_opts(CONF)
 pci_devices.register_opts(CONF)
 processing.register_opts(CONF)
+purge.register_opts(CONF)
 pxe_filter.register_opts(CONF)
 service_catalog.register_opts(CONF)
 swift.register_opts(CONF)
@@ -76,6 +76,22 @@ _OPTS = [
                        'can manage PXE booting of nodes. If set to False, '
                        'the API will reject introspection requests with '
                        'manage_boot missing or set to True.')),
+    cfg.IntOpt('database_replica_lag', default=10, min=0,
+               help=_('Staleness tolerance of the read-only API queries (node '
+                      'status, node list, introspection data and rules list) '
+                      'served by the replica database configured with the '
+                      '[database]slave_connection option. For this amount of '
+                      'time in seconds after this process wrote to the '
+                      'database, these queries use the primary database '
+                      'instead, so that clients see their own changes. It '
+                      'should be set to the expected replication lag; 0 '
+                      'always uses the replica. Only writes made by this '
+                      'process are tracked: when the API and the conductor '
+                      'run as separate processes, the node list and the '
+                      'introspection data may lag behind the changes made by '
+                      'the conductor. The status of nodes that are not '
+                      'finished on the replica is always read from the '
+                      'primary database.')),
     cfg.BoolOpt('enable_mdns', default=False,
                 help=_('Whether to enable publishing the ironic-inspector API '
                        'endpoint via multicast DNS.')),
@@ -17,6 +17,17 @@ from ironic_inspector.common.i18n import _
 
 
 _OPTS = [
+    cfg.StrOpt('mode', default='hostsdir',
+               choices=[('hostsdir', _('One file per MAC address in the '
+                                       'dhcp_hostsdir directory, picked up '
+                                       'by dnsmasq through inotify.')),
+                        ('hostsfile', _('All MAC addresses in the single '
+                                        'dhcp_hostsfile file, replaced '
+                                        'atomically on changes, after which '
+                                        'the dnsmasq_reload_command is '
+                                        'run.'))],
+               help=_('How the MAC address records are exposed to dnsmasq. '
+                      'The hostsfile mode scales better with many ports.')),
     cfg.StrOpt('dhcp_hostsdir',
                default='/var/lib/ironic-inspector/dhcp-hostsdir',
                help=_('The MAC address cache directory, exposed to dnsmasq.'
@@ -36,7 +47,28 @@ _OPTS = [
     cfg.StrOpt('dnsmasq_stop_command', default='',
                help=_('A (shell) command line to stop the dnsmasq service '
                       'upon inspector (error) exit. Default: don\'t stop.')),
-
+    cfg.StrOpt('dhcp_hostsfile',
+               default='/var/lib/ironic-inspector/dhcp-hostsfile',
+               help=_('The MAC address cache file, exposed to dnsmasq with '
+                      'the --dhcp-hostsfile option. Only used in the '
+                      'hostsfile mode. This file is expected to be in '
+                      'exclusive control of the driver and is rewritten on '
+                      'the driver initialization.')),
+    cfg.StrOpt('dnsmasq_reload_command', default='',
+               help=_('A (shell) command line to make dnsmasq re-read the '
+                      'dhcp_hostsfile, e.g. by sending it the SIGHUP signal. '
+                      'Only used in the hostsfile mode, where it is required '
+                      'for dnsmasq to pick up the changes; a warning is '
+                      'logged on start up if it is not set. It is not run '
+                      'during the driver initialization, before dnsmasq is '
+                      'started.')),
+    cfg.IntOpt('verify_interval', default=600, min=0,
+               help=_('The driver keeps the state of the records in the '
+                      'dhcp_hostsdir (or dhcp_hostsfile) in memory and only '
+                      'writes the changes. Amount of time in seconds, after '
+                      'which the records are re-read from the disk during a '
+                      'sync to detect and repair any drift. Set to 0 to '
+                      'disable.')),
 ]
 
 
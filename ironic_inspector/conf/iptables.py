@@ -40,6 +40,16 @@ _OPTS = [
                         ('6', _('IPv6'))],
                help=_('The IP version that will be used for iptables filter. '
                       'Defaults to 4.')),
+    cfg.StrOpt('ipset_name',
+               default='ironic-inspector',
+               help=_('Name of the ipset holding the blacklisted MACs, '
+                      'used by the "ipset" PXE filter driver.')),
+    cfg.IntOpt('verify_interval', default=600, min=0,
+               help=_('Amount of time in seconds, after which the actual '
+                      'state of the filter is compared with the expected one '
+                      'during a sync of the "iptables" and "ipset" PXE '
+                      'filter drivers. Any drift is reported and repaired. '
+                      'Set to 0 to disable.')),
 ]
 
 
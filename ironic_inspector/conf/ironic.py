@@ -65,6 +65,20 @@ _OPTS = [
                default=30,
                help=_('Maximum number of retries in case of conflict error '
                       '(HTTP 409).')),
+    cfg.IntOpt('port_cache_refresh_interval',
+               default=600,
+               min=0,
+               help=_('Interval in seconds between full reloads of the '
+                      'cache of Ironic ports used by the PXE filters and '
+                      'the discovery. In between, only the ports created or '
+                      'updated since the previous refresh are fetched. '
+                      'Deleted ports are only detected on a full reload. '
+                      'Set to 0 to always reload all ports.')),
+    cfg.IntOpt('port_cache_page_size',
+               default=100,
+               min=1,
+               help=_('Number of ports to request at once when refreshing '
+                      'the cache of Ironic ports incrementally.')),
 ]
 
 
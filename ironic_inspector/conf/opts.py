@@ -66,8 +66,10 @@ def list_opts():
         ('swift', ironic_inspector.conf.swift.list_opts()),
         ('ironic', ironic_inspector.conf.ironic.list_opts()),
         ('iptables', ironic_inspector.conf.iptables.list_opts()),
+        ('nftables', ironic_inspector.conf.nftables.list_opts()),
         ('processing', ironic_inspector.conf.processing.list_opts()),
         ('pci_devices', ironic_inspector.conf.pci_devices.list_opts()),
+        ('purge', ironic_inspector.conf.purge.list_opts()),
         ('pxe_filter', ironic_inspector.conf.pxe_filter.list_opts()),
         ('service_catalog', ironic_inspector.conf.service_catalog.list_opts()),
     ]
@@ -95,6 +95,14 @@ _OPTS = [
     cfg.BoolOpt('power_off',
                 default=True,
                 help=_('Whether to power off a node after introspection.')),
+    cfg.IntOpt('continue_cache_ttl',
+               default=60,
+               min=0,
+               help=_('Time (in seconds) to remember the result of '
+                      'successfully processed introspection data. Identical '
+                      'data submitted again by the ramdisk within this time '
+                      'gets the original result without being processed '
+                      'again. Set to 0 to disable.')),
 ]
 
 
@@ -0,0 +1,47 @@
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+from oslo_config import cfg
+
+from ironic_inspector.common.i18n import _
+
+
+_OPTS = [
+    cfg.IntOpt('retention_days',
+               default=0, min=0,
+               help=_('Number of days to keep the records of finished '
+                      'introspections (the node status, attributes, options '
+                      'and introspection data stored in the database) for. '
+                      'Older records are purged periodically. Set to 0 to '
+                      'disable purging.')),
+    cfg.IntOpt('period',
+               default=3600, min=1,
+               help=_('Amount of time in seconds between two runs of the '
+                      'purge of finished introspection records.')),
+    cfg.IntOpt('batch_size',
+               default=100, min=1,
+               help=_('Number of nodes purged in one database transaction.')),
+    cfg.StrOpt('archive_dir',
+               help=_('Directory to export the purged records to before '
+                      'deleting them. Every purge run creates a gzip '
+                      'compressed file with one JSON record per node. If not '
+                      'set, the records are deleted without being '
+                      'exported.')),
+]
+
+
+def register_opts(conf):
+    conf.register_opts(_OPTS, 'purge')
+
+
+def list_opts():
+    return _OPTS
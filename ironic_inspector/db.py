@@ -16,6 +16,7 @@
 """SQLAlchemy models for inspection data and shared database code."""
 
 import contextlib
+import threading
 
 from oslo_concurrency import lockutils
 from oslo_config import cfg
@@ -23,6 +24,8 @@ from oslo_db import options as db_opts
 from oslo_db.sqlalchemy import enginefacade
 from oslo_db.sqlalchemy import models
 from oslo_db.sqlalchemy import types as db_types
+from oslo_utils import timeutils
+import six
 from sqlalchemy import (Boolean, Column, DateTime, Enum, ForeignKey,
                         Integer, String, Text)
 from sqlalchemy.ext.declarative import declarative_base
@@ -41,6 +44,11 @@ Base = declarative_base(cls=ModelBase)
 CONF = cfg.CONF
 _DEFAULT_SQL_CONNECTION = 'sqlite:///ironic_inspector.sqlite'
 _CTX_MANAGER = None
+# Monotonic time of the last write transaction of this process
+_LAST_WRITE = None
+# The session bound to the current API request, RPC call or background job,
+# greenthread-local once eventlet has monkey patched threading
+_REQUEST = threading.local()
 
 db_opts.set_defaults(CONF, connection=_DEFAULT_SQL_CONNECTION)
 
@@ -88,6 +96,9 @@ class Rule(Base):
     __tablename__ = 'rules'
     uuid = Column(String(36), primary_key=True)
     created_at = Column(DateTime, nullable=False)
+    # NOTE: rules are applied in the order of their positions, the UUID
+    # breaks ties between rules created concurrently
+    position = Column(Integer, nullable=False, default=0)
     description = Column(Text)
     # NOTE(dtantsur): in the future we might need to temporary disable a rule
     disabled = Column(Boolean, default=False)
@@ -134,6 +145,13 @@ class RuleAction(Base):
         return res
 
 
+class RuleSetVersion(Base):
+    __tablename__ = 'rule_set_version'
+    # NOTE: there is only one row, bumped on every change to the rules
+    id = Column(Integer, primary_key=True)
+    version = Column(Integer, nullable=False, default=0)
+
+
 class IntrospectionData(Base):
     __tablename__ = 'introspection_data'
     uuid = Column(String(36), ForeignKey('nodes.uuid'), primary_key=True)
@@ -155,17 +173,88 @@ def model_query(model, *args, **kwargs):
     """Query helper for simpler session usage.
 
     :param session: if present, the session to use
+    :param replica: if True and no session is given, use a replica session
+        (see get_replica_session), only suitable for read-only queries
+        tolerating stale data.
     """
-    session = kwargs.get('session') or get_reader_session()
+    session = kwargs.get('session')
+    if session is None:
+        session = (get_replica_session() if kwargs.get('replica')
+                   else get_reader_session())
     query = session.query(model, *args)
     return query
 
 
 @contextlib.contextmanager
 def ensure_transaction(session=None):
+    global _LAST_WRITE
+
     session = session or get_writer_session()
-    with session.begin(subtransactions=True):
+    try:
+        with session.begin(subtransactions=True):
+            yield session
+    finally:
+        _LAST_WRITE = timeutils.now()
+
+
+@contextlib.contextmanager
+def request_session():
+    """Bind one session to the current thread for the duration of a request.
+
+    While bound, the session is returned by get_reader_session and
+    get_writer_session, and is thus used by model_query and
+    ensure_transaction, instead of creating a new session for every query
+    and transaction. Nested calls reuse the outer session. The session is
+    closed on exit.
+    """
+    session = getattr(_REQUEST, 'session', None)
+    if session is not None:
+        yield session
+        return
+
+    session = get_context_manager().writer.get_sessionmaker()()
+    _REQUEST.session = session
+    try:
+        yield session
+    finally:
+        _REQUEST.session = None
+        session.close()
+
+
+def with_request_session(func):
+    """Decorator running the function within request_session."""
+    @six.wraps(func)
+    def wrapper(*args, **kwargs):
+        with request_session():
+            return func(*args, **kwargs)
+    return wrapper
+
+
+def expire_request_session():
+    """Expire the objects loaded by the bound session, if any.
+
+    The sessions are created with expire_on_commit=False, so the objects
+    loaded earlier during a request are not refreshed by later queries. Call
+    this when the rows may have changed outside of the current request, e.g.
+    after waiting for a node lock.
+    """
+    session = getattr(_REQUEST, 'session', None)
+    if session is not None:
+        session.expire_all()
+
+
+@contextlib.contextmanager
+def standalone_session():
+    """Create a new session, even if one is bound by request_session.
+
+    For work that can outlive the request, e.g. producing a streamed
+    response. The session is closed on exit.
+    """
+    session = get_context_manager().writer.get_sessionmaker()()
+    try:
         yield session
+    finally:
+        session.close()
 
 
 @_synchronized("transaction-context-manager")
@@ -193,14 +282,44 @@ def get_context_manager():
 def get_reader_session():
     """Help method to get reader session.
 
-    :returns: The reader session.
+    The reader session uses the primary database, so that the reads are
+    consistent with the preceding writes.
+
+    :returns: The session bound by request_session, if any, otherwise a new
+        reader session.
     """
+    return get_writer_session()
+
+
+def get_replica_session():
+    """Help method to get a session for reads tolerating stale data.
+
+    The session uses the replica database set by the
+    [database]slave_connection option, unless this process wrote to the
+    database during the last [DEFAULT]database_replica_lag seconds, in which
+    case the primary database is used to let the clients see their changes.
+
+    :returns: The replica session, or the reader session if no replica is
+        configured.
+    """
+    if not CONF.database.slave_connection:
+        return get_reader_session()
+
+    lag = CONF.database_replica_lag
+    if (lag and _LAST_WRITE is not None and
+            timeutils.now() - _LAST_WRITE < lag):
+        return get_reader_session()
+
     return get_context_manager().reader.get_sessionmaker()()
 
 
 def get_writer_session():
     """Help method to get writer session.
 
-    :returns: The writer session.
+    :returns: The session bound by request_session, if any, otherwise a new
+        writer session.
     """
+    session = getattr(_REQUEST, 'session', None)
+    if session is not None:
+        return session
     return get_context_manager().writer.get_sessionmaker()()
@@ -20,6 +20,7 @@ from oslo_config import cfg
 
 from ironic_inspector.common.i18n import _
 from ironic_inspector.common import ironic as ir_utils
+from ironic_inspector import db
 from ironic_inspector import introspection_state as istate
 from ironic_inspector import node_cache
 from ironic_inspector.pxe_filter import base as pxe_filter
@@ -63,6 +64,7 @@ def introspect(node_id, manage_boot=True, token=None):
     utils.executor().submit(_background_introspect, node_info, ironic)
 
 
+@db.with_request_session
 @node_cache.release_lock
 @node_cache.fsm_transition(istate.Events.wait)
 def _background_introspect(node_info, ironic):
@@ -89,7 +91,7 @@ def _background_introspect_locked(node_info, ironic):
         node_info.add_attribute(node_cache.MACS_ATTRIBUTE, macs)
         LOG.info('Whitelisting MAC\'s %s for a PXE boot', macs,
                  node_info=node_info)
-        pxe_filter.driver().sync(ironic)
+        pxe_filter.driver().on_introspection_started(macs, ironic)
 
     attrs = node_info.attributes
     if CONF.processing.node_not_found_hook is None and not attrs:
@@ -145,6 +147,7 @@ def abort(node_id, token=None):
     utils.executor().submit(_abort, node_info, ironic)
 
 
+@db.with_request_session
 @node_cache.release_lock
 @node_cache.fsm_event_before(istate.Events.abort)
 def _abort(node_info, ironic):
@@ -158,15 +161,8 @@ def _abort(node_info, ironic):
             LOG.warning('Failed to power off node: %s', exc,
                         node_info=node_info)
 
+    # NOTE: this also blocks the node from PXE booting the introspection
+    # image
     node_info.finished(istate.Events.abort_end,
                        error=_('Canceled by operator'))
-
-    # block this node from PXE Booting the introspection image
-    try:
-        pxe_filter.driver().sync(ironic)
-    except Exception as exc:
-        # Note(mkovacik): this will be retried in the PXE filter sync
-        # periodic task; we continue aborting
-        LOG.warning('Failed to sync the PXE filter: %s', exc,
-                    node_info=node_info)
     LOG.info('Introspection aborted', node_info=node_info)
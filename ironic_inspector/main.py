@@ -11,6 +11,7 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import json
 import os
 import re
 
@@ -27,6 +28,7 @@ from ironic_inspector.common import ironic as ir_utils
 from ironic_inspector.common import rpc
 import ironic_inspector.conf
 from ironic_inspector.conf import opts as conf_opts
+from ironic_inspector import db
 from ironic_inspector import node_cache
 from ironic_inspector import process
 from ironic_inspector import rules
@@ -39,7 +41,7 @@ app = flask.Flask(__name__)
 LOG = utils.getProcessingLogger(__name__)
 
 MINIMUM_API_VERSION = (1, 0)
-CURRENT_API_VERSION = (1, 15)
+CURRENT_API_VERSION = (1, 18)
 DEFAULT_API_VERSION = CURRENT_API_VERSION
 _LOGGING_EXCLUDED_KEYS = ('logs',)
 
@@ -91,6 +93,22 @@ def convert_exceptions(func):
     return wrapper
 
 
+def _require_version(minimum, feature):
+    """Check that the requested API version is at least minimum.
+
+    :param minimum: the minimum API version as a tuple
+    :param feature: a human readable name of the feature for the error
+    :raises: utils.Error with code 406 otherwise, the same code as for an
+             unsupported API version
+    """
+    if _get_version() < minimum:
+        raise utils.Error(_('%(feature)s requires API version %(version)s '
+                            'or newer') %
+                          {'feature': feature,
+                           'version': _format_version(minimum)},
+                          code=406)
+
+
 @app.before_request
 def check_api_version():
     requested = _get_version()
@@ -155,7 +173,8 @@ def api(path, is_public_api=False, rule=None, verb_to_rule_map=None,
     """Decorator to wrap api methods.
 
     Performs flask routing, exception conversion,
-    generation of oslo context for request and API access policy enforcement.
+    generation of oslo context for request, API access policy enforcement
+    and binding of a database session for the duration of the request.
 
     :param path: flask app route path
     :param is_public_api: whether this API path should be treated
@@ -182,7 +201,8 @@ def api(path, is_public_api=False, rule=None, verb_to_rule_map=None,
             else:
                 policy_rule = rule
             utils.check_auth(flask.request, rule=policy_rule)
-            return func(*args, **kwargs)
+            with db.request_session():
+                return func(*args, **kwargs)
         return wrapper
     return outer
 
@@ -262,7 +282,7 @@ def api_introspection(node_id):
                     token=flask.request.headers.get('X-Auth-Token'))
         return '', 202
     else:
-        node_info = node_cache.get_node(node_id)
+        node_info = node_cache.get_node(node_id, replica=True)
         return flask.json.jsonify(generate_introspection_status(node_info))
 
 
@@ -291,11 +311,17 @@ def api_introspection_abort(node_id):
 @api('/v1/introspection/<node_id>/data', rule="introspection:data",
      methods=['GET'])
 def api_introspection_data(node_id):
+    fields = api_tools.fields_field()
+    if fields is not None:
+        _require_version((1, 18), _('Selecting fields of introspection '
+                                    'data'))
+
     try:
         if not uuidutils.is_uuid_like(node_id):
             node = ir_utils.get_node(node_id, fields=['uuid'])
             node_id = node.uuid
-        res = process.get_introspection_data(node_id)
+        res = process.get_introspection_data(node_id, fields=fields,
+                                             replica=True)
         return res, 200, {'Content-Type': 'application/json'}
     except utils.IntrospectionDataStoreDisabled:
         return error_response(_('Inspector is not configured to store data. '
@@ -340,15 +366,32 @@ def rule_repr(rule, short):
 
 @api('/v1/rules',
      rule="introspection:rule:{}",
-     verb_to_rule_map={'GET': 'get', 'POST': 'create', 'DELETE': 'delete'},
-     methods=['GET', 'POST', 'DELETE'])
+     verb_to_rule_map={'GET': 'get', 'POST': 'create', 'DELETE': 'delete',
+                       'PUT': 'import'},
+     methods=['GET', 'POST', 'DELETE', 'PUT'])
 def api_rules():
     if flask.request.method == 'GET':
-        res = [rule_repr(rule, short=True) for rule in rules.get_all()]
+        res = [rule_repr(rule, short=True)
+               for rule in rules.get_all(replica=True)]
         return flask.jsonify(rules=res)
     elif flask.request.method == 'DELETE':
         rules.delete_all()
         return '', 204
+    elif flask.request.method == 'PUT':
+        _require_version((1, 16), _('Bulk import of rules'))
+        body = flask.request.get_json(force=True)
+        if not isinstance(body, dict):
+            raise utils.Error(_('Invalid request body, expected an object'),
+                              code=400)
+        mode = body.get('mode', 'replace')
+        if mode not in ('replace', 'merge'):
+            raise utils.Error(_('Invalid import mode %s, expected "replace" '
+                                'or "merge"') % mode, code=400)
+
+        res = rules.import_rules(body.get('rules', []),
+                                 replace=(mode == 'replace'))
+        return flask.jsonify(rules=[rule_repr(rule, short=True)
+                                    for rule in res])
     else:
         body = flask.request.get_json(force=True)
         if body.get('uuid') and not uuidutils.is_uuid_like(body['uuid']):
@@ -364,6 +407,40 @@ def api_rules():
             flask.jsonify(rule_repr(rule, short=False)), response_code)
 
 
+@api('/v1/rules/export',
+     rule="introspection:rule:get",
+     methods=['GET'])
+def api_rules_export():
+    _require_version((1, 16), _('Export of rules'))
+
+    def _generate():
+        yield '{"rules": ['
+        # NOTE: rules.export reads every batch in its own session, the
+        # request session is closed while the response is streamed
+        for index, rule in enumerate(rules.export()):
+            if index:
+                yield ', '
+            yield json.dumps(rule.as_dict(short=False))
+        yield ']}'
+
+    return flask.Response(flask.stream_with_context(_generate()),
+                          mimetype='application/json')
+
+
+@api('/v1/rules/evaluate',
+     rule="introspection:rule:evaluate",
+     methods=['POST'])
+def api_rules_evaluate():
+    _require_version((1, 17), _('Evaluation of rules'))
+
+    body = flask.request.get_json(force=True) if flask.request.data else {}
+    if not isinstance(body, dict):
+        raise utils.Error(_('Invalid request body, expected an object'),
+                          code=400)
+
+    return flask.jsonify(rules.evaluate(body.get('rules')))
+
+
 @api('/v1/rules/<uuid>',
      rule="introspection:rule:{}",
      verb_to_rule_map={'GET': 'get', 'DELETE': 'delete'},
@@ -0,0 +1,47 @@
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+"""add_rule_position
+
+Revision ID: a91b3c5d7e2f
+Revises: c3e2a1f0b9d7
+Create Date: 2019-03-04 10:21:45.183204
+
+"""
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy import sql
+
+
+# revision identifiers, used by Alembic.
+revision = 'a91b3c5d7e2f'
+down_revision = 'c3e2a1f0b9d7'
+branch_labels = None
+depends_on = None
+
+Rule = sql.table('rules',
+                 sql.column('uuid', sa.String),
+                 sql.column('created_at', sa.DateTime),
+                 sql.column('position', sa.Integer))
+
+
+def upgrade():
+    op.add_column('rules', sa.Column('position', sa.Integer(),
+                                     nullable=False, server_default='0'))
+    # keep the existing order of the rules
+    connection = op.get_bind()
+    uuids = [row[0] for row in connection.execute(
+        sql.select([Rule.c.uuid]).order_by(Rule.c.created_at, Rule.c.uuid))]
+    for position, uuid in enumerate(uuids):
+        connection.execute(Rule.update().where(Rule.c.uuid == uuid).values(
+            position=position))
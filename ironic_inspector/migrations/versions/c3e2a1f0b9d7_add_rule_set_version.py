@@ -0,0 +1,39 @@
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+"""add_rule_set_version
+
+Revision ID: c3e2a1f0b9d7
+Revises: bf8dec16023c
+Create Date: 2019-02-11 14:03:27.518230
+
+"""
+
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = 'c3e2a1f0b9d7'
+down_revision = 'bf8dec16023c'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    rule_set_version = op.create_table(
+        'rule_set_version',
+        sa.Column('id', sa.Integer, primary_key=True),
+        sa.Column('version', sa.Integer, nullable=False, default=0),
+        mysql_ENGINE='InnoDB',
+        mysql_DEFAULT_CHARSET='UTF8'
+    )
+    op.bulk_insert(rule_set_version, [{'id': 1, 'version': 0}])
@@ -30,12 +30,14 @@ from oslo_utils import reflection
 from oslo_utils import timeutils
 from oslo_utils import uuidutils
 import six
+import sqlalchemy
 from sqlalchemy.orm import exc as orm_errors
 
 from ironic_inspector.common.i18n import _
 from ironic_inspector.common import ironic as ir_utils
 from ironic_inspector import db
 from ironic_inspector import introspection_state as istate
+from ironic_inspector.pxe_filter import base as pxe_filter
 from ironic_inspector import utils
 
 
@@ -93,6 +95,9 @@ class NodeInfo(object):
         # Whether lock was acquired using this NodeInfo object
         self._locked = lock is not None
         self._fsm = None
+        # Node patches and trait changes accumulated by batched_updates()
+        self._pending_patches = None
+        self._pending_traits = None
 
     def __del__(self):
         if self._locked:
@@ -123,6 +128,8 @@ class NodeInfo(object):
         LOG.debug('Attempting to acquire lock', node_info=self)
         if self._lock.acquire(blocking):
             self._locked = True
+            # NOTE: the node may have been updated while waiting for the lock
+            db.expire_request_session()
             LOG.debug('Successfully acquired lock', node_info=self)
             return True
         else:
@@ -283,7 +290,8 @@ class NodeInfo(object):
     def finished(self, event, error=None):
         """Record status for this node and process a terminal transition.
 
-        Also deletes look up attributes from the cache.
+        Also deletes look up attributes from the cache and blocks the node's
+        MACs in the PXE filter.
 
         :param event: the event to process
         :param error: error message
@@ -292,6 +300,7 @@ class NodeInfo(object):
         self.release_lock()
         self.finished_at = timeutils.utcnow()
         self.error = error
+        macs = self.attributes.get(MACS_ATTRIBUTE)
 
         with db.ensure_transaction() as session:
             self.fsm_event(event)
@@ -300,6 +309,17 @@ class NodeInfo(object):
                 node_uuid=self.uuid).delete()
             db.model_query(db.Option, session=session).filter_by(
                 uuid=self.uuid).delete()
+            self._attributes = None
+
+        if macs:
+            # block this node from PXE booting the introspection image
+            try:
+                pxe_filter.driver().on_introspection_finished(
+                    macs, self._ironic)
+            except Exception as exc:
+                # this will be retried in the PXE filter sync periodic task
+                LOG.warning('Failed to update the PXE filter: %s', exc,
+                            node_info=self)
 
     def add_attribute(self, name, value, session=None):
         """Store look up attribute for a node in the database.
@@ -409,6 +429,106 @@ class NodeInfo(object):
         else:
             self._ports[mac] = port
 
+    @contextlib.contextmanager
+    def batched_updates(self, ironic=None):
+        """Accumulate node updates and send them to Ironic at once.
+
+        Inside this context manager patches without extra arguments are
+        applied to the cached node object and sent as a single node update
+        on exit, while trait changes are sent as one call. Updates are also
+        sent if an exception is raised inside the block.
+
+        :param ironic: Ironic client to use instead of self.ironic
+        """
+        if self._pending_patches is not None:
+            # Already batching, the outermost block sends updates
+            yield
+            return
+
+        self._pending_patches = []
+        self._pending_traits = []
+        try:
+            yield
+        except Exception:
+            with excutils.save_and_reraise_exception():
+                try:
+                    self._flush_updates(ironic)
+                except Exception:
+                    LOG.exception('Failed to update the node after an '
+                                  'error', node_info=self)
+        else:
+            self._flush_updates(ironic)
+        finally:
+            self._pending_patches = None
+            self._pending_traits = None
+
+    def _flush_updates(self, ironic=None):
+        patches, self._pending_patches = self._pending_patches, []
+        traits, self._pending_traits = self._pending_traits, []
+        if not patches and not traits:
+            return
+
+        ironic = ironic or self.ironic
+
+        if patches:
+            LOG.debug('Updating node with patches %s', patches,
+                      node_info=self)
+            try:
+                self._node = ironic.node.update(self.uuid, patches)
+            except Exception:
+                # The cached node has the patches applied, refetch it
+                self._node = None
+                raise
+
+        if len(traits) == 1:
+            op, trait = traits[0]
+            if op == 'add':
+                self._add_trait(trait, ironic)
+            else:
+                self._remove_trait(trait, ironic)
+        elif traits:
+            current = ironic.node.get_traits(self.uuid)
+            new = list(current)
+            for op, trait in traits:
+                if op == 'add' and trait not in new:
+                    new.append(trait)
+                elif op == 'remove' and trait in new:
+                    new.remove(trait)
+            if new != current:
+                LOG.debug('Setting traits %s', new, node_info=self)
+                ironic.node.set_traits(self.uuid, new)
+
+    def _queue_patch(self, patch):
+        """Add a patch to the pending ones, applying it to the cached node.
+
+        :returns: False if the patch cannot be applied to the cached node
+        """
+        try:
+            _apply_patch(self.node(), patch)
+        except (AttributeError, KeyError, IndexError, TypeError):
+            return False
+
+        path = patch['path']
+        if patch.get('op') in ('add', 'replace'):
+            # A later value for the same path overrides the previous one,
+            # unless the path is touched by another patch in between.
+            for idx in range(len(self._pending_patches) - 1, -1, -1):
+                existing = self._pending_patches[idx]
+                existing_path = existing.get('path', '')
+                if existing_path == path:
+                    if existing.get('op') in ('add', 'replace'):
+                        op = ('add' if 'add' in (existing['op'], patch['op'])
+                              else 'replace')
+                        self._pending_patches[idx] = dict(patch, op=op)
+                        return True
+                    break
+                elif (existing_path.startswith(path + '/')
+                      or path.startswith(existing_path + '/')):
+                    break
+
+        self._pending_patches.append(patch)
+        return True
+
     def patch(self, patches, ironic=None, **kwargs):
         """Apply JSON patches to a node.
 
@@ -426,6 +546,19 @@ class NodeInfo(object):
             if patch.get('path') and not patch['path'].startswith('/'):
                 patch['path'] = '/' + patch['path']
 
+        if self._pending_patches is not None:
+            if not kwargs:
+                for idx, patch in enumerate(patches):
+                    if not self._queue_patch(patch):
+                        # Send what cannot be tracked locally right away
+                        self._pending_patches.extend(patches[idx:])
+                        self._flush_updates(ironic)
+                        break
+                return
+
+            # Extra arguments apply to the whole update, send it separately
+            self._flush_updates(ironic)
+
         LOG.debug('Updating node with patches %s', patches, node_info=self)
         self._node = ironic.node.update(self.uuid, patches, **kwargs)
 
@@ -477,6 +610,12 @@ class NodeInfo(object):
         :param trait: trait to add
         :param ironic: Ironic client to use instead of self.ironic
         """
+        if self._pending_traits is not None:
+            self._pending_traits.append(('add', trait))
+        else:
+            self._add_trait(trait, ironic)
+
+    def _add_trait(self, trait, ironic=None):
         ironic = ironic or self.ironic
         ironic.node.add_trait(self.uuid, trait)
 
@@ -486,6 +625,12 @@ class NodeInfo(object):
         :param trait: trait to add
         :param ironic: Ironic client to use instead of self.ironic
         """
+        if self._pending_traits is not None:
+            self._pending_traits.append(('remove', trait))
+        else:
+            self._remove_trait(trait, ironic)
+
+    def _remove_trait(self, trait, ironic=None):
         ironic = ironic or self.ironic
         try:
             ironic.node.remove_trait(self.uuid, trait)
@@ -551,6 +696,40 @@ class NodeInfo(object):
             self.patch([{'op': op, 'path': path, 'value': value}], ironic)
 
 
+def _apply_patch(node, patch):
+    """Apply a JSON patch to an Ironic node object in place.
+
+    :raises: AttributeError, KeyError, IndexError or TypeError if the patch
+             cannot be applied
+    """
+    parts = [part.replace('~1', '/').replace('~0', '~')
+             for part in patch['path'].strip('/').split('/')]
+    op = patch['op']
+    if op not in ('add', 'replace', 'remove') or not parts[0]:
+        raise KeyError(patch['path'])
+
+    if len(parts) == 1:
+        if op == 'remove':
+            setattr(node, parts[0], None)
+        else:
+            getattr(node, parts[0])
+            setattr(node, parts[0], copy.deepcopy(patch['value']))
+        return
+
+    target = getattr(node, parts[0])
+    for part in parts[1:-1]:
+        target = target[part]
+    if not isinstance(target, dict):
+        raise TypeError(patch['path'])
+
+    if op == 'remove':
+        del target[parts[-1]]
+    elif op == 'replace' and parts[-1] not in target:
+        raise KeyError(patch['path'])
+    else:
+        target[parts[-1]] = copy.deepcopy(patch['value'])
+
+
 def triggers_fsm_error_transition(errors=(Exception,),
                                   no_errors=(utils.NodeStateInvalidEvent,
                                              utils.NodeStateRaceCondition)):
@@ -783,12 +962,16 @@ def _list_node_uuids():
     return {x.uuid for x in db.model_query(db.Node.uuid)}
 
 
-def get_node(node_id, ironic=None, locked=False):
+def get_node(node_id, ironic=None, locked=False, replica=False):
     """Get node from cache.
 
     :param node_id: node UUID or name.
     :param ironic: optional ironic client instance
     :param locked: if True, get a lock on node before fetching its data
+    :param replica: if True, the node may be fetched from the database
+                    replica, see db.get_replica_session. Nodes that are
+                    missing or not finished on the replica are fetched from
+                    the primary database. Ignored if locked.
     :returns: structure NodeInfo.
     """
     if uuidutils.is_uuid_like(node_id):
@@ -805,7 +988,15 @@ def get_node(node_id, ironic=None, locked=False):
         lock = None
 
     try:
-        row = db.model_query(db.Node).filter_by(uuid=uuid).first()
+        row = None
+        if replica and not locked:
+            row = (db.model_query(db.Node, replica=True)
+                   .filter_by(uuid=uuid).first())
+        # NOTE: the replica may lag behind writes made by other processes
+        # (e.g. a conductor starting introspection), so only finished nodes
+        # are taken from it
+        if row is None or row.finished_at is None:
+            row = db.model_query(db.Node).filter_by(uuid=uuid).first()
         if row is None:
             raise utils.Error(_('Could not find node %s in cache') % uuid,
                               code=404)
@@ -929,6 +1120,111 @@ def clean_up():
     return uuids
 
 
+def purge_finished(older_than, batch_size=100, archive=None):
+    """Purge the records of introspections finished before a moment.
+
+    The nodes are purged in batches ordered by UUID, each batch in its own
+    transaction. Nodes locked by this process are skipped until the next
+    run.
+
+    :param older_than: a datetime, records of introspections finished
+                       before it are purged.
+    :param batch_size: number of nodes to purge in one transaction.
+    :param archive: an optional binary file object, the records are written
+                    to it as JSON lines before they are deleted.
+    :returns: number of purged nodes
+    """
+    marker = None
+    purged = 0
+    while True:
+        query = db.model_query(db.Node.uuid).filter(
+            db.Node.finished_at < older_than)
+        if marker is not None:
+            query = query.filter(db.Node.uuid > marker)
+        uuids = [row.uuid for row in
+                 query.order_by(db.Node.uuid).limit(batch_size)]
+        if not uuids:
+            break
+
+        purged += _purge_batch(uuids, older_than, archive)
+        if len(uuids) < batch_size:
+            break
+        marker = uuids[-1]
+
+    return purged
+
+
+def _purge_batch(uuids, older_than, archive=None):
+    locks = []
+    try:
+        for uuid in uuids:
+            lock = _get_lock(uuid)
+            if lock.acquire(False):
+                locks.append((uuid, lock))
+            else:
+                LOG.debug('Node %s is locked, not purging it', uuid)
+        if not locks:
+            return 0
+
+        with db.ensure_transaction() as session:
+            # NOTE: re-check, the introspection may have been restarted
+            rows = db.model_query(db.Node, session=session).filter(
+                db.Node.uuid.in_([uuid for uuid, _lock in locks]),
+                db.Node.finished_at < older_than).all()
+            uuids = [row.uuid for row in rows]
+            if not uuids:
+                return 0
+
+            if archive is not None:
+                _archive_nodes(rows, archive, session)
+
+            db.model_query(db.Attribute, session=session).filter(
+                db.Attribute.node_uuid.in_(uuids)).delete(
+                    synchronize_session=False)
+            for model in (db.Option, db.IntrospectionData, db.Node):
+                db.model_query(model, session=session).filter(
+                    model.uuid.in_(uuids)).delete(synchronize_session=False)
+    finally:
+        for _uuid, lock in locks:
+            lock.release()
+
+    LOG.info('Purged records of finished introspection for nodes %s', uuids)
+    return len(uuids)
+
+
+def _row_to_dict(row):
+    result = {}
+    for column in row.__table__.columns:
+        value = getattr(row, column.name)
+        if isinstance(value, datetime.datetime):
+            value = value.isoformat()
+        result[column.name] = value
+    return result
+
+
+def _archive_nodes(rows, archive, session):
+    """Write the records of nodes to an archive as JSON lines."""
+    uuids = [row.uuid for row in rows]
+    related = collections.defaultdict(lambda: collections.defaultdict(list))
+    for key, model, column in (('attributes', db.Attribute,
+                                db.Attribute.node_uuid),
+                               ('options', db.Option, db.Option.uuid),
+                               ('introspection_data', db.IntrospectionData,
+                                db.IntrospectionData.uuid)):
+        for item in db.model_query(model, session=session).filter(
+                column.in_(uuids)):
+            related[getattr(item, column.key)][key].append(
+                _row_to_dict(item))
+
+    for row in rows:
+        record = {'node': _row_to_dict(row)}
+        for key in ('attributes', 'options', 'introspection_data'):
+            record[key] = related[row.uuid][key]
+        archive.write((json.dumps(record, sort_keys=True) + '\n')
+                      .encode('utf-8'))
+    archive.flush()
+
+
 def create_node(driver, ironic=None, **attributes):
     """Create ironic node and cache it.
 
@@ -957,7 +1253,8 @@ def get_node_list(ironic=None, marker=None, limit=None):
     """Get node list from the cache.
 
     The list of the nodes is ordered based on the (started_at, uuid)
-    attribute pair, newer items first.
+    attribute pair, newer items first. The nodes are fetched from the
+    database replica, see db.get_replica_session.
 
     :param ironic: optional ironic client instance
     :param marker: pagination marker (an UUID or None)
@@ -966,12 +1263,12 @@ def get_node_list(ironic=None, marker=None, limit=None):
     """
     if marker is not None:
         # uuid marker -> row marker for pagination
-        marker = db.model_query(db.Node).get(marker)
+        marker = db.model_query(db.Node, replica=True).get(marker)
         if marker is None:
             raise utils.Error(_('Node not found for marker: %s') % marker,
                               code=404)
 
-    rows = db.model_query(db.Node)
+    rows = db.model_query(db.Node, replica=True)
     # ordered based on (started_at, uuid); newer first
     rows = db_utils.paginate_query(rows, db.Node, limit,
                                    ('started_at', 'uuid'),
@@ -1001,20 +1298,42 @@ def store_introspection_data(node_id, introspection_data, processed=True):
         session.flush()
 
 
-def get_introspection_data(node_id, processed=True):
+def get_introspection_data(node_id, processed=True, fields=None,
+                           get_json=True, replica=False):
     """Get introspection data for this node.
 
     :param node_id: node UUID.
     :param processed: Specify the type of introspected data, set to False
                       indicates retrieving the unprocessed data.
+    :param fields: optional list of paths to select, see
+                   utils.project_data.
+    :param get_json: if False, return the data as a JSON string. Without
+                     fields, the stored string is returned without decoding.
+    :param replica: whether to read from the database replica, see
+                    db.get_replica_session. Only suitable for the API, the
+                    data may be missing or stale.
     :return: A dictionary representation of intropsected data
     """
+    if get_json or fields:
+        column = db.IntrospectionData.data
+    else:
+        # NOTE: skips the JSON decoding by the column type
+        column = sqlalchemy.type_coerce(db.IntrospectionData.data,
+                                        sqlalchemy.Text)
+
     try:
-        ref = db.model_query(db.IntrospectionData).filter_by(
-            uuid=node_id, processed=processed).one()
-        return ref['data']
+        data, = db.model_query(column, replica=replica).filter(
+            db.IntrospectionData.uuid == node_id,
+            db.IntrospectionData.processed == processed).one()
     except orm_errors.NoResultFound:
         msg = _('Introspection data not found for node %(node)s, '
                 'processed=%(processed)s') % {'node': node_id,
                                               'processed': processed}
         raise utils.IntrospectionDataNotFound(msg)
+
+    if fields:
+        data = utils.project_data(data or {}, fields)
+    elif not get_json and data is not None:
+        # already a JSON string
+        return data
+    return data if get_json else json.dumps(data)
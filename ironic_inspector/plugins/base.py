@@ -106,6 +106,20 @@ class RuleConditionPlugin(WithValidation):  # pragma: no cover
     ALLOW_NONE = False
     """Whether this condition accepts None when field is not found."""
 
+    def compile(self, params, **kwargs):
+        """Prepare parameters for repeated checks.
+
+        Called once per condition before it is checked against any nodes.
+        Plugins can override it to parse values or compile expressions in
+        advance. The result is passed to :meth:`check` instead of the stored
+        parameters, so it must be accepted there.
+
+        :param params: parameters as a dictionary, must not be modified
+        :param kwargs: used for extensibility without breaking existing plugins
+        :returns: parameters to pass to :meth:`check`
+        """
+        return params
+
     @abc.abstractmethod
     def check(self, node_info, field, params, **kwargs):
         """Check if condition holds for a given field.
@@ -41,6 +41,8 @@ def _check_existing_nodes(introspection_data, node_driver_info, ironic):
     macs = utils.get_valid_macs(introspection_data)
     if macs:
         # verify existing ports
+        # NOTE: not using the port cache: it may miss a recently created port
+        # or still contain a deleted one, so every MAC needs a lookup anyway
         for mac in macs:
             ports = ironic.port.list(address=mac)
             if not ports:
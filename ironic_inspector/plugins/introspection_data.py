@@ -42,7 +42,8 @@ def _filter_data_excluded_keys(data):
 class BaseStorageBackend(object):
 
     @abc.abstractmethod
-    def get(self, node_uuid, processed=True, get_json=False):
+    def get(self, node_uuid, processed=True, get_json=False, fields=None,
+            replica=False):
         """Get introspected data from storage backend.
 
         :param node_uuid: node UUID.
@@ -50,6 +51,11 @@ class BaseStorageBackend(object):
                           processed or not.
         :param get_json: Specify whether return the introspection data in json
                          format, string value is returned if False.
+        :param fields: optional list of paths to select from the data, each a
+                       tuple of keys, see utils.project_data. Only passed
+                       when set.
+        :param replica: whether stale data from a database replica is
+                        acceptable. Only passed when set.
         :returns: the introspection data.
         :raises: IntrospectionDataStoreDisabled if storage backend is disabled.
         """
@@ -67,7 +73,8 @@ class BaseStorageBackend(object):
 
 
 class NoStore(BaseStorageBackend):
-    def get(self, node_uuid, processed=True, get_json=False):
+    def get(self, node_uuid, processed=True, get_json=False, fields=None,
+            replica=False):
         raise utils.IntrospectionDataStoreDisabled(
             'Introspection data storage is disabled')
 
@@ -77,10 +84,14 @@ class NoStore(BaseStorageBackend):
 
 
 class SwiftStore(object):
-    def get(self, node_uuid, processed=True, get_json=False):
+    def get(self, node_uuid, processed=True, get_json=False, fields=None,
+            replica=False):
         suffix = None if processed else _UNPROCESSED_DATA_STORE_SUFFIX
         LOG.debug('Fetching introspection data from Swift for %s', node_uuid)
         data = swift.get_introspection_data(node_uuid, suffix=suffix)
+        if fields:
+            data = utils.project_data(json.loads(data), fields)
+            return data if get_json else json.dumps(data)
         if get_json:
             return json.loads(data)
         return data
@@ -98,13 +109,14 @@ class SwiftStore(object):
 
 
 class DatabaseStore(object):
-    def get(self, node_uuid, processed=True, get_json=False):
+    def get(self, node_uuid, processed=True, get_json=False, fields=None,
+            replica=False):
         LOG.debug('Fetching introspection data from database for %(node)s',
                   {'node': node_uuid})
-        data = node_cache.get_introspection_data(node_uuid, processed)
-        if get_json:
-            return data
-        return json.dumps(data)
+        return node_cache.get_introspection_data(node_uuid, processed,
+                                                 fields=fields,
+                                                 get_json=get_json,
+                                                 replica=replica)
 
     def save(self, node_uuid, data, processed=True):
         introspection_data = _filter_data_excluded_keys(data)
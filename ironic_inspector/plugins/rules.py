@@ -27,21 +27,41 @@ from ironic_inspector import utils
 LOG = utils.getProcessingLogger(__name__)
 
 
-def coerce(value, expected):
+def _coercion(expected):
     if isinstance(expected, float):
-        return float(value)
+        return float
     elif isinstance(expected, int):
-        return int(value)
-    else:
-        return value
+        return int
+
+
+def coerce(value, expected):
+    coercion = _coercion(expected)
+    return value if coercion is None else coercion(value)
 
 
 class SimpleCondition(base.RuleConditionPlugin):
     op = None
 
+    def compile(self, params, **kwargs):
+        """Compile the parameters.
+
+        The resulting ``_coercion`` parameter is the type the field is
+        converted to before comparing, None if it is compared as is. The rule
+        set index relies on it for equality conditions.
+        """
+        compiled = dict(params)
+        compiled['_coercion'] = _coercion(params['value'])
+        return compiled
+
     def check(self, node_info, field, params, **kwargs):
         value = params['value']
-        return self.op(coerce(field, value), value)
+        try:
+            coercion = params['_coercion']
+        except KeyError:
+            coercion = _coercion(value)
+        if coercion is not None:
+            field = coercion(field)
+        return self.op(field, value)
 
 
 class EqCondition(SimpleCondition):
@@ -85,8 +105,15 @@ class NetCondition(base.RuleConditionPlugin):
         except netaddr.AddrFormatError as exc:
             raise ValueError('invalid value: %s' % exc)
 
+    def compile(self, params, **kwargs):
+        compiled = dict(params)
+        compiled['_network'] = netaddr.IPNetwork(params['value'])
+        return compiled
+
     def check(self, node_info, field, params, **kwargs):
-        network = netaddr.IPNetwork(params['value'])
+        network = params.get('_network')
+        if network is None:
+            network = netaddr.IPNetwork(params['value'])
         return netaddr.IPAddress(field) in network
 
 
@@ -97,18 +124,35 @@ class ReCondition(base.RuleConditionPlugin):
         except re.error as exc:
             raise ValueError(_('invalid regular expression: %s') % exc)
 
+    def _pattern(self, params):
+        return params['value']
+
+    def compile(self, params, **kwargs):
+        compiled = dict(params)
+        compiled['_regexp'] = re.compile(self._pattern(params))
+        return compiled
+
+    def _regexp(self, params):
+        try:
+            return params['_regexp']
+        except KeyError:
+            return re.compile(self._pattern(params))
+
 
 class MatchesCondition(ReCondition):
-    def check(self, node_info, field, params, **kwargs):
+    def _pattern(self, params):
         regexp = params['value']
         if regexp[-1] != '$':
             regexp += '$'
-        return re.match(regexp, str(field)) is not None
+        return regexp
+
+    def check(self, node_info, field, params, **kwargs):
+        return self._regexp(params).match(str(field)) is not None
 
 
 class ContainsCondition(ReCondition):
     def check(self, node_info, field, params, **kwargs):
-        return re.search(params['value'], str(field)) is not None
+        return self._regexp(params).search(str(field)) is not None
 
 
 class FailAction(base.RuleActionPlugin):
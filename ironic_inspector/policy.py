@@ -104,6 +104,7 @@ rule_policies = [
         'rule:is_admin',
         'Get introspection rule(s)',
         [{'path': '/rules', 'method': 'GET'},
+         {'path': '/rules/export', 'method': 'GET'},
          {'path': '/rules/{rule_id}', 'method': 'GET'}]
     ),
     policy.DocumentedRuleDefault(
@@ -119,6 +120,18 @@ rule_policies = [
         'Create introspection rule',
         [{'path': '/rules', 'method': 'POST'}]
     ),
+    policy.DocumentedRuleDefault(
+        'introspection:rule:import',
+        'rule:is_admin',
+        'Replace or merge introspection rules in bulk',
+        [{'path': '/rules', 'method': 'PUT'}]
+    ),
+    policy.DocumentedRuleDefault(
+        'introspection:rule:evaluate',
+        'rule:is_admin',
+        'Check introspection rules against stored introspection data',
+        [{'path': '/rules/evaluate', 'method': 'POST'}]
+    ),
 ]
 
 
@@ -15,8 +15,12 @@
 
 import copy
 import datetime
+import hashlib
+import json
 import os
 
+from eventlet import event
+from eventlet import semaphore
 from oslo_config import cfg
 from oslo_serialization import base64
 from oslo_utils import excutils
@@ -24,6 +28,7 @@ from oslo_utils import timeutils
 
 from ironic_inspector.common.i18n import _
 from ironic_inspector.common import ironic as ir_utils
+from ironic_inspector import db
 from ironic_inspector import introspection_state as istate
 from ironic_inspector import node_cache
 from ironic_inspector.plugins import base as plugins_base
@@ -38,6 +43,106 @@ LOG = utils.getProcessingLogger(__name__)
 _STORAGE_EXCLUDED_KEYS = {'logs'}
 
 
+class _ContinueCache(object):
+    """Short-lived cache of /v1/continue results keyed by payload digest.
+
+    Ramdisks retry submitting introspection data on timeouts. A duplicate
+    of a successfully processed payload gets the original result back
+    without another node look up, while a duplicate arriving when the
+    first submission is still being processed waits for its outcome
+    instead of contending for the node lock.
+    """
+
+    def __init__(self):
+        self._lock = semaphore.Semaphore()
+        # digest -> (expires_at, node uuid, started_at, result)
+        self._results = {}
+        # digest -> eventlet event sent with (result, exception)
+        self._in_flight = {}
+
+    def clear(self):
+        with self._lock:
+            self._results.clear()
+            self._in_flight.clear()
+
+    def _expire(self, now):
+        for digest, entry in list(self._results.items()):
+            if entry[0] <= now:
+                del self._results[digest]
+
+    def process(self, digest, func, *args):
+        """Call func(*args) unless an identical payload was processed.
+
+        :param digest: payload digest.
+        :param func: function processing the payload, must return a tuple
+                     (node_info, result).
+        :returns: processing result.
+        """
+        ttl = CONF.processing.continue_cache_ttl
+        if ttl <= 0:
+            return func(*args)[1]
+
+        with self._lock:
+            self._expire(timeutils.utcnow())
+            cached = self._results.get(digest)
+            pending = self._in_flight.get(digest)
+            if cached is None and pending is None:
+                pending = self._in_flight[digest] = event.Event()
+                owner = True
+            else:
+                owner = False
+
+        if not owner:
+            if cached is not None and self._is_current(cached):
+                LOG.info('Returning result of a previous identical '
+                         'submission for node %s', cached[1])
+                return cached[3]
+            elif cached is None:
+                LOG.debug('Waiting for an identical submission to be '
+                          'processed')
+                result, exc = pending.wait()
+                if exc is not None:
+                    raise exc
+                return result
+            # The node was introspected again since, drop the stale entry
+            with self._lock:
+                if self._results.get(digest) is cached:
+                    del self._results[digest]
+            return self.process(digest, func, *args)
+
+        try:
+            node_info, result = func(*args)
+        except Exception as exc:
+            with self._lock:
+                del self._in_flight[digest]
+            pending.send((None, exc))
+            raise
+
+        expires_at = timeutils.utcnow() + datetime.timedelta(seconds=ttl)
+        with self._lock:
+            self._results[digest] = (expires_at, node_info.uuid,
+                                     node_info.started_at, result)
+            del self._in_flight[digest]
+        pending.send((result, None))
+        return result
+
+    @staticmethod
+    def _is_current(cached):
+        # A cheap primary key query instead of a full look up: make sure
+        # that the cached result belongs to the current introspection.
+        row = (db.model_query(db.Node.started_at)
+               .filter_by(uuid=cached[1]).first())
+        return row is not None and row.started_at == cached[2]
+
+
+_CONTINUE_CACHE = _ContinueCache()
+
+
+def _payload_digest(introspection_data):
+    payload = json.dumps(introspection_data, sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
 def _store_logs(introspection_data, node_info):
     logs = introspection_data.get('logs')
     if not logs:
@@ -155,6 +260,7 @@ def store_introspection_data(node_uuid, data, processed=True):
     ext.save(node_uuid, data, processed)
 
 
+@db.with_request_session
 def _store_unprocessed_data(node_uuid, data):
     # runs in background
     try:
@@ -164,7 +270,8 @@ def _store_unprocessed_data(node_uuid, data):
                       'introspection data for node %s', node_uuid, data=data)
 
 
-def get_introspection_data(uuid, processed=True, get_json=False):
+def get_introspection_data(uuid, processed=True, get_json=False,
+                           fields=None, replica=False):
     """Get introspection data from the storage backend.
 
     :param uuid: node UUID
@@ -172,19 +279,37 @@ def get_introspection_data(uuid, processed=True, get_json=False):
                       set True to request processed introspection data.
     :param get_json: Specify whether return the introspection data in json
                      format, string value is returned if False.
+    :param fields: optional list of paths to select, see
+                   utils.project_data.
+    :param replica: whether the data can be read from a database replica,
+                    only for the read-only API.
     :raises: utils.Error
     """
     introspection_data_manager = plugins_base.introspection_data_manager()
     store = CONF.processing.store_data
     ext = introspection_data_manager[store].obj
-    return ext.get(uuid, processed=processed, get_json=get_json)
+    # NOTE: only passed when set for compatibility with out-of-tree
+    # storage backends
+    kwargs = {}
+    if fields:
+        kwargs['fields'] = fields
+    if replica:
+        kwargs['replica'] = replica
+    return ext.get(uuid, processed=processed, get_json=get_json, **kwargs)
 
 
 def process(introspection_data):
     """Process data from the ramdisk.
 
     This function heavily relies on the hooks to do the actual data processing.
+    Duplicate submissions of the same data are not processed again, see
+    the ``[processing]continue_cache_ttl`` option.
     """
+    digest = _payload_digest(introspection_data)
+    return _CONTINUE_CACHE.process(digest, _process, introspection_data)
+
+
+def _process(introspection_data):
     unprocessed_data = copy.deepcopy(introspection_data)
     failures = []
     _run_pre_hooks(introspection_data, failures)
@@ -242,7 +367,7 @@ def process(introspection_data):
 
     if CONF.processing.always_store_ramdisk_logs:
         _store_logs(introspection_data, node_info)
-    return result
+    return node_info, result
 
 
 def _run_post_hooks(node_info, introspection_data):
@@ -275,6 +400,7 @@ def _process_node(node_info, node, introspection_data):
     return resp
 
 
+@db.with_request_session
 @node_cache.triggers_fsm_error_transition()
 def _finish(node_info, ironic, introspection_data, power_off=True):
     if power_off:
@@ -327,6 +453,7 @@ def reapply(node_uuid, data=None):
     utils.executor().submit(_reapply, node_info, introspection_data=data)
 
 
+@db.with_request_session
 def _reapply(node_info, introspection_data=None):
     # runs in background
     node_info.started_at = timeutils.utcnow()
@@ -17,11 +17,14 @@ import contextlib
 
 from automaton import exceptions as automaton_errors
 from automaton import machines
+from eventlet import event
 from eventlet import semaphore
 from futurist import periodics
+from ironic_lib import metrics_utils
 from oslo_concurrency import lockutils
 from oslo_config import cfg
 from oslo_log import log
+from oslo_utils import timeutils
 import six
 import stevedore
 
@@ -33,6 +36,7 @@ CONF = cfg.CONF
 LOG = log.getLogger(__name__)
 
 _STEVEDORE_DRIVER_NAMESPACE = 'ironic_inspector.pxe_filter'
+_METRICS_PREFIX = 'ironic_inspector.pxe_filter'
 
 
 class InvalidFilterDriverState(RuntimeError):
@@ -83,6 +87,145 @@ def locked_driver_event(event):
     return outer
 
 
+def locked_driver_update(method):
+    """Call driver incremental update method if the driver is initialized.
+
+    Updates are skipped while the driver is not initialized, the initial
+    sync takes care of them.
+    """
+    @six.wraps(method)
+    def inner(self, *args, **kwargs):
+        with self.lock:
+            if self.state != States.initialized:
+                LOG.debug('Skipping %(method)s for the PXE filter driver '
+                          '%(driver)s', {'method': method.__name__,
+                                         'driver': self})
+                return
+            with self.fsm_reset_on_error() as fsm:
+                fsm.process_event(Events.sync)
+                # NOTE: invalidates the data gathered by running syncs
+                self._generation += 1
+                return method(self, *args, **kwargs)
+    return inner
+
+
+def gathered_driver_sync(method):
+    """Call driver sync method with the data gathered without the lock.
+
+    The (slow) reads of the ironic and inspector state are done by the
+    driver's _gather() method before the driver lock is taken; concurrent
+    callers share a gather in flight. The method is then called locked,
+    having processed the sync event, as method(self, ironic, gathered)
+    where gathered is a Gathered instance. If the driver was updated or
+    reset while gathering, the data is gathered again under the lock.
+    """
+    @six.wraps(method)
+    def inner(self, ironic):
+        gathered = None
+        if self.state == States.initialized:
+            gathered = self._shared_gather(ironic)
+        with self.lock, self.fsm_reset_on_error() as fsm:
+            fsm.process_event(Events.sync)
+            if gathered is None or gathered.generation != self._generation:
+                LOG.debug('Gathering the data for the PXE filter driver %s '
+                          'under the lock', self)
+                gathered = self._gather_timed(ironic)
+            elif gathered.sequence < self._applied_sequence:
+                LOG.debug('Skipping the sync of the PXE filter driver %s, '
+                          'a more recent gather was already applied', self)
+                return
+            self._applied_sequence = gathered.sequence
+            return method(self, ironic, gathered)
+    return inner
+
+
+class Gathered(object):
+    """The data gathered for a sync.
+
+    :ivar data: the driver specific data returned by its _gather() method.
+    :ivar timings: a dict phase name -> seconds spent in the phase.
+    :ivar generation: the driver generation when the gather started.
+    :ivar sequence: the sequence number of the gather.
+    """
+
+    def __init__(self, data, timings, generation, sequence):
+        self.data = data
+        self.timings = timings
+        self.generation = generation
+        self.sequence = sequence
+
+
+class SyncStats(object):
+    """Telemetry of a single PXE filter synchronization.
+
+    :ivar timings: a dict phase name -> seconds spent in the phase.
+    :ivar added: the number of MACs added to the blacklist.
+    :ivar removed: the number of MACs removed from the blacklist.
+    :ivar changed: whether the filter was updated at all.
+    :ivar drift: the number of MACs which actual state differed from the
+        expected one, None if the state was not verified.
+    """
+
+    def __init__(self):
+        self.timings = {}
+        self.added = 0
+        self.removed = 0
+        self.changed = False
+        self.drift = None
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        """Measure the time spent in a phase of the synchronization."""
+        watch = timeutils.StopWatch()
+        watch.start()
+        try:
+            yield
+        finally:
+            self.timings[name] = (self.timings.get(name, 0) +
+                                  watch.elapsed())
+
+    def record(self, added=0, removed=0):
+        """Record an update of the filter."""
+        self.added += added
+        self.removed += removed
+        self.changed = True
+
+
+@contextlib.contextmanager
+def sync_stats(driver):
+    """Collect telemetry of a synchronization and report it as metrics.
+
+    The timings of the phases are sent as timers, the numbers of MACs added
+    and removed as counters, the drift found by a verification as a gauge.
+
+    :param driver: name of the driver, used in the metric names.
+    :returns: a context manager yielding a SyncStats instance.
+    """
+    stats = SyncStats()
+    try:
+        yield stats
+    except Exception:
+        result = 'failed'
+        raise
+    else:
+        result = 'changed' if stats.changed else 'noop'
+    finally:
+        LOG.debug('The PXE filter %(driver)s sync %(result)s: %(added)d '
+                  'MAC(s) added, %(removed)d removed, timings %(timings)s',
+                  {'driver': driver, 'result': result, 'added': stats.added,
+                   'removed': stats.removed, 'timings': stats.timings})
+        metrics = metrics_utils.get_metrics_logger(
+            '%s.%s' % (_METRICS_PREFIX, driver))
+        for phase, elapsed in stats.timings.items():
+            # NOTE: timers are in milliseconds
+            metrics.send_timer('sync.%s' % phase, elapsed * 1000)
+        metrics.send_counter('sync.macs_added', stats.added)
+        metrics.send_counter('sync.macs_removed', stats.removed)
+        metrics.send_counter('sync.%s' % result, 1)
+        if stats.drift is not None:
+            metrics.send_gauge('drift', stats.drift)
+
+
 class BaseFilter(interface.FilterDriver):
     """The generic PXE boot filtering interface implementation.
 
@@ -98,6 +241,13 @@ class BaseFilter(interface.FilterDriver):
         super(BaseFilter, self).__init__()
         self.lock = semaphore.BoundedSemaphore()
         self.fsm.initialize(start_state=States.uninitialized)
+        # Incremented on every update of the driver state that is not a
+        # (full) sync, see gathered_driver_sync
+        self._generation = 0
+        self._sequence = 0
+        self._applied_sequence = 0
+        # An eventlet event of the gather in flight
+        self._flight = None
 
     def __str__(self):
         return '%(driver)s, state=%(state)s' % {
@@ -119,9 +269,60 @@ class BaseFilter(interface.FilterDriver):
         :returns: nothing.
         """
         LOG.debug('Resetting the PXE filter driver %s', self)
+        self._generation += 1
         # a reset event is always possible
         self.fsm.process_event(Events.reset)
 
+    def _gather(self, ironic, stats):
+        """Gather the data for a sync. Not locked.
+
+        Drivers using the gathered_driver_sync decorator have to override
+        this method. It must not modify the driver state.
+
+        :param ironic: an ironic client instance.
+        :param stats: a SyncStats instance to record the phases to.
+        :returns: driver specific data.
+        """
+
+    def _gather_timed(self, ironic):
+        """Call _gather() and record its timings.
+
+        :param ironic: an ironic client instance.
+        :returns: a Gathered instance.
+        """
+        generation = self._generation
+        self._sequence += 1
+        sequence = self._sequence
+        stats = SyncStats()
+        data = self._gather(ironic, stats)
+        return Gathered(data, stats.timings, generation, sequence)
+
+    def _shared_gather(self, ironic):
+        """Gather the data for a sync, or join a gather in flight.
+
+        :param ironic: an ironic client instance.
+        :returns: a Gathered instance.
+        """
+        flight = self._flight
+        if flight is not None:
+            LOG.debug('Joining the gather in flight of the PXE filter '
+                      'driver %s', self)
+            return flight.wait()
+
+        # NOTE: no green thread switch is possible between the check and
+        # setting the flight
+        self._flight = flight = event.Event()
+        try:
+            gathered = self._gather_timed(ironic)
+        except Exception as e:
+            flight.send_exception(e)
+            raise
+        else:
+            flight.send(gathered)
+            return gathered
+        finally:
+            self._flight = None
+
     @contextlib.contextmanager
     def fsm_reset_on_error(self):
         """Reset the filter driver upon generic exception.
@@ -202,6 +403,12 @@ class BaseFilter(interface.FilterDriver):
 class NoopFilter(BaseFilter):
     """A trivial PXE boot filter."""
 
+    def on_introspection_started(self, macs, ironic=None):
+        """Nothing to update."""
+
+    def on_introspection_finished(self, macs, ironic=None):
+        """Nothing to update."""
+
 
 _DRIVER_MANAGER = None
 
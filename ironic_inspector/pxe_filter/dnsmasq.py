@@ -18,6 +18,10 @@
 #
 # [1] see the --dhcp-hostsdir option description in
 #     http://www.thekelleys.org.uk/dnsmasq/docs/dnsmasq-man.html
+#
+# In the hostsfile mode all the records are kept in a single file instead,
+# exposed through the --dhcp-hostsfile option. The file is replaced atomically
+# and dnsmasq is made to re-read it, typically with the SIGHUP signal.
 
 
 try:
@@ -34,6 +38,7 @@ from oslo_log import log
 from oslo_utils import timeutils
 
 from ironic_inspector.common import ironic as ir_utils
+from ironic_inspector.common import port_cache
 from ironic_inspector import node_cache
 from ironic_inspector.pxe_filter import base as pxe_filter
 
@@ -49,6 +54,14 @@ _MACWL_LEN = len('ff:ff:ff:ff:ff:ff\n')
 _UNKNOWN_HOSTS_FILE = 'unknown_hosts_filter'
 _BLACKLIST_UNKNOWN_HOSTS = '*:*:*:*:*:*,ignore\n'
 _WHITELIST_UNKNOWN_HOSTS = '*:*:*:*:*:*\n'
+# States of the MAC records in the dhcp_hostsdir or dhcp_hostsfile
+_BLACKLISTED = 'blacklisted'
+_WHITELISTED = 'whitelisted'
+_HOSTSFILE_MODE = 'hostsfile'
+
+
+def _hostsfile_mode():
+    return CONF.dnsmasq_pxe_filter.mode == _HOSTSFILE_MODE
 
 
 def _should_enable_unknown_hosts():
@@ -68,65 +81,235 @@ class DnsmasqFilter(pxe_filter.BaseFilter):
     through amending its configuration.
     """
 
+    def __init__(self):
+        super(DnsmasqFilter, self).__init__()
+        # MAC -> _BLACKLISTED or _WHITELISTED, mirrors the dhcp_hostsdir
+        # or the dhcp_hostsfile
+        self._records = None
+        self._verified_at = None
+        # the hostsfile mode only: the unknown hosts record in the file and
+        # whether the records changed since the file was last written
+        self._unknown_hosts = None
+        self._dirty = False
+
     def reset(self):
         """Stop dnsmasq and upcall reset."""
         _execute(CONF.dnsmasq_pxe_filter.dnsmasq_stop_command,
                  ignore_errors=True)
+        self._records = None
+        self._unknown_hosts = None
+        self._dirty = False
         super(DnsmasqFilter, self).reset()
 
-    def _sync(self, ironic):
+    def _load_records(self):
+        """Rebuild the in-memory records from the dhcp_hostsdir.
+
+        Or from the dhcp_hostsfile in the hostsfile mode.
+
+        :raises: FileNotFoundError in case the dhcp_hostsdir is invalid.
+        :returns: the number of records which drifted from the expected
+            state, None if the records were not known.
+        """
+        if _hostsfile_mode():
+            blacklist, whitelist, self._unknown_hosts = _read_hostsfile()
+        else:
+            blacklist, whitelist = _get_black_white_lists()
+        records = dict.fromkeys(blacklist, _BLACKLISTED)
+        records.update(dict.fromkeys(whitelist, _WHITELISTED))
+        drift = None
+        if self._records is not None:
+            drift = len({mac for mac, state in
+                         set(records.items()).symmetric_difference(
+                             self._records.items())})
+            if drift:
+                LOG.warning('The dnsmasq records drifted from the expected '
+                            'state for %d MAC(s), repairing', drift)
+        self._records = records
+        self._dirty = False
+        self._verified_at = timeutils.utcnow()
+        return drift
+
+    def _need_load(self):
+        if self._records is None:
+            return True
+        # NOTE: the directory may be shared with other inspector processes,
+        # in this case it is not in our exclusive control.
+        if (not _hostsfile_mode() and
+                not CONF.dnsmasq_pxe_filter.purge_dhcp_hostsdir):
+            return True
+        interval = CONF.dnsmasq_pxe_filter.verify_interval
+        return bool(interval) and timeutils.is_older_than(self._verified_at,
+                                                          interval)
+
+    def _gather(self, ironic, stats):
+        """Get the inspector and ironic state. Not locked.
+
+        :param ironic: an ironic client instance.
+        :param stats: a SyncStats instance.
+        :returns: a tuple (active MACs, ironic MACs, whether to enable
+            unknown hosts).
+        """
+        with stats.phase('fetch'):
+            # active_macs are the MACs for which introspection is active
+            active_macs = node_cache.active_macs()
+            # ironic_macs are all the MACs know to ironic (all ironic ports)
+            ironic_macs = port_cache.refresh(ironic).macs()
+            return (active_macs, ironic_macs,
+                    _should_enable_unknown_hosts())
+
+    def _sync(self, ironic, gathered=None, reload=True):
         """Sync the inspector, ironic and dnsmasq state. Locked.
 
+        Only the records which state differs from the desired one are
+        written to the dhcp_hostsdir. In the hostsfile mode, the
+        dhcp_hostsfile is only rewritten if any record changed.
+
+        :param ironic: an ironic client instance.
+        :param gathered: a Gathered instance, the data is gathered now if
+            not provided.
+        :param reload: whether to reload dnsmasq after the dhcp_hostsfile
+            is rewritten, see _apply.
         :raises: IOError, OSError.
         :returns: None.
         """
         LOG.debug('Syncing the driver')
         timestamp_start = timeutils.utcnow()
 
-        # active_macs are the MACs for which introspection is active
-        active_macs = node_cache.active_macs()
-        # ironic_macs are all the MACs know to ironic (all ironic ports)
-        ironic_macs = set(port.address for port in
-                          ir_utils.call_with_retries(ironic.port.list, limit=0,
-                                                     fields=['address']))
-        blacklist, whitelist = _get_black_white_lists()
-        # removedlist are the MACs that are in either blacklist or whitelist,
-        # but not kept in ironic (ironic_macs) any more
-        removedlist = blacklist.union(whitelist).difference(ironic_macs)
-
-        # Whitelist active MACs that are not already whitelisted
-        for mac in active_macs.difference(whitelist):
-            _whitelist_mac(mac)
-        # Blacklist any ironic MACs that is not active for introspection unless
-        # it is already blacklisted
-        for mac in ironic_macs.difference(blacklist.union(active_macs)):
-            _blacklist_mac(mac)
-
-        # Whitelist or Blacklist unknown hosts and MACs not kept in ironic
-        # NOTE(hjensas): Treat unknown hosts and MACs not kept in ironic the
-        # same. Neither should boot the inspection image unless introspection
-        # is active. Deleted MACs must be whitelisted when introspection is
-        # active in case the host is re-enrolled.
-        _configure_unknown_hosts()
-        _configure_removedlist(removedlist)
+        if gathered is None:
+            gathered = self._gather_timed(ironic)
+        active_macs, ironic_macs, enable_unknown_hosts = gathered.data
+
+        with pxe_filter.sync_stats('dnsmasq') as stats:
+            stats.timings.update(gathered.timings)
+            with stats.phase('compute'):
+                if self._need_load():
+                    stats.drift = self._load_records()
+
+                # NOTE(hjensas): Treat unknown hosts and MACs not kept in
+                # ironic the same. Neither should boot the inspection image
+                # unless introspection is active. Deleted MACs must be
+                # whitelisted when introspection is active in case the host
+                # is re-enrolled.
+                removed_state = (_WHITELISTED if enable_unknown_hosts
+                                 else _BLACKLISTED)
+                desired = dict.fromkeys(
+                    set(self._records).difference(ironic_macs),
+                    removed_state)
+                # Blacklist any ironic MACs that is not active for
+                # introspection
+                desired.update(dict.fromkeys(ironic_macs, _BLACKLISTED))
+                # Whitelist active MACs
+                desired.update(dict.fromkeys(active_macs, _WHITELISTED))
+                changed = {mac: state for mac, state in desired.items()
+                           if self._records.get(mac) != state}
+                to_whitelist = [mac for mac, state in changed.items()
+                                if state == _WHITELISTED]
+                to_blacklist = [mac for mac, state in changed.items()
+                                if state == _BLACKLISTED]
+
+            with stats.phase('apply'):
+                # NOTE: a failed write is retried on the next sync
+                self._set_records(to_whitelist, _WHITELISTED)
+                self._set_records(to_blacklist, _BLACKLISTED)
+                self._apply(reload=reload)
+            if changed:
+                stats.record(added=len(to_blacklist),
+                             removed=len(to_whitelist))
 
         timestamp_end = timeutils.utcnow()
         LOG.debug('The dnsmasq PXE filter was synchronized (took %s)',
                   timestamp_end - timestamp_start)
 
-    @pxe_filter.locked_driver_event(pxe_filter.Events.sync)
-    def sync(self, ironic):
+    def _set_records(self, macs, state):
+        if self._records is None:
+            self._load_records()
+        if _hostsfile_mode():
+            # NOTE: written all at once by _apply
+            for mac in macs:
+                if self._records.get(mac) != state:
+                    self._records[mac] = state
+                    self._dirty = True
+            return
+
+        write = _whitelist_mac if state == _WHITELISTED else _blacklist_mac
+        for mac in macs:
+            if self._records.get(mac) != state and write(mac):
+                self._records[mac] = state
+
+    def _apply(self, reload=True):
+        """Make dnsmasq use the current records.
+
+        Manages the unknown hosts record in the dhcp_hostsdir mode. In the
+        hostsfile mode, replaces the dhcp_hostsfile with the records and
+        reloads dnsmasq, unless nothing changed.
+
+        :param reload: whether to reload dnsmasq, False if it is not
+            running yet.
+        :raises: OSError, IOError, ProcessExecutionError.
+        :returns: None.
+        """
+        if not _hostsfile_mode():
+            _configure_unknown_hosts()
+            return
+
+        unknown_hosts = (_WHITELIST_UNKNOWN_HOSTS
+                         if _should_enable_unknown_hosts()
+                         else _BLACKLIST_UNKNOWN_HOSTS)
+        if not self._dirty and unknown_hosts == self._unknown_hosts:
+            LOG.debug('Not updating the dhcp_hostsfile - no changes')
+            return
+
+        try:
+            _write_hostsfile(self._records, unknown_hosts)
+        except Exception:
+            # Force reload of the records on the next attempt
+            self._records = None
+            raise
+        self._dirty = False
+        self._unknown_hosts = unknown_hosts
+        if reload:
+            _execute(CONF.dnsmasq_pxe_filter.dnsmasq_reload_command)
+
+    @pxe_filter.locked_driver_update
+    def on_introspection_started(self, macs, ironic=None):
+        """Whitelist the MACs of a node on introspection. Locked.
+
+        :param macs: an iterable of MACs of the node's ports.
+        :param ironic: ignored.
+        :raises: OSError, IOError.
+        :returns: None.
+        """
+        self._set_records(macs, _WHITELISTED)
+        self._apply()
+
+    @pxe_filter.locked_driver_update
+    def on_introspection_finished(self, macs, ironic=None):
+        """Blacklist the MACs of a node after introspection. Locked.
+
+        :param macs: an iterable of MACs of the node's ports.
+        :param ironic: ignored.
+        :raises: OSError, IOError.
+        :returns: None.
+        """
+        # NOTE: the same MAC may still be in use by a node on introspection
+        self._set_records(set(macs).difference(node_cache.active_macs()),
+                          _BLACKLISTED)
+        self._apply()
+
+    @pxe_filter.gathered_driver_sync
+    def sync(self, ironic, gathered):
         """Sync dnsmasq configuration with current Ironic&Inspector state.
 
         Polls all ironic ports. Those being inspected, the active ones, are
         whitelisted while the rest are blacklisted in the dnsmasq
-        configuration.
+        configuration. Only the records are updated under the lock.
 
         :param ironic: an ironic client instance.
+        :param gathered: the Gathered data, see gathered_driver_sync.
         :raises: OSError, IOError.
         :returns: None.
         """
-        self._sync(ironic)
+        self._sync(ironic, gathered)
 
     @pxe_filter.locked_driver_event(pxe_filter.Events.initialize)
     def init_filter(self):
@@ -136,12 +319,28 @@ class DnsmasqFilter(pxe_filter.BaseFilter):
         some inotify blacklist events by prefetching the blacklist before
         the dnsmasq is started.
 
+        In the hostsfile mode, the dhcp_hostsfile is rewritten from scratch
+        and dnsmasq is started without being reloaded first.
+
         :raises: OSError, IOError.
         :returns: None.
         """
-        _purge_dhcp_hostsdir()
+        if _hostsfile_mode():
+            if not CONF.dnsmasq_pxe_filter.dnsmasq_reload_command:
+                LOG.warning('The dnsmasq_reload_command option is not set, '
+                            'dnsmasq will not pick up the changes to the '
+                            'dhcp_hostsfile %s until it is restarted',
+                            CONF.dnsmasq_pxe_filter.dhcp_hostsfile)
+            self._records = {}
+            self._unknown_hosts = None
+            self._dirty = True
+            self._verified_at = timeutils.utcnow()
+        else:
+            _purge_dhcp_hostsdir()
+            self._load_records()
         ironic = ir_utils.get_client()
-        self._sync(ironic)
+        # NOTE: dnsmasq is not running yet, it reads the file on start
+        self._sync(ironic, reload=False)
         _execute(CONF.dnsmasq_pxe_filter.dnsmasq_start_command)
         LOG.info('The dnsmasq PXE filter was initialized')
 
@@ -177,14 +376,72 @@ def _get_black_white_lists():
     blacklist = set()
     whitelist = set()
     for mac in os.listdir(hostsdir):
-        if os.stat(os.path.join(hostsdir, mac)).st_size == _MACBL_LEN:
+        size = os.stat(os.path.join(hostsdir, mac)).st_size
+        if size == _MACBL_LEN:
             blacklist.add(mac)
-        if os.stat(os.path.join(hostsdir, mac)).st_size == _MACWL_LEN:
+        elif size == _MACWL_LEN:
             whitelist.add(mac)
 
     return blacklist, whitelist
 
 
+def _read_hostsfile():
+    """Get addresses currently black- and white-listed in the dhcp_hostsfile.
+
+    :raises: IOError in case the dhcp_hostsfile isn't readable.
+    :returns: a tuple (blacklist, whitelist, unknown hosts record or None).
+        A missing file is treated as an empty one.
+    """
+    blacklist = set()
+    whitelist = set()
+    unknown_hosts = None
+    try:
+        with open(CONF.dnsmasq_pxe_filter.dhcp_hostsfile, 'r') as f:
+            lines = f.readlines()
+    except (IOError, OSError) as e:
+        if e.errno != errno.ENOENT:
+            raise
+        return blacklist, whitelist, unknown_hosts
+
+    for line in lines:
+        if line in (_BLACKLIST_UNKNOWN_HOSTS, _WHITELIST_UNKNOWN_HOSTS):
+            unknown_hosts = line
+        elif line.endswith(',ignore\n'):
+            blacklist.add(line[:-len(',ignore\n')])
+        elif line.strip():
+            whitelist.add(line.strip())
+
+    return blacklist, whitelist, unknown_hosts
+
+
+def _write_hostsfile(records, unknown_hosts):
+    """Atomically replace the dhcp_hostsfile.
+
+    The content is written to a temporary file in the same directory, which
+    is then renamed over the dhcp_hostsfile, so that dnsmasq never reads a
+    partially written file.
+
+    :param records: a dict MAC -> _BLACKLISTED or _WHITELISTED.
+    :param unknown_hosts: the record for all unknown hosts.
+    :raises: IOError, OSError.
+    :returns: None.
+    """
+    path = CONF.dnsmasq_pxe_filter.dhcp_hostsfile
+    tmp_path = '%s.tmp' % path
+    lines = ['%s,ignore\n' % mac if state == _BLACKLISTED else '%s\n' % mac
+             for mac, state in sorted(records.items())]
+    # NOTE: dnsmasq prefers the records with the fewest wildcards, the
+    # position of the unknown hosts record doesn't matter
+    lines.append(unknown_hosts)
+    with open(tmp_path, 'w') as f:
+        f.writelines(lines)
+        f.flush()
+        os.fsync(f.fileno())
+    os.rename(tmp_path, path)
+    LOG.debug('Wrote %(count)d records to %(path)s',
+              {'count': len(records), 'path': path})
+
+
 def _exclusive_write_or_pass(path, buf):
     """Write exclusively or pass if path locked.
 
@@ -224,25 +481,6 @@ def _exclusive_write_or_pass(path, buf):
     return False
 
 
-def _configure_removedlist(macs):
-    """Manages a dhcp_hostsdir ignore/not-ignore record for removed macs
-
-    :raises: FileNotFoundError in case the dhcp_hostsdir is invalid,
-    :returns: None.
-    """
-
-    hostsdir = CONF.dnsmasq_pxe_filter.dhcp_hostsdir
-
-    if _should_enable_unknown_hosts():
-        for mac in macs:
-            if os.stat(os.path.join(hostsdir, mac)).st_size != _MACWL_LEN:
-                _whitelist_mac(mac)
-    else:
-        for mac in macs:
-            if os.stat(os.path.join(hostsdir, mac)).st_size != _MACBL_LEN:
-                _blacklist_mac(mac)
-
-
 def _configure_unknown_hosts():
     """Manages a dhcp_hostsdir ignore/not-ignore record for unknown macs.
 
@@ -281,14 +519,16 @@ def _blacklist_mac(mac):
 
     :raises: FileNotFoundError in case the dhcp_hostsdir is invalid,
              IOError in case the dhcp host MAC file isn't writable.
-    :returns: None.
+    :returns: True if the record was written.
     """
     path = os.path.join(CONF.dnsmasq_pxe_filter.dhcp_hostsdir, mac)
     if _exclusive_write_or_pass(path, '%s,ignore\n' % mac):
         LOG.debug('Blacklisted %s', mac)
+        return True
     else:
         LOG.warning('Failed to blacklist %s; retrying next periodic sync '
                     'time', mac)
+        return False
 
 
 def _whitelist_mac(mac):
@@ -296,15 +536,17 @@ def _whitelist_mac(mac):
 
     :raises: FileNotFoundError in case the dhcp_hostsdir is invalid,
              IOError in case the dhcp host MAC file isn't writable.
-    :returns: None.
+    :returns: True if the record was written.
     """
     path = os.path.join(CONF.dnsmasq_pxe_filter.dhcp_hostsdir, mac)
     # remove the ,ignore directive
     if _exclusive_write_or_pass(path, '%s\n' % mac):
         LOG.debug('Whitelisted %s', mac)
+        return True
     else:
         LOG.warning('Failed to whitelist %s; retrying next periodic sync '
                     'time', mac)
+        return False
 
 
 def _execute(cmd=None, ignore_errors=False):
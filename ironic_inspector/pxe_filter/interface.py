@@ -17,6 +17,8 @@ import abc
 
 import six
 
+from ironic_inspector.common import ironic as ir_utils
+
 
 @six.add_metaclass(abc.ABCMeta)
 class FilterDriver(object):
@@ -46,6 +48,36 @@ class FilterDriver(object):
         :returns: nothing.
         """
 
+    def on_introspection_started(self, macs, ironic=None):
+        """Allow the MACs of a node, which introspection has started.
+
+        Called right after the introspection was started for a node, so that
+        the node can PXE boot without waiting for the next sync. Drivers
+        should only update the state related to the provided MACs and leave
+        the full reconciliation to the sync method.
+
+        The default implementation runs a full sync.
+
+        :param macs: an iterable of MACs of the node's ports.
+        :param ironic: an optional ironic client instance.
+        :returns: nothing.
+        """
+        self.sync(ironic or ir_utils.get_client())
+
+    def on_introspection_finished(self, macs, ironic=None):
+        """Disallow the MACs of a node, which introspection has finished.
+
+        Called after the introspection of a node finished, failed or was
+        aborted. See on_introspection_started for details.
+
+        The default implementation runs a full sync.
+
+        :param macs: an iterable of MACs of the node's ports.
+        :param ironic: an optional ironic client instance.
+        :returns: nothing.
+        """
+        self.sync(ironic or ir_utils.get_client())
+
     @abc.abstractmethod
     def tear_down_filter(self):
         """Reset the filter.
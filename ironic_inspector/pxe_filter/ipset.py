@@ -0,0 +1,175 @@
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""An ipset-backed PXE boot filter.
+
+Works like the iptables filter, but the blacklisted MACs are kept in a
+``hash:mac`` ipset referenced by a single iptables rule, so that matching a
+DHCP packet does not depend on the number of blacklisted MACs, and a sync
+only adds and removes the MACs that have changed.
+"""
+
+from oslo_concurrency import processutils
+from oslo_config import cfg
+from oslo_log import log
+
+from ironic_inspector.common import ironic as ir_utils
+from ironic_inspector.pxe_filter import base as pxe_filter
+from ironic_inspector.pxe_filter import iptables
+
+
+CONF = cfg.CONF
+LOG = log.getLogger(__name__)
+
+
+class IpsetFilter(iptables.IptablesFilter):
+    """A PXE boot filtering interface implementation using ipset."""
+
+    def __init__(self):
+        super(IpsetFilter, self).__init__()
+        self.set_name = CONF.iptables.ipset_name
+        self.ipset_command = ('sudo', 'ironic-inspector-rootwrap',
+                              CONF.rootwrap_config, 'ipset')
+
+    def reset(self):
+        # NOTE: the set can only be destroyed once no rule references it
+        super(IpsetFilter, self).reset()
+        try:
+            self._ipset('destroy', self.set_name, ignore=True)
+        except Exception as e:
+            LOG.exception('Encountered exception resetting filter: %s', e)
+
+    def _init_filter(self):
+        super(IpsetFilter, self)._init_filter()
+        self._ipset('create', self.set_name, 'hash:mac', '-exist')
+        self._ipset('flush', self.set_name)
+        LOG.debug('The ipset %s was initialized', self.set_name)
+
+    def _sync(self, ironic, gathered=None):
+        if gathered is None:
+            gathered = self._gather_timed(ironic)
+        enable_dhcp, to_blacklist = gathered.data
+
+        with pxe_filter.sync_stats('ipset') as stats:
+            stats.timings.update(gathered.timings)
+            if not enable_dhcp:
+                self._disable_dhcp(stats)
+                return
+
+            self._verify(stats)
+            to_blacklist = set(to_blacklist)
+            if self.enabled and self.blacklist_cache is not None:
+                if to_blacklist == self.blacklist_cache:
+                    LOG.debug('Not updating ipset - no changes in MAC list '
+                              '%s', to_blacklist)
+                    return
+
+                to_add = to_blacklist - self.blacklist_cache
+                to_delete = self.blacklist_cache - to_blacklist
+                with stats.phase('apply'):
+                    self._restore_set([('add', mac) for mac in to_add] +
+                                      [('del', mac) for mac in to_delete])
+                self.blacklist_cache = to_blacklist
+                stats.record(added=len(to_add), removed=len(to_delete))
+                LOG.debug('The ipset filter was synchronized')
+                return
+
+            LOG.debug('Blacklisting active MAC\'s %s', to_blacklist)
+            # Force update on the next iteration if this attempt fails
+            self.blacklist_cache = None
+            with stats.phase('apply'):
+                self._restore_set([('flush',)] +
+                                  [('add', mac) for mac in to_blacklist])
+                self._restore_chain([
+                    # - Blacklist active macs, so that nova can boot them
+                    ('-A', self.chain, '-m', 'set', '--match-set',
+                     self.set_name, 'src', '-j', 'DROP'),
+                    # - Whitelist everything else
+                    ('-A', self.chain, '-j', 'ACCEPT'),
+                ])
+
+            self.enabled = True
+            self.blacklist_cache = to_blacklist
+            stats.record(added=len(to_blacklist))
+            LOG.debug('The ipset filter was synchronized')
+
+    def _get_actual_blacklist(self):
+        """Get the MACs currently in the set.
+
+        :returns: a set of lower case MACs.
+        """
+        out, _err = processutils.execute(*(self.ipset_command +
+                                           ('save', self.set_name)))
+        macs = set()
+        for line in out.splitlines():
+            args = line.split()
+            if len(args) >= 3 and args[0] == 'add':
+                macs.add(args[2].lower())
+        return macs
+
+    def _update_blacklist(self, action, macs, ironic):
+        """Add (-I) or remove (-D) MACs to or from the set.
+
+        Falls back to a full sync on failure.
+        """
+        command = 'add' if action == '-I' else 'del'
+        try:
+            self._restore_set([(command, mac) for mac in macs])
+        except processutils.ProcessExecutionError:
+            LOG.warning('Incremental update of the ipset filter failed, '
+                        'falling back to a full sync')
+            self.blacklist_cache = None
+            self._sync(ironic or ir_utils.get_client())
+            return
+
+        if command == 'add':
+            self.blacklist_cache = self.blacklist_cache.union(macs)
+        else:
+            self.blacklist_cache = self.blacklist_cache.difference(macs)
+        LOG.debug('The ipset filter was updated for MAC\'s %s', macs)
+
+    def _restore_set(self, commands):
+        """Apply set commands with a single ipset restore call.
+
+        :param commands: a list of tuples (command, [argument]) to run
+            against the set.
+        """
+        if not commands:
+            return
+
+        payload = ''.join('%s\n' % ' '.join((command[0], self.set_name) +
+                                            tuple(command[1:]))
+                          for command in commands)
+        LOG.debug('Running ipset restore with %d commands', len(commands))
+        try:
+            processutils.execute(*(self.ipset_command + ('restore',
+                                                         '-exist')),
+                                 process_input=payload)
+        except processutils.ProcessExecutionError as exc:
+            LOG.error('ipset restore failed: %s', exc)
+            raise
+
+    def _ipset(self, *args, **kwargs):
+        cmd = self.ipset_command + args
+        ignore = kwargs.pop('ignore', False)
+        LOG.debug('Running ipset %s', args)
+        try:
+            processutils.execute(*cmd)
+        except processutils.ProcessExecutionError as exc:
+            if ignore:
+                LOG.debug('Ignoring failed ipset %(args)s: %(error)s',
+                          {'args': args, 'error': exc})
+            else:
+                LOG.error('ipset %(args)s failed: %(error)s',
+                          {'args': args, 'error': exc})
+                raise
@@ -11,15 +11,17 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-import contextlib
+import copy
 import os
 import re
 
 from oslo_concurrency import processutils
 from oslo_config import cfg
 from oslo_log import log
+from oslo_utils import timeutils
 
 from ironic_inspector.common import ironic as ir_utils
+from ironic_inspector.common import port_cache
 from ironic_inspector import node_cache
 from ironic_inspector.pxe_filter import base as pxe_filter
 
@@ -27,7 +29,11 @@ from ironic_inspector.pxe_filter import base as pxe_filter
 CONF = cfg.CONF
 LOG = log.getLogger(__name__)
 
-_EMAC_REGEX = 'EMAC=([0-9a-f]{2}(:[0-9a-f]{2}){5}) IMAC=.*'
+_NEIGH_REGEX = re.compile(r'EMAC=([0-9a-f]{2}(?::[0-9a-f]{2}){5}) IMAC=(\S+)')
+# The InfiniBand GUID is the last 8 bytes of the IMAC and the client-id
+_GUID_LEN = len('00:00:00:00:00:00:00:00')
+# neighs file path -> ((mtime, content), {GUID: EMAC})
+_NEIGHS_CACHE = {}
 
 
 def _should_enable_dhcp():
@@ -47,6 +53,7 @@ class IptablesFilter(pxe_filter.BaseFilter):
         super(IptablesFilter, self).__init__()
         self.blacklist_cache = None
         self.enabled = True
+        self._verified_at = None
         self.interface = CONF.iptables.dnsmasq_interface
         self.chain = CONF.iptables.firewall_chain
         self.new_chain = self.chain + '_temp'
@@ -55,17 +62,23 @@ class IptablesFilter(pxe_filter.BaseFilter):
         # at this time.
         if CONF.iptables.ip_version == '4':
             self._cmd_iptables = 'iptables'
+            self._cmd_restore = 'iptables-restore'
             self._dhcp_port = '67'
         else:
             self._cmd_iptables = 'ip6tables'
+            self._cmd_restore = 'ip6tables-restore'
             self._dhcp_port = '547'
 
         self.base_command = ('sudo', 'ironic-inspector-rootwrap',
                              CONF.rootwrap_config, self._cmd_iptables)
+        self.restore_command = ('sudo', 'ironic-inspector-rootwrap',
+                                CONF.rootwrap_config, self._cmd_restore,
+                                '--noflush')
 
     def reset(self):
         self.enabled = True
         self.blacklist_cache = None
+        # NOTE: new_chain is only used by previous releases, clean it up too
         for chain in (self.chain, self.new_chain):
             try:
                 self._clean_up(chain)
@@ -75,6 +88,9 @@ class IptablesFilter(pxe_filter.BaseFilter):
 
     @pxe_filter.locked_driver_event(pxe_filter.Events.initialize)
     def init_filter(self):
+        self._init_filter()
+
+    def _init_filter(self):
         # -w flag makes iptables wait for xtables lock, but it's not supported
         # everywhere yet
         try:
@@ -86,14 +102,23 @@ class IptablesFilter(pxe_filter.BaseFilter):
         else:
             self.base_command += ('-w',)
 
+        try:
+            cmd = self.restore_command + ('-w', '--test')
+            processutils.execute(*cmd, process_input='*filter\nCOMMIT\n')
+        except processutils.ProcessExecutionError:
+            LOG.warning('%s does not support -w flag, please update it to '
+                        'at least version 1.6.2', self._cmd_restore)
+        else:
+            self.restore_command += ('-w',)
+
         self._clean_up(self.chain)
         # Not really needed, but helps to validate that we have access to
         # iptables
         self._iptables('-N', self.chain)
         LOG.debug('The iptables filter was initialized')
 
-    @pxe_filter.locked_driver_event(pxe_filter.Events.sync)
-    def sync(self, ironic):
+    @pxe_filter.gathered_driver_sync
+    def sync(self, ironic, gathered):
         """Sync firewall filter rules for introspection.
 
         Gives access to PXE boot port for any machine, except for those, whose
@@ -105,55 +130,213 @@ class IptablesFilter(pxe_filter.BaseFilter):
 
         ``init()`` function must be called once before any call to this
         function. This function is using ``eventlet`` semaphore to serialize
-        access from different green threads.
+        access from different green threads, the Ironic ports are fetched
+        before taking it.
 
         :param ironic: an ironic client instance.
+        :param gathered: the Gathered data, see gathered_driver_sync.
+        :returns: nothing.
+        """
+        self._sync(ironic, gathered)
+
+    def _gather(self, ironic, stats):
+        """Get the MACs to blacklist. Not locked.
+
+        :param ironic: an ironic client instance.
+        :param stats: a SyncStats instance.
+        :returns: a tuple (whether to enable DHCP, list of MACs to blacklist
+            or None if DHCP should be disabled).
+        """
+        return _gather_blacklist(ironic, stats)
+
+    @pxe_filter.locked_driver_update
+    def on_introspection_started(self, macs, ironic=None):
+        """Remove the MACs of a node on introspection from the blacklist.
+
+        Falls back to a full sync if the current state of the chain is not
+        known or the MACs have to be mapped to EoIB MACs.
+
+        :param macs: an iterable of MACs of the node's ports.
+        :param ironic: an optional ironic client instance.
+        :returns: nothing.
+        """
+        if (not self.enabled or self.blacklist_cache is None or
+                CONF.iptables.ethoib_interfaces):
+            self._sync(ironic or ir_utils.get_client())
+            return
+
+        self._update_blacklist(
+            '-D', [mac for mac in macs if mac in self.blacklist_cache], ironic)
+
+    @pxe_filter.locked_driver_update
+    def on_introspection_finished(self, macs, ironic=None):
+        """Blacklist the MACs of a node after introspection.
+
+        See on_introspection_started for details.
+
+        :param macs: an iterable of MACs of the node's ports.
+        :param ironic: an optional ironic client instance.
         :returns: nothing.
         """
         if not _should_enable_dhcp():
             self._disable_dhcp()
             return
 
-        to_blacklist = _get_blacklist(ironic)
-        if to_blacklist == self.blacklist_cache:
-            LOG.debug('Not updating iptables - no changes in MAC list %s',
-                      to_blacklist)
+        if self.blacklist_cache is None or CONF.iptables.ethoib_interfaces:
+            self._sync(ironic or ir_utils.get_client())
+            return
+
+        active_macs = node_cache.active_macs()
+        self._update_blacklist(
+            '-I', [mac for mac in macs if mac not in self.blacklist_cache and
+                   mac not in active_macs], ironic)
+
+    def _update_blacklist(self, action, macs, ironic):
+        """Add (-I) or remove (-D) DROP rules for MACs in the current chain.
+
+        Falls back to a full sync on failure.
+        """
+        blacklist = set(self.blacklist_cache)
+        try:
+            for mac in macs:
+                if action == '-I':
+                    self._iptables('-I', self.chain, '1', '-m', 'mac',
+                                   '--mac-source', mac, '-j', 'DROP')
+                    blacklist.add(mac)
+                else:
+                    self._iptables('-D', self.chain, '-m', 'mac',
+                                   '--mac-source', mac, '-j', 'DROP')
+                    blacklist.discard(mac)
+        except processutils.ProcessExecutionError:
+            LOG.warning('Incremental update of the iptables filter failed, '
+                        'falling back to a full sync')
+            self.blacklist_cache = None
+            self._sync(ironic or ir_utils.get_client())
             return
 
-        LOG.debug('Blacklisting active MAC\'s %s', to_blacklist)
-        with self._temporary_chain(self.new_chain, self.chain):
+        self.blacklist_cache = blacklist
+        LOG.debug('The iptables filter was updated for MAC\'s %s', macs)
+
+    def _sync(self, ironic, gathered=None):
+        if gathered is None:
+            gathered = self._gather_timed(ironic)
+        enable_dhcp, to_blacklist = gathered.data
+
+        with pxe_filter.sync_stats('iptables') as stats:
+            stats.timings.update(gathered.timings)
+            if not enable_dhcp:
+                self._disable_dhcp(stats)
+                return
+
+            self._verify(stats)
+            if (self.blacklist_cache is not None and
+                    set(to_blacklist) == self.blacklist_cache):
+                LOG.debug('Not updating iptables - no changes in MAC list %s',
+                          to_blacklist)
+                return
+
+            LOG.debug('Blacklisting active MAC\'s %s', to_blacklist)
+            old_blacklist = self.blacklist_cache or set()
             # Force update on the next iteration if this attempt fails
             self.blacklist_cache = None
-            # - Blacklist active macs, so that nova can boot them
-            for mac in to_blacklist:
-                self._iptables('-A', self.new_chain, '-m', 'mac',
-                               '--mac-source', mac, '-j', 'DROP')
-            # - Whitelist everything else
-            self._iptables('-A', self.new_chain, '-j', 'ACCEPT')
-
-        # Cache result of successful iptables update
-        self.enabled = True
-        self.blacklist_cache = to_blacklist
-        LOG.debug('The iptables filter was synchronized')
+            with stats.phase('apply'):
+                # - Blacklist active macs, so that nova can boot them
+                rules = [('-A', self.chain, '-m', 'mac', '--mac-source', mac,
+                          '-j', 'DROP') for mac in to_blacklist]
+                # - Whitelist everything else
+                rules.append(('-A', self.chain, '-j', 'ACCEPT'))
+                self._restore_chain(rules)
+
+            # Cache result of successful iptables update
+            self.enabled = True
+            self.blacklist_cache = set(to_blacklist)
+            stats.record(added=len(self.blacklist_cache - old_blacklist),
+                         removed=len(old_blacklist - self.blacklist_cache))
+            LOG.debug('The iptables filter was synchronized')
+
+    def _verify(self, stats):
+        """Compare the actual blacklist with the cached one periodically.
+
+        On a drift, the cache is dropped, so that the sync rebuilds the
+        filter.
+
+        :param stats: a SyncStats instance to record the drift to.
+        :returns: nothing.
+        """
+        interval = CONF.iptables.verify_interval
+        if not self.enabled or self.blacklist_cache is None:
+            # The filter is rebuilt anyway
+            self._verified_at = timeutils.utcnow()
+            return
+        if not interval or (self._verified_at is not None and
+                            not timeutils.is_older_than(self._verified_at,
+                                                        interval)):
+            return
 
-    @contextlib.contextmanager
-    def _temporary_chain(self, chain, main_chain):
-        """Context manager to operate on a temporary chain."""
-        # Clean up a bit to account for possible troubles on previous run
-        self._clean_up(chain)
-        self._iptables('-N', chain)
+        with stats.phase('verify'):
+            actual = self._get_actual_blacklist()
+        self._verified_at = timeutils.utcnow()
+        stats.drift = len(actual.symmetric_difference(
+            mac.lower() for mac in self.blacklist_cache))
+        if stats.drift:
+            LOG.warning('The %(driver)s filter drifted from the expected '
+                        'state for %(count)d MAC(s), repairing',
+                        {'driver': type(self).__name__,
+                         'count': stats.drift})
+            self.blacklist_cache = None
 
-        yield
+    def _get_actual_blacklist(self):
+        """Get the MACs currently blacklisted in the chain.
 
-        # Swap chains
-        self._iptables('-I', 'INPUT', '-i', self.interface, '-p', 'udp',
-                       '--dport', self._dhcp_port, '-j', chain)
-        self._iptables('-D', 'INPUT', '-i', self.interface, '-p', 'udp',
-                       '--dport', self._dhcp_port, '-j', main_chain,
-                       ignore=True)
-        self._iptables('-F', main_chain, ignore=True)
-        self._iptables('-X', main_chain, ignore=True)
-        self._iptables('-E', chain, main_chain)
+        :returns: a set of lower case MACs.
+        """
+        out, _err = processutils.execute(*(self.base_command +
+                                           ('-S', self.chain)))
+        macs = set()
+        for line in out.splitlines():
+            args = line.split()
+            if '--mac-source' in args and args[-1] == 'DROP':
+                macs.add(args[args.index('--mac-source') + 1].lower())
+        return macs
+
+    def _restore_chain(self, rules):
+        """Atomically replace the content of the chain.
+
+        The whole chain is rendered as one iptables-restore payload. With
+        --noflush, declaring the chain flushes it (or creates it), and the
+        new rules take effect at once on COMMIT. The jump from the INPUT
+        chain is added in the same transaction if it is missing.
+
+        :param rules: a list of iptables arguments tuples to add to the
+            flushed chain.
+        """
+        lines = ['*filter', ':%s - [0:0]' % self.chain]
+        lines.extend(' '.join(rule) for rule in rules)
+        if not self._jump_exists():
+            lines.append(' '.join(('-I', 'INPUT') + self._jump_args()))
+        lines.append('COMMIT')
+
+        LOG.debug('Running %(cmd)s with %(count)d rules',
+                  {'cmd': self._cmd_restore, 'count': len(rules)})
+        try:
+            processutils.execute(*self.restore_command,
+                                 process_input='\n'.join(lines) + '\n')
+        except processutils.ProcessExecutionError as exc:
+            LOG.error('%(cmd)s failed: %(error)s',
+                      {'cmd': self._cmd_restore, 'error': exc})
+            raise
+
+    def _jump_args(self):
+        return ('-i', self.interface, '-p', 'udp', '--dport', self._dhcp_port,
+                '-j', self.chain)
+
+    def _jump_exists(self):
+        cmd = self.base_command + ('-C', 'INPUT') + self._jump_args()
+        try:
+            processutils.execute(*cmd)
+        except processutils.ProcessExecutionError:
+            return False
+        return True
 
     def _iptables(self, *args, **kwargs):
         # NOTE(dtantsur): -w flag makes it wait for xtables lock
@@ -178,7 +361,7 @@ class IptablesFilter(pxe_filter.BaseFilter):
         self._iptables('-F', chain, ignore=True)
         self._iptables('-X', chain, ignore=True)
 
-    def _disable_dhcp(self):
+    def _disable_dhcp(self, stats=None):
         """Disable DHCP completely."""
         if not self.enabled:
             LOG.debug('DHCP is already disabled, not updating')
@@ -187,10 +370,11 @@ class IptablesFilter(pxe_filter.BaseFilter):
         LOG.debug('No nodes on introspection and node_not_found_hook is '
                   'not set - disabling DHCP')
         self.blacklist_cache = None
-        with self._temporary_chain(self.new_chain, self.chain):
-            # Blacklist everything
-            self._iptables('-A', self.new_chain, '-j', 'REJECT')
-            self.enabled = False
+        # Blacklist everything
+        self._restore_chain([('-A', self.chain, '-j', 'REJECT')])
+        self.enabled = False
+        if stats is not None:
+            stats.record()
 
 
 def _ib_mac_to_rmac_mapping(ports):
@@ -213,9 +397,8 @@ def _ib_mac_to_rmac_mapping(ports):
         neighs_file = (
             os.path.join('/sys/class/net', interface, 'eth/neighs'))
         try:
-            with open(neighs_file, 'r') as fd:
-                data = fd.read()
-        except IOError:
+            neighs = _get_neighs(neighs_file)
+        except (IOError, OSError):
             LOG.error('Interface %s is not Ethernet Over InfiniBand; '
                       'Skipping ...', interface)
             continue
@@ -224,17 +407,61 @@ def _ib_mac_to_rmac_mapping(ports):
             if client_id:
                 # Note(moshele): The last 8 bytes in the client-id is
                 # the baremetal node InfiniBand GUID
-                guid = client_id[-23:]
-                p = re.compile(_EMAC_REGEX + guid)
-                match = p.search(data)
-                if match:
-                    port.address = match.group(1)
-
-
-def _get_blacklist(ironic):
-    ports = [port for port in
-             ir_utils.call_with_retries(ironic.port.list, limit=0,
-                                        fields=['address', 'extra'])
-             if port.address not in node_cache.active_macs()]
-    _ib_mac_to_rmac_mapping(ports)
+                emac = neighs.get(client_id[-_GUID_LEN:])
+                if emac:
+                    port.address = emac
+
+
+def _get_neighs(neighs_file):
+    """Get the GUID to EoIB MAC mapping of an EoIB neighs file.
+
+    The file is only parsed again if its modification time or content
+    changed since the last call.
+
+    :param neighs_file: path to the neighs file.
+    :raises: IOError, OSError if the file can't be read.
+    :returns: a dict GUID -> EoIB MAC.
+    """
+    mtime = os.stat(neighs_file).st_mtime
+    with open(neighs_file, 'r') as fd:
+        data = fd.read()
+
+    signature = (mtime, data)
+    cached = _NEIGHS_CACHE.get(neighs_file)
+    if cached is not None and cached[0] == signature:
+        return cached[1]
+
+    neighs = {}
+    for emac, imac in _NEIGH_REGEX.findall(data):
+        # NOTE: the first record of a GUID wins
+        neighs.setdefault(imac[-_GUID_LEN:], emac)
+    _NEIGHS_CACHE[neighs_file] = (signature, neighs)
+    LOG.debug('Parsed %(count)d EoIB neighbors from %(file)s',
+              {'count': len(neighs), 'file': neighs_file})
+    return neighs
+
+
+def _gather_blacklist(ironic, stats):
+    """Get the MACs to blacklist, unless DHCP should be disabled.
+
+    :param ironic: an ironic client instance.
+    :param stats: a SyncStats instance.
+    :returns: a tuple (whether to enable DHCP, list of MACs to blacklist or
+        None if DHCP should be disabled).
+    """
+    if not _should_enable_dhcp():
+        return False, None
+    return True, _get_blacklist(ironic, stats)
+
+
+def _get_blacklist(ironic, stats=None):
+    stats = stats or pxe_filter.SyncStats()
+    with stats.phase('fetch'):
+        active_macs = node_cache.active_macs()
+        ports = port_cache.refresh(ironic).ports()
+    with stats.phase('compute'):
+        # NOTE: copies, since the EoIB mapping modifies the addresses in place
+        ports = [copy.copy(port) for port in ports
+                 if port.address not in active_macs]
+        _ib_mac_to_rmac_mapping(ports)
     return [port.address for port in ports]
@@ -0,0 +1,265 @@
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""An nftables PXE boot filter.
+
+The driver manages a dedicated table of the ``inet`` family with a set of
+blacklisted MACs and a single input chain matching DHCP requests against
+the set. Every change is applied as one atomic ``nft -f`` transaction.
+"""
+
+import copy
+
+from oslo_concurrency import processutils
+from oslo_config import cfg
+from oslo_log import log
+
+from ironic_inspector.common import ironic as ir_utils
+from ironic_inspector.common import port_cache
+from ironic_inspector import node_cache
+from ironic_inspector.pxe_filter import base as pxe_filter
+from ironic_inspector.pxe_filter import iptables
+
+
+CONF = cfg.CONF
+LOG = log.getLogger(__name__)
+
+_SET = 'blacklist'
+_CHAIN = 'input'
+# DHCPv4 and DHCPv6 server ports
+_DHCP_PORTS = '{ 67, 547 }'
+
+
+def _map_macs(macs):
+    """Map InfiniBand MACs of ports to the EoIB MACs.
+
+    See iptables._ib_mac_to_rmac_mapping for details. The client IDs are
+    taken from the port cache, unknown MACs are returned unchanged.
+    """
+    if not CONF.iptables.ethoib_interfaces:
+        return list(macs)
+
+    cache = port_cache.cache()
+    ports = []
+    for mac in macs:
+        port = cache.get_by_mac(mac)
+        # NOTE: a copy, since the mapping modifies the address in place
+        ports.append(copy.copy(port) if port is not None
+                     else port_cache.Port(None, mac))
+    iptables._ib_mac_to_rmac_mapping(ports)
+    return [port.address for port in ports]
+
+
+class NftablesFilter(pxe_filter.BaseFilter):
+    """A PXE boot filtering interface implementation using nftables."""
+
+    def __init__(self):
+        super(NftablesFilter, self).__init__()
+        self.blacklist_cache = None
+        self.enabled = True
+        self.interface = CONF.iptables.dnsmasq_interface
+        self.table = CONF.nftables.table_name
+        self.base_command = ('sudo', 'ironic-inspector-rootwrap',
+                             CONF.rootwrap_config, 'nft', '-f', '-')
+
+    def reset(self):
+        self.enabled = True
+        self.blacklist_cache = None
+        try:
+            # NOTE: adding the table first makes the deletion idempotent
+            self._nft(['add table inet %s' % self.table,
+                       'delete table inet %s' % self.table])
+        except Exception as e:
+            LOG.exception('Encountered exception resetting filter: %s', e)
+        super(NftablesFilter, self).reset()
+
+    @pxe_filter.locked_driver_event(pxe_filter.Events.initialize)
+    def init_filter(self):
+        # An empty set and a chain without rules do not filter anything
+        # until the first sync
+        self._nft(self._ruleset())
+        LOG.debug('The nftables filter was initialized')
+
+    @pxe_filter.gathered_driver_sync
+    def sync(self, ironic, gathered):
+        """Sync the nftables filter for introspection.
+
+        Gives access to PXE boot port for any machine, except for those, whose
+        MAC is registered in Ironic and is not on introspection right now.
+
+        :param ironic: an ironic client instance.
+        :param gathered: the Gathered data, see gathered_driver_sync.
+        :returns: nothing.
+        """
+        self._sync(ironic, gathered)
+
+    def _gather(self, ironic, stats):
+        """Get the MACs to blacklist. Not locked.
+
+        See iptables._gather_blacklist for details.
+        """
+        return iptables._gather_blacklist(ironic, stats)
+
+    @pxe_filter.locked_driver_update
+    def on_introspection_started(self, macs, ironic=None):
+        """Remove the MACs of a node on introspection from the blacklist.
+
+        :param macs: an iterable of MACs of the node's ports.
+        :param ironic: an optional ironic client instance.
+        :returns: nothing.
+        """
+        if not self.enabled or self.blacklist_cache is None:
+            self._sync(ironic or ir_utils.get_client())
+            return
+
+        self._update_blacklist(
+            'delete', [mac for mac in _map_macs(macs)
+                       if mac in self.blacklist_cache], ironic)
+
+    @pxe_filter.locked_driver_update
+    def on_introspection_finished(self, macs, ironic=None):
+        """Blacklist the MACs of a node after introspection.
+
+        :param macs: an iterable of MACs of the node's ports.
+        :param ironic: an optional ironic client instance.
+        :returns: nothing.
+        """
+        if not iptables._should_enable_dhcp():
+            self._disable_dhcp()
+            return
+
+        if self.blacklist_cache is None:
+            self._sync(ironic or ir_utils.get_client())
+            return
+
+        macs = list(macs)
+        active_macs = node_cache.active_macs()
+        self._update_blacklist(
+            'add', [mapped for mac, mapped in zip(macs, _map_macs(macs))
+                    if mapped not in self.blacklist_cache and
+                    mac not in active_macs], ironic)
+
+    def _sync(self, ironic, gathered=None):
+        if gathered is None:
+            gathered = self._gather_timed(ironic)
+        enable_dhcp, to_blacklist = gathered.data
+
+        with pxe_filter.sync_stats('nftables') as stats:
+            stats.timings.update(gathered.timings)
+            if not enable_dhcp:
+                self._disable_dhcp(stats)
+                return
+
+            to_blacklist = set(to_blacklist)
+            if self.enabled and self.blacklist_cache is not None:
+                if to_blacklist == self.blacklist_cache:
+                    LOG.debug('Not updating nftables - no changes in MAC '
+                              'list %s', to_blacklist)
+                    return
+
+                to_add = to_blacklist - self.blacklist_cache
+                to_delete = self.blacklist_cache - to_blacklist
+                with stats.phase('apply'):
+                    self._nft(self._elements('add', to_add) +
+                              self._elements('delete', to_delete))
+                self.blacklist_cache = to_blacklist
+                stats.record(added=len(to_add), removed=len(to_delete))
+                LOG.debug('The nftables filter was synchronized')
+                return
+
+            LOG.debug('Blacklisting active MAC\'s %s', to_blacklist)
+            # Force update on the next iteration if this attempt fails
+            self.blacklist_cache = None
+            with stats.phase('apply'):
+                self._nft(self._ruleset(
+                    'iifname "%s" udp dport %s ether saddr @%s drop' %
+                    (self.interface, _DHCP_PORTS, _SET), to_blacklist))
+
+            self.enabled = True
+            self.blacklist_cache = to_blacklist
+            stats.record(added=len(to_blacklist))
+            LOG.debug('The nftables filter was synchronized')
+
+    def _disable_dhcp(self, stats=None):
+        """Disable DHCP completely."""
+        if not self.enabled:
+            LOG.debug('DHCP is already disabled, not updating')
+            return
+
+        LOG.debug('No nodes on introspection and node_not_found_hook is '
+                  'not set - disabling DHCP')
+        self.blacklist_cache = None
+        self._nft(self._ruleset('iifname "%s" udp dport %s reject' %
+                                (self.interface, _DHCP_PORTS)))
+        self.enabled = False
+        if stats is not None:
+            stats.record()
+
+    def _update_blacklist(self, command, macs, ironic):
+        """Add or delete set elements, fall back to a full sync on failure."""
+        try:
+            self._nft(self._elements(command, macs))
+        except processutils.ProcessExecutionError:
+            LOG.warning('Incremental update of the nftables filter failed, '
+                        'falling back to a full sync')
+            self.blacklist_cache = None
+            self._sync(ironic or ir_utils.get_client())
+            return
+
+        if command == 'add':
+            self.blacklist_cache = self.blacklist_cache.union(macs)
+        else:
+            self.blacklist_cache = self.blacklist_cache.difference(macs)
+        LOG.debug('The nftables filter was updated for MAC\'s %s', macs)
+
+    def _ruleset(self, rule=None, elements=()):
+        """Render commands replacing the whole table."""
+        lines = [
+            # NOTE: adding the table first makes the deletion idempotent
+            'add table inet %s' % self.table,
+            'delete table inet %s' % self.table,
+            'table inet %s {' % self.table,
+            '    set %s {' % _SET,
+            '        type ether_addr',
+        ]
+        if elements:
+            lines.append('        elements = { %s }' %
+                         ', '.join(sorted(elements)))
+        lines.extend([
+            '    }',
+            '    chain %s {' % _CHAIN,
+            '        type filter hook input priority 0; policy accept;',
+        ])
+        if rule:
+            lines.append('        %s' % rule)
+        lines.extend(['    }', '}'])
+        return lines
+
+    def _elements(self, command, macs):
+        if not macs:
+            return []
+        return ['%s element inet %s %s { %s }' %
+                (command, self.table, _SET, ', '.join(sorted(macs)))]
+
+    def _nft(self, lines):
+        """Apply the commands as one atomic transaction."""
+        if not lines:
+            return
+
+        LOG.debug('Running nft with %d commands', len(lines))
+        try:
+            processutils.execute(*self.base_command,
+                                 process_input='\n'.join(lines) + '\n')
+        except processutils.ProcessExecutionError as exc:
+            LOG.error('nft failed: %s', exc)
+            raise
@@ -14,23 +14,51 @@
 
 """Support for introspection rules."""
 
+import re
+import string
+
+from eventlet import semaphore
+import futurist
 import jsonpath_rw as jsonpath
 import jsonschema
+from oslo_config import cfg
 from oslo_db import exception as db_exc
 from oslo_utils import timeutils
 from oslo_utils import uuidutils
 import six
+import sqlalchemy
 from sqlalchemy import orm
 
 from ironic_inspector.common.i18n import _
 from ironic_inspector import db
+from ironic_inspector import node_cache
 from ironic_inspector.plugins import base as plugins_base
+from ironic_inspector.plugins import rules as rules_plugins
 from ironic_inspector import utils
 
 
+CONF = cfg.CONF
 LOG = utils.getProcessingLogger(__name__)
 _CONDITIONS_SCHEMA = None
 _ACTIONS_SCHEMA = None
+# Validators for the schemas above, built on first use
+_CONDITIONS_VALIDATOR = None
+_ACTIONS_VALIDATOR = None
+# Process-wide cache of the rule set, a _RuleSet object
+_RULE_SET = None
+_RULE_SET_LOCK = semaphore.Semaphore()
+_RULE_SET_VERSION_ID = 1
+# How many nodes to fetch introspection data for at once when evaluating
+_EVALUATION_WORKERS = 4
+# Dotted field names with optional numeric indices, e.g. "inventory.cpu.count"
+# or "inventory.interfaces[0].mac_address"
+_NAME_RE = r'[a-zA-Z_][a-zA-Z0-9_\-]*'
+_SIMPLE_PATH_RE = re.compile(r'^{name}(\[\d+\])*(\.{name}(\[\d+\])*)*\Z'
+                             .format(name=_NAME_RE))
+_SIMPLE_PATH_STEP_RE = re.compile(r'({name})|\[(\d+)\]'
+                                  .format(name=_NAME_RE))
+_JSONPATH_RESERVED_WORDS = {'where'}
+_FORMATTER = string.Formatter()
 
 
 def conditions_schema():
@@ -99,6 +127,172 @@ def actions_schema():
     return _ACTIONS_SCHEMA
 
 
+def _make_validator(schema):
+    cls = jsonschema.validators.validator_for(schema)
+    cls.check_schema(schema)
+    return cls(schema)
+
+
+def _check_schema(validator, instance):
+    error = jsonschema.exceptions.best_match(validator.iter_errors(instance))
+    if error is not None:
+        raise error
+
+
+def _validate_conditions_schema(conditions_json):
+    global _CONDITIONS_VALIDATOR
+    if _CONDITIONS_VALIDATOR is None:
+        _CONDITIONS_VALIDATOR = _make_validator(conditions_schema())
+    _check_schema(_CONDITIONS_VALIDATOR, conditions_json)
+
+
+def _validate_actions_schema(actions_json):
+    global _ACTIONS_VALIDATOR
+    if _ACTIONS_VALIDATOR is None:
+        _ACTIONS_VALIDATOR = _make_validator(actions_schema())
+    _check_schema(_ACTIONS_VALIDATOR, actions_json)
+
+
+class _SimplePath(object):
+    """Simple JSON path evaluated by walking dicts and lists directly.
+
+    Gives the same results as jsonpath_rw for paths consisting only of
+    field names and non-negative indices, without its object model.
+    """
+
+    def __init__(self, steps):
+        # field names as strings, indices as integers
+        self.steps = steps
+
+    def find_values(self, data):
+        value = data
+        for step in self.steps:
+            if isinstance(step, int):
+                # Matches jsonpath_rw.Index, including its exceptions
+                if len(value) <= step:
+                    return []
+                value = value[step]
+            else:
+                # Matches jsonpath_rw.Fields
+                try:
+                    value = value[step]
+                except (TypeError, KeyError, AttributeError):
+                    return []
+        return [value]
+
+
+class _JsonPath(object):
+    """JSON path evaluated by jsonpath_rw."""
+
+    def __init__(self, path):
+        self.expression = jsonpath.parse(path)
+
+    def find_values(self, data):
+        return [x.value for x in self.expression.find(data)]
+
+
+def _compile_path(path):
+    """Prepare a JSON path for evaluation.
+
+    :param path: JSON path without a scheme
+    :returns: an object with a find_values(data) method returning a list
+    """
+    if _SIMPLE_PATH_RE.match(path):
+        steps = []
+        for name, index in _SIMPLE_PATH_STEP_RE.findall(path):
+            if name in _JSONPATH_RESERVED_WORDS:
+                break
+            steps.append(name if name else int(index))
+        else:
+            return _SimplePath(steps)
+
+    return _JsonPath(path)
+
+
+class _CompiledCondition(object):
+    """Condition prepared for checking against many nodes."""
+
+    def __init__(self, condition, ext_mgr):
+        self.field = condition.field
+        self.op = condition.op
+        self.multiple = condition.multiple
+        self.invert = condition.invert
+        self.params = condition.params
+        self.scheme, self.path = _parse_path(condition.field)
+        self.expression = _compile_path(self.path)
+        self.plugin = ext_mgr[condition.op].obj
+        self.compiled_params = self.plugin.compile(condition.params)
+
+
+class _CompiledAction(object):
+    """Action with formatted parameters prepared for many nodes."""
+
+    def __init__(self, action, ext_mgr):
+        self.action = action.action
+        self.plugin = ext_mgr[action.action].obj
+        # Parameters that do not depend on introspection data
+        self.static_params = dict(action.params)
+        self.templates = {}
+        for name in self.plugin.FORMATTED_PARAMS:
+            try:
+                value = action.params[name]
+            except KeyError:
+                # Ignore parameter that wasn't given.
+                continue
+
+            template = _compile_value(value)
+            if template is None:
+                self.static_params[name] = _format_value(value, None)
+            else:
+                self.templates[name] = template
+
+    def render(self, data):
+        """Get parameters for introspection data.
+
+        :param data: introspection data
+        :returns: new dictionary with parameters
+        """
+        params = dict(self.static_params)
+        for name, template in self.templates.items():
+            params[name] = template(data)
+        return params
+
+
+class _EvaluationContext(object):
+    """Values of fields for checking rules against one node.
+
+    The node is fetched and serialized at most once, and the values found
+    by a JSON path are reused by all conditions with the same field.
+    """
+
+    def __init__(self, node_info, data):
+        self.node_info = node_info
+        self.data = data
+        self._node = None
+        self._values = {}
+
+    def _source(self, scheme):
+        if scheme == 'node':
+            if self._node is None:
+                self._node = self.node_info.node().to_dict()
+            return self._node
+        return self.data
+
+    def find(self, cond):
+        """Get values of a condition field.
+
+        :param cond: compiled condition
+        :returns: list of found values, must not be modified
+        """
+        key = (cond.scheme, cond.path)
+        try:
+            return self._values[key]
+        except KeyError:
+            values = cond.expression.find_values(self._source(cond.scheme))
+            self._values[key] = values
+            return values
+
+
 class IntrospectionRule(object):
     """High-level class representing an introspection rule."""
 
@@ -108,6 +302,8 @@ class IntrospectionRule(object):
         self._conditions = conditions
         self._actions = actions
         self._description = description
+        self._compiled_conditions = None
+        self._compiled_actions = None
 
     def as_dict(self, short=False):
         result = {
@@ -121,31 +317,54 @@ class IntrospectionRule(object):
 
         return result
 
+    @property
+    def uuid(self):
+        return self._uuid
+
     @property
     def description(self):
         return self._description or self._uuid
 
-    def check_conditions(self, node_info, data):
+    def compile(self):
+        """Prepare conditions for checking and actions for applying.
+
+        JSON paths are parsed, condition parameters are passed through
+        the plugins' ``compile`` call and formatted action parameters are
+        parsed only once per rule object.
+
+        :returns: list of compiled conditions
+        """
+        if self._compiled_conditions is None:
+            ext_mgr = plugins_base.rule_conditions_manager()
+            self._compiled_conditions = [
+                _CompiledCondition(cond, ext_mgr)
+                for cond in self._conditions
+            ]
+        if self._compiled_actions is None:
+            ext_mgr = plugins_base.rule_actions_manager()
+            self._compiled_actions = [
+                _CompiledAction(act, ext_mgr)
+                for act in self._actions
+            ]
+        return self._compiled_conditions
+
+    def check_conditions(self, node_info, data, context=None):
         """Check if conditions are true for a given node.
 
         :param node_info: a NodeInfo object
         :param data: introspection data
+        :param context: evaluation context to share field values with other
+                        rules checked against the same node
         :returns: True if conditions match, otherwise False
         """
         LOG.debug('Checking rule "%s"', self.description,
                   node_info=node_info, data=data)
-        ext_mgr = plugins_base.rule_conditions_manager()
-        for cond in self._conditions:
-            scheme, path = _parse_path(cond.field)
+        if context is None:
+            context = _EvaluationContext(node_info, data)
 
-            if scheme == 'node':
-                source_data = node_info.node().to_dict()
-            elif scheme == 'data':
-                source_data = data
-
-            field_values = jsonpath.parse(path).find(source_data)
-            field_values = [x.value for x in field_values]
-            cond_ext = ext_mgr[cond.op].obj
+        for cond in self.compile():
+            field_values = context.find(cond)
+            cond_ext = cond.plugin
 
             if not field_values:
                 if cond_ext.ALLOW_NONE:
@@ -161,7 +380,8 @@ class IntrospectionRule(object):
                     return False
 
             for value in field_values:
-                result = cond_ext.check(node_info, value, cond.params)
+                result = cond_ext.check(node_info, value,
+                                        cond.compiled_params)
                 if cond.invert:
                     result = not result
 
@@ -191,23 +411,13 @@ class IntrospectionRule(object):
         LOG.debug('Running actions for rule "%s"', self.description,
                   node_info=node_info, data=data)
 
-        ext_mgr = plugins_base.rule_actions_manager()
-        for act in self._actions:
-            ext = ext_mgr[act.action].obj
-
-            for formatted_param in ext.FORMATTED_PARAMS:
-                try:
-                    initial = act.params[formatted_param]
-                except KeyError:
-                    # Ignore parameter that wasn't given.
-                    continue
-                else:
-                    act.params[formatted_param] = _format_value(initial, data)
-
+        self.compile()
+        for act in self._compiled_actions:
+            params = act.render(data)
             LOG.debug('Running action `%(action)s %(params)s`',
-                      {'action': act.action, 'params': act.params},
+                      {'action': act.action, 'params': params},
                       node_info=node_info, data=data)
-            ext.apply(node_info, act.params)
+            act.plugin.apply(node_info, params)
 
         LOG.debug('Successfully applied actions',
                   node_info=node_info, data=data)
@@ -232,9 +442,7 @@ def _format_value(value, data):
         try:
             return value.format(data=data)
         except KeyError as e:
-            raise utils.Error(_('Invalid formatting variable key '
-                                'provided in value %(val)s: %(e)s'),
-                              {'val': value, 'e': e}, data=data)
+            raise _format_error(value, e, data)
     elif isinstance(value, dict):
         return {_format_value(k, data): _format_value(v, data)
                 for k, v in six.iteritems(value)}
@@ -245,6 +453,82 @@ def _format_value(value, data):
         return value
 
 
+def _format_error(value, exc, data):
+    return utils.Error(_('Invalid formatting variable key provided in '
+                         'value %(val)s: %(e)s') % {'val': value, 'e': exc},
+                       data=data)
+
+
+def _compile_string(value):
+    try:
+        parts = list(_FORMATTER.parse(value))
+    except ValueError:
+        # Invalid format string, let str.format report it for every node
+        return lambda data: _format_value(value, data)
+
+    if all(field is None for _literal, field, _spec, _conv in parts):
+        return None
+
+    for _literal, field, spec, _conv in parts:
+        if field is not None and (not field.startswith('data')
+                                  or '{' in (spec or '')):
+            # Positional or nested fields, keep the generic formatting
+            return lambda data: _format_value(value, data)
+
+    def _render(data):
+        result = []
+        for literal, field, spec, conversion in parts:
+            result.append(literal)
+            if field is None:
+                continue
+            try:
+                obj, _key = _FORMATTER.get_field(field, (), {'data': data})
+            except KeyError as exc:
+                raise _format_error(value, exc, data)
+            obj = _FORMATTER.convert_field(obj, conversion)
+            result.append(_FORMATTER.format_field(obj, spec))
+        return ''.join(result)
+
+    return _render
+
+
+def _compile_value(value):
+    """Pre-parse formatting of a parameter value.
+
+    The same rules as in _format_value apply.
+
+    :param value: The string to format, or container whose members to
+                  format.
+    :returns: a function accepting introspection data and returning the
+              formatted value, or None if the value does not depend on
+              introspection data.
+    """
+    if isinstance(value, six.string_types):
+        return _compile_string(value)
+    elif isinstance(value, dict):
+        items = [(k, _compile_value(k), v, _compile_value(v))
+                 for k, v in six.iteritems(value)]
+        if all(kt is None and vt is None for _k, kt, _v, vt in items):
+            return None
+        items = [(_format_value(k, None) if kt is None else None, kt,
+                  _format_value(v, None) if vt is None else None, vt)
+                 for k, kt, v, vt in items]
+        return lambda data: {
+            (k if kt is None else kt(data)): (v if vt is None else vt(data))
+            for k, kt, v, vt in items
+        }
+    elif isinstance(value, list):
+        items = [(v, _compile_value(v)) for v in value]
+        if all(vt is None for _v, vt in items):
+            return None
+        items = [(_format_value(v, None) if vt is None else None, vt)
+                 for v, vt in items]
+        return lambda data: [v if vt is None else vt(data)
+                             for v, vt in items]
+    else:
+        return None
+
+
 def _parse_path(path):
     """Parse path, extract scheme and path.
 
@@ -272,7 +556,7 @@ def _validate_conditions(conditions_json):
     :returns: a list of conditions.
     """
     try:
-        jsonschema.validate(conditions_json, conditions_schema())
+        _validate_conditions_schema(conditions_json)
     except jsonschema.ValidationError as exc:
         raise utils.Error(_('Validation failed for conditions: %s') % exc)
 
@@ -299,6 +583,8 @@ def _validate_conditions(conditions_json):
                   if k not in reserved_params}
         try:
             plugin.validate(params)
+            # Make sure that the condition can be prepared for checking
+            plugin.compile(params)
         except ValueError as exc:
             raise utils.Error(_('Invalid parameters for operator %(op)s: '
                                 '%(error)s') %
@@ -318,7 +604,7 @@ def _validate_actions(actions_json):
     :returns: a list of actions.
     """
     try:
-        jsonschema.validate(actions_json, actions_schema())
+        _validate_actions_schema(actions_json)
     except jsonschema.ValidationError as exc:
         raise utils.Error(_('Validation failed for actions: %s') % exc)
 
@@ -365,21 +651,10 @@ def create(conditions_json, actions_json, uuid=None,
 
     try:
         with db.ensure_transaction() as session:
-            rule = db.Rule(uuid=uuid, description=description,
-                           disabled=False, created_at=timeutils.utcnow())
-
-            for field, op, multiple, invert, params in conditions:
-                rule.conditions.append(db.RuleCondition(op=op,
-                                                        field=field,
-                                                        multiple=multiple,
-                                                        invert=invert,
-                                                        params=params))
-
-            for action, params in actions:
-                rule.actions.append(db.RuleAction(action=action,
-                                                  params=params))
-
+            rule = _make_db_rule(uuid, description, conditions, actions,
+                                 _next_position(session))
             rule.save(session)
+            _bump_rule_set_version(session)
     except db_exc.DBDuplicateEntry as exc:
         LOG.error('Database integrity error %s when '
                   'creating a rule', exc)
@@ -394,6 +669,139 @@ def create(conditions_json, actions_json, uuid=None,
                              description=description)
 
 
+def _next_position(session):
+    """Get the position after the last existing rule."""
+    last = session.query(sqlalchemy.func.max(db.Rule.position)).scalar()
+    return 0 if last is None else last + 1
+
+
+def _make_db_rule(uuid, description, conditions, actions, position):
+    rule = db.Rule(uuid=uuid, description=description, disabled=False,
+                   created_at=timeutils.utcnow(), position=position)
+
+    for field, op, multiple, invert, params in conditions:
+        rule.conditions.append(db.RuleCondition(op=op,
+                                                field=field,
+                                                multiple=multiple,
+                                                invert=invert,
+                                                params=params))
+
+    for action, params in actions:
+        rule.actions.append(db.RuleAction(action=action,
+                                          params=params))
+
+    return rule
+
+
+def _validate_rule_set(rules_json):
+    """Validate a list of rules for bulk import.
+
+    :returns: list of tuples (uuid, description, conditions, actions)
+    :raises: utils.Error if any rule is invalid
+    """
+    if not isinstance(rules_json, list):
+        raise utils.Error(_('Expected a list of rules, got %s') %
+                          type(rules_json).__name__)
+
+    result = []
+    seen = set()
+    for index, rule_json in enumerate(rules_json):
+        if not isinstance(rule_json, dict):
+            raise utils.Error(_('Rule #%d is not an object') % index)
+
+        uuid = rule_json.get('uuid') or uuidutils.generate_uuid()
+        if not uuidutils.is_uuid_like(uuid):
+            raise utils.Error(_('Invalid UUID value %(uuid)s in rule '
+                                '#%(index)d') % {'uuid': uuid,
+                                                 'index': index})
+        if uuid in seen:
+            raise utils.Error(_('Rule with UUID %s is listed more than '
+                                'once') % uuid)
+        seen.add(uuid)
+
+        try:
+            conditions = _validate_conditions(rule_json.get('conditions',
+                                                            []))
+            actions = _validate_actions(rule_json.get('actions', []))
+        except utils.Error as exc:
+            raise utils.Error(_('Rule #%(index)d (%(uuid)s) is invalid: '
+                                '%(error)s') % {'index': index, 'uuid': uuid,
+                                                'error': exc})
+
+        result.append((uuid, rule_json.get('description'), conditions,
+                       actions))
+    return result
+
+
+def import_rules(rules_json, replace=True):
+    """Create many rules in one transaction.
+
+    All rules are validated before the database is touched, so that either
+    the whole rule set is imported or nothing changes.
+
+    :param rules_json: list of dicts with keys ``conditions``, ``actions``
+                       and optionally ``uuid`` and ``description``, same as
+                       the arguments of :func:`create`.
+    :param replace: if True, all existing rules are removed first. Otherwise
+                    the rules are merged: existing rules with the same UUIDs
+                    are replaced in place, other existing rules are kept and
+                    new rules are added after them.
+    :returns: list of new IntrospectionRule objects in the order of
+              ``rules_json``
+    :raises: utils.Error on failure
+    """
+    validated = _validate_rule_set(rules_json)
+    uuids = [item[0] for item in validated]
+    LOG.debug('Importing %(count)d rule(s), replace=%(replace)s',
+              {'count': len(validated), 'replace': replace})
+
+    result = []
+    with db.ensure_transaction() as session:
+        positions = {}
+        if replace:
+            db.model_query(db.RuleAction, session=session).delete()
+            db.model_query(db.RuleCondition, session=session).delete()
+            db.model_query(db.Rule, session=session).delete()
+            position = 0
+        else:
+            # NOTE: before the replaced rules are deleted, so that the new
+            # rules come after all existing ones
+            position = _next_position(session)
+        if uuids and not replace:
+            positions = dict(
+                db.model_query(db.Rule.uuid, db.Rule.position,
+                               session=session)
+                .filter(db.Rule.uuid.in_(uuids)))
+            for model, column in ((db.RuleAction, db.RuleAction.rule),
+                                  (db.RuleCondition, db.RuleCondition.rule),
+                                  (db.Rule, db.Rule.uuid)):
+                (db.model_query(model, session=session)
+                 .filter(column.in_(uuids))
+                 .delete(synchronize_session=False))
+
+        # Rules are applied in the order of their positions, replaced rules
+        # keep theirs, new rules follow the existing ones in the order of
+        # the imported list
+        for uuid, description, conditions, actions in validated:
+            if uuid not in positions:
+                positions[uuid] = position
+                position += 1
+            rule = _make_db_rule(uuid, description, conditions, actions,
+                                 positions[uuid])
+            session.add(rule)
+            result.append(IntrospectionRule(uuid=uuid,
+                                            conditions=rule.conditions,
+                                            actions=rule.actions,
+                                            description=description))
+
+        session.flush()
+        _bump_rule_set_version(session)
+
+    LOG.info('Imported %(count)d introspection rule(s), replace=%(replace)s',
+             {'count': len(result), 'replace': replace})
+    return result
+
+
 def get(uuid):
     """Get a rule by its UUID."""
     try:
@@ -406,15 +814,53 @@ def get(uuid):
                              description=rule.description)
 
 
-def get_all():
-    """List all rules."""
-    query = db.model_query(db.Rule).order_by(db.Rule.created_at)
+def get_all(session=None, replica=False):
+    """List all rules.
+
+    :param session: optional existing database session.
+    :param replica: whether to fetch the rules from the database replica,
+                    see db.get_replica_session. Only suitable for listing,
+                    the rules may be stale.
+    """
+    query = db.model_query(db.Rule, session=session,
+                           replica=replica).order_by(db.Rule.position,
+                                                     db.Rule.uuid)
     return [IntrospectionRule(uuid=rule.uuid, actions=rule.actions,
                               conditions=rule.conditions,
                               description=rule.description)
             for rule in query]
 
 
+def export(batch_size=100):
+    """Iterate over all rules in order without loading them at once.
+
+    Rules are fetched in batches of ``batch_size`` using the position and
+    the UUID as a key, the result is suitable for :func:`import_rules`.
+    Every batch is read in its own short-lived session, so the generator can
+    be consumed after the request session is closed.
+
+    :returns: generator of IntrospectionRule objects
+    """
+    last = None
+    while True:
+        with db.standalone_session() as session:
+            query = db.model_query(db.Rule, session=session).order_by(
+                db.Rule.position, db.Rule.uuid)
+            if last is not None:
+                query = query.filter(sqlalchemy.or_(
+                    db.Rule.position > last.position,
+                    sqlalchemy.and_(db.Rule.position == last.position,
+                                    db.Rule.uuid > last.uuid)))
+            batch = query.limit(batch_size).all()
+        for rule in batch:
+            yield IntrospectionRule(uuid=rule.uuid, actions=rule.actions,
+                                    conditions=rule.conditions,
+                                    description=rule.description)
+        if len(batch) < batch_size:
+            return
+        last = batch[-1]
+
+
 def delete(uuid):
     """Delete a rule by its UUID."""
     with db.ensure_transaction() as session:
@@ -426,6 +872,7 @@ def delete(uuid):
                  .filter_by(uuid=uuid).delete())
         if not count:
             raise utils.Error(_('Rule %s was not found') % uuid, code=404)
+        _bump_rule_set_version(session)
 
     LOG.info('Introspection rule %s was deleted', uuid)
 
@@ -436,14 +883,143 @@ def delete_all():
         db.model_query(db.RuleAction, session=session).delete()
         db.model_query(db.RuleCondition, session=session).delete()
         db.model_query(db.Rule, session=session).delete()
+        _bump_rule_set_version(session)
 
     LOG.info('All introspection rules were deleted')
 
 
+def _bump_rule_set_version(session):
+    """Mark the rule set as changed for all processes.
+
+    Must be called in the same transaction as the change itself.
+    """
+    count = (db.model_query(db.RuleSetVersion, session=session)
+             .filter_by(id=_RULE_SET_VERSION_ID)
+             .update({'version': db.RuleSetVersion.version + 1}))
+    if not count:
+        db.RuleSetVersion(id=_RULE_SET_VERSION_ID,
+                          version=1).save(session)
+
+
+def _get_rule_set_version(session=None):
+    row = (db.model_query(db.RuleSetVersion.version, session=session)
+           .filter_by(id=_RULE_SET_VERSION_ID).first())
+    return row.version if row is not None else 0
+
+
+def _find_guard(conditions):
+    """Find a condition suitable for indexing a rule.
+
+    :param conditions: compiled conditions of a rule
+    :returns: the first not inverted built-in ``eq`` condition on a simple
+              path with a hashable value, None if there is no such condition
+    """
+    for cond in conditions:
+        if (type(cond.plugin) is not rules_plugins.EqCondition
+                or cond.invert
+                or not isinstance(cond.expression, _SimplePath)):
+            continue
+        try:
+            hash(cond.params['value'])
+        except TypeError:
+            continue
+        return cond
+
+
+class _RuleSet(object):
+    """Compiled rules with an index of their equality guards.
+
+    Rules are grouped by the path and the expected value of their first
+    equality condition (see _find_guard). For every node each such path is
+    evaluated once and only the rules expecting the found value are
+    checked, as well as all rules without equality conditions.
+    """
+
+    def __init__(self, version, rules):
+        self.version = version
+        self.rules = rules
+        self._unguarded = []
+        # (scheme, path, coercion) -> (condition, {value: [rule positions]})
+        self._guards = {}
+        for position, rule in enumerate(rules):
+            guard = _find_guard(rule.compile())
+            if guard is None:
+                self._unguarded.append(position)
+                continue
+
+            value = guard.params['value']
+            # NOTE: the same coercion as used by the condition itself
+            key = (guard.scheme, guard.path,
+                   guard.compiled_params['_coercion'])
+            buckets = self._guards.setdefault(key, (guard, {}))[1]
+            buckets.setdefault(value, []).append(position)
+
+    def candidates(self, context):
+        """Find rules that can match a node.
+
+        :param context: evaluation context for the node
+        :returns: list of rules in their original order
+        """
+        positions = list(self._unguarded)
+        for (_scheme, _path, coercion), (guard, buckets) in (
+                self._guards.items()):
+            values = context.find(guard)
+            if not values:
+                continue
+
+            value = values[0]
+            if coercion is not None:
+                try:
+                    value = coercion(value)
+                except Exception:
+                    # Let the condition itself report the problem
+                    for bucket in buckets.values():
+                        positions.extend(bucket)
+                    continue
+
+            try:
+                positions.extend(buckets.get(value, ()))
+            except TypeError:
+                # Unhashable value can not be equal to any expected value
+                continue
+
+        return [self.rules[position] for position in sorted(positions)]
+
+
+def get_rule_set():
+    """Get all rules using the process-wide cache.
+
+    The cache is validated against the rule set version, which is bumped
+    on every change to the rules, so a single row is read when nothing
+    has changed. The returned rules must not be modified.
+
+    :returns: _RuleSet object.
+    """
+    global _RULE_SET
+    # NOTE: the version must be read before the rules and from the same
+    # (primary) database, otherwise stale rules could be cached with a too
+    # new version.
+    session = db.get_reader_session()
+    version = _get_rule_set_version(session)
+    cached = _RULE_SET
+    if cached is not None and cached.version == version:
+        return cached
+
+    with _RULE_SET_LOCK:
+        cached = _RULE_SET
+        if cached is not None and cached.version == version:
+            return cached
+
+        LOG.debug('Loading introspection rules, rule set version %s',
+                  version)
+        _RULE_SET = _RuleSet(version, get_all(session))
+        return _RULE_SET
+
+
 def apply(node_info, data):
     """Apply rules to a node."""
-    rules = get_all()
-    if not rules:
+    rule_set = get_rule_set()
+    if not rule_set.rules:
         LOG.debug('No custom introspection rules to apply',
                   node_info=node_info, data=data)
         return
@@ -451,17 +1027,143 @@ def apply(node_info, data):
     LOG.debug('Applying custom introspection rules',
               node_info=node_info, data=data)
 
+    context = _EvaluationContext(node_info, data)
+    candidates = rule_set.candidates(context)
+    LOG.debug('%(candidates)d of %(total)d rules can match',
+              {'candidates': len(candidates), 'total': len(rule_set.rules)},
+              node_info=node_info, data=data)
     to_apply = []
-    for rule in rules:
-        if rule.check_conditions(node_info, data):
+    for rule in candidates:
+        if rule.check_conditions(node_info, data, context=context):
             to_apply.append(rule)
 
     if to_apply:
         LOG.debug('Running actions', node_info=node_info, data=data)
-        for rule in to_apply:
-            rule.apply_actions(node_info, data=data)
+        # Send all changes to Ironic at once after all actions are run
+        with node_info.batched_updates():
+            for rule in to_apply:
+                rule.apply_actions(node_info, data=data)
     else:
         LOG.debug('No actions to apply', node_info=node_info, data=data)
 
     LOG.info('Successfully applied custom introspection rules',
              node_info=node_info, data=data)
+
+
+def _get_stored_data(node_uuid):
+    """Get processed introspection data, None if it is not available."""
+    store = plugins_base.introspection_data_manager()[
+        CONF.processing.store_data].obj
+    try:
+        return store.get(node_uuid, processed=True, get_json=True)
+    except utils.Error as exc:
+        LOG.debug('No processed introspection data for node %(node)s: '
+                  '%(error)s', {'node': node_uuid, 'error': exc})
+        return None
+
+
+def evaluate(rules_json=None, batch_size=100):
+    """Check rule conditions against all stored introspection data.
+
+    Nothing is changed: actions are not run and the rules are not stored.
+    Nodes are walked in batches of ``batch_size``, their processed data is
+    fetched from the store by a few dedicated workers and released after
+    each batch.
+
+    :param rules_json: list of rules in the format accepted by
+                       :func:`import_rules`, existing rules are evaluated
+                       if None.
+    :param batch_size: how many nodes to process at once
+    :returns: dict with keys ``nodes`` (total number of nodes),
+              ``nodes_without_data`` (number of nodes without processed
+              data), ``rules`` (list of dicts with keys ``uuid``,
+              ``description``, ``matches`` and ``nodes``) and ``errors``
+              (list of dicts with keys ``node``, ``rule`` and ``error``,
+              ``rule`` is None if the node could not be matched against
+              the rule set at all).
+    :raises: utils.Error if the rules are invalid
+    """
+    if rules_json is None:
+        candidate_rules = get_rule_set().rules
+    else:
+        candidate_rules = []
+        for uuid, description, conditions, actions in _validate_rule_set(
+                rules_json):
+            rule = _make_db_rule(uuid, description, conditions, actions,
+                                 None)
+            candidate_rules.append(IntrospectionRule(
+                uuid=uuid, conditions=rule.conditions,
+                actions=rule.actions, description=description))
+    rule_set = _RuleSet(None, candidate_rules)
+
+    matches = {rule.uuid: [] for rule in candidate_rules}
+    errors = []
+    total = without_data = 0
+    marker = None
+    # NOTE: a small dedicated pool, so that a large evaluation does not
+    # starve introspection and processing in the shared executor
+    with futurist.GreenThreadPoolExecutor(
+            max_workers=_EVALUATION_WORKERS) as pool:
+        while True:
+            # NOTE: keyset pagination on UUIDs, so that nodes removed in the
+            # meantime do not break the walk
+            query = db.model_query(db.Node).order_by(db.Node.uuid)
+            if marker is not None:
+                query = query.filter(db.Node.uuid > marker)
+            nodes = [node_cache.NodeInfo.from_row(row)
+                     for row in query.limit(batch_size)]
+            if not nodes:
+                break
+            marker = nodes[-1].uuid
+            total += len(nodes)
+
+            futures = [pool.submit(_get_stored_data, node.uuid)
+                       for node in nodes]
+            for node_info, future in zip(nodes, futures):
+                data = future.result()
+                if data is None:
+                    without_data += 1
+                    continue
+
+                context = _EvaluationContext(node_info, data)
+                try:
+                    candidates = rule_set.candidates(context)
+                except Exception as exc:
+                    LOG.warning('Failed to find candidate rules: %s', exc,
+                                node_info=node_info)
+                    errors.append({'node': node_info.uuid, 'rule': None,
+                                   'error': six.text_type(exc)})
+                    continue
+
+                for rule in candidates:
+                    try:
+                        matched = rule.check_conditions(node_info, data,
+                                                        context=context)
+                    except Exception as exc:
+                        LOG.warning('Failed to evaluate rule %(rule)s: '
+                                    '%(error)s',
+                                    {'rule': rule.uuid, 'error': exc},
+                                    node_info=node_info)
+                        errors.append({'node': node_info.uuid,
+                                       'rule': rule.uuid,
+                                       'error': six.text_type(exc)})
+                        continue
+                    if matched:
+                        matches[rule.uuid].append(node_info.uuid)
+
+            if len(nodes) < batch_size:
+                break
+
+    LOG.info('Evaluated %(rules)d rule(s) against %(nodes)d node(s), '
+             '%(without)d of them without processed introspection data',
+             {'rules': len(candidate_rules), 'nodes': total,
+              'without': without_data})
+    return {
+        'nodes': total,
+        'nodes_without_data': without_data,
+        'rules': [dict(rule.as_dict(short=True),
+                       matches=len(matches[rule.uuid]),
+                       nodes=matches[rule.uuid])
+                  for rule in candidate_rules],
+        'errors': errors,
+    }
@@ -25,12 +25,16 @@ from oslo_utils import uuidutils
 from oslotest import base as test_base
 
 from ironic_inspector.common import i18n
+from ironic_inspector.common import port_cache
 import ironic_inspector.conf
 from ironic_inspector.conf import opts as conf_opts
 from ironic_inspector import db
 from ironic_inspector import introspection_state as istate
 from ironic_inspector import node_cache
 from ironic_inspector.plugins import base as plugins_base
+from ironic_inspector import process
+from ironic_inspector.pxe_filter import base as pxe_filter
+from ironic_inspector import rules
 from ironic_inspector.test.unit import policy_fixture
 from ironic_inspector import utils
 
@@ -52,6 +56,10 @@ class BaseTest(test_base.BaseTestCase):
         self.addCleanup(engine.dispose)
         plugins_base.reset()
         node_cache._SEMAPHORES = lockutils.Semaphores()
+        process._CONTINUE_CACHE.clear()
+        rules._RULE_SET = None
+        pxe_filter._DRIVER_MANAGER = None
+        port_cache._CACHE = None
         patch = mock.patch.object(i18n, '_', lambda s: s)
         patch.start()
         # 'p=patch' magic is due to how closures work
@@ -65,6 +73,7 @@ class BaseTest(test_base.BaseTestCase):
         self.cfg.set_default('connection', "sqlite:///", group='database')
         self.cfg.set_default('slave_connection', None, group='database')
         self.cfg.set_default('max_retries', 10, group='database')
+        self.cfg.set_default('driver', 'noop', group='pxe_filter')
         conf_opts.parse_args([], default_config_files=[])
         self.policy = self.useFixture(policy_fixture.PolicyFixture())
 
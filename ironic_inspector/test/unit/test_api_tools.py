@@ -134,3 +134,26 @@ class LimitFieldTestCase(test_base.BaseTest):
     def test_limit_invalid_value(self, get_mock):
         six.assertRaisesRegex(self, utils.Error, 'Bad request',
                               api_tools.limit_field)
+
+
+class FieldsFieldTestCase(test_base.BaseTest):
+    @mock_test_field(return_value='root_disk, inventory.disks')
+    def test_dotted(self, get_mock):
+        self.assertEqual([('root_disk',), ('inventory', 'disks')],
+                         api_tools.fields_field())
+
+    @mock_test_field(return_value='/inventory/disks,/a~1b/c~0d')
+    def test_json_pointer(self, get_mock):
+        self.assertEqual([('inventory', 'disks'), ('a/b', 'c~d')],
+                         api_tools.fields_field())
+
+    @mock_test_field(return_value='inventory..disks')
+    def test_invalid(self, get_mock):
+        six.assertRaisesRegex(self, utils.Error,
+                              'Invalid field inventory..disks',
+                              api_tools.fields_field)
+
+    @mock_test_field(return_value='root_disk,')
+    def test_empty(self, get_mock):
+        six.assertRaisesRegex(self, utils.Error, 'Invalid field',
+                              api_tools.fields_field)
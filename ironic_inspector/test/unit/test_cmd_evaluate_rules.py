@@ -0,0 +1,94 @@
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import json
+import os
+import tempfile
+
+import fixtures
+from oslo_config import cfg
+import six
+
+from ironic_inspector.cmd import evaluate_rules
+from ironic_inspector import rules
+from ironic_inspector.test import base as test_base
+from ironic_inspector import utils
+
+
+class TestEvaluateRulesCommand(test_base.BaseTest):
+    def setUp(self):
+        super(TestEvaluateRulesCommand, self).setUp()
+        # NOTE: the global configuration is already parsed by the test base
+        self.conf = cfg.ConfigOpts()
+        self.conf.register_cli_opts(evaluate_rules._OPTS)
+        self.useFixture(fixtures.MockPatchObject(
+            evaluate_rules, 'CONF', self.conf))
+        self.useFixture(fixtures.MockPatchObject(
+            evaluate_rules, '_setup_logger', autospec=True))
+        self.mock_evaluate = self.useFixture(fixtures.MockPatchObject(
+            rules, 'evaluate', autospec=True)).mock
+        self.result = {
+            'nodes': 2, 'nodes_without_data': 0, 'errors': [],
+            'rules': [{'uuid': 'uuid1', 'description': 'd', 'matches': 1,
+                       'nodes': ['node1']}]}
+        self.mock_evaluate.return_value = self.result
+        self.stdout = self.useFixture(fixtures.MockPatch(
+            'sys.stdout', new_callable=six.StringIO)).mock
+        self.stderr = self.useFixture(fixtures.MockPatch(
+            'sys.stderr', new_callable=six.StringIO)).mock
+
+    def test_stored_rules(self):
+        self.assertIsNone(evaluate_rules.main())
+
+        self.mock_evaluate.assert_called_once_with(None, batch_size=100)
+        output = json.loads(self.stdout.getvalue())
+        self.assertEqual([{'uuid': 'uuid1', 'description': 'd',
+                           'matches': 1}],
+                         output['rules'])
+
+    def test_show_nodes(self):
+        self.conf.set_override('show_nodes', True)
+        self.conf.set_override('batch_size', 10)
+
+        self.assertIsNone(evaluate_rules.main())
+
+        self.mock_evaluate.assert_called_once_with(None, batch_size=10)
+        self.assertEqual(self.result, json.loads(self.stdout.getvalue()))
+
+    def test_rules_file(self):
+        rules_json = [{'conditions': [], 'actions': []}]
+        fd, path = tempfile.mkstemp()
+        self.addCleanup(os.unlink, path)
+        with os.fdopen(fd, 'w') as fp:
+            json.dump({'rules': rules_json}, fp)
+        self.conf.set_override('rules_file', path)
+
+        self.assertIsNone(evaluate_rules.main())
+
+        self.mock_evaluate.assert_called_once_with(rules_json,
+                                                   batch_size=100)
+
+    def test_error(self):
+        self.mock_evaluate.side_effect = utils.Error(u'bad rule \u2603')
+
+        self.assertEqual(1, evaluate_rules.main())
+
+        self.assertEqual(u'bad rule \u2603\n', self.stderr.getvalue())
+        self.assertEqual('', self.stdout.getvalue())
+
+    def test_interrupted(self):
+        self.mock_evaluate.side_effect = KeyboardInterrupt()
+
+        self.assertEqual(130, evaluate_rules.main())
+
+        self.assertIn('terminating', self.stderr.getvalue())
@@ -11,7 +11,9 @@
 # under the License.
 
 
+import fixtures
 import mock
+from oslo_config import cfg
 
 from ironic_inspector import db
 from ironic_inspector.test import base as test_base
@@ -29,6 +31,26 @@ class TestDB(test_base.NodeTest):
         mock_session.query.assert_called_once_with('db.Node')
         self.assertEqual(fake_query, query)
 
+    @mock.patch.object(db, 'get_reader_session', autospec=True)
+    @mock.patch.object(db, 'get_replica_session', autospec=True)
+    def test_model_query_replica(self, mock_replica, mock_reader):
+        mock_session = mock_replica.return_value
+
+        query = db.model_query('db.Node', replica=True)
+
+        mock_replica.assert_called_once_with()
+        mock_reader.assert_not_called()
+        self.assertEqual(mock_session.query.return_value, query)
+
+    @mock.patch.object(db, 'get_writer_session', autospec=True)
+    def test_ensure_transaction_last_write(self, mock_writer):
+        with mock.patch.object(db.timeutils, 'now', autospec=True,
+                               return_value=42):
+            with db.ensure_transaction():
+                pass
+
+        self.assertEqual(42, db._LAST_WRITE)
+
     @mock.patch.object(db, 'get_writer_session', autospec=True)
     def test_ensure_transaction_new_session(self, mock_writer):
         mock_session = mock_writer.return_value
@@ -59,12 +81,14 @@ class TestDB(test_base.NodeTest):
     @mock.patch.object(db, 'get_context_manager', autospec=True)
     def test_get_reader_session(self, mock_cnxt_mgr):
         mock_cnxt = mock_cnxt_mgr.return_value
-        mock_sess_maker = mock_cnxt.reader.get_sessionmaker.return_value
+        # the primary database
+        mock_sess_maker = mock_cnxt.writer.get_sessionmaker.return_value
 
         session = db.get_reader_session()
 
         mock_sess_maker.assert_called_once_with()
         self.assertEqual(mock_sess_maker.return_value, session)
+        mock_cnxt.reader.get_sessionmaker.assert_not_called()
 
     @mock.patch.object(db, 'get_context_manager', autospec=True)
     def test_get_writer_session(self, mock_cnxt_mgr):
@@ -75,3 +99,136 @@ class TestDB(test_base.NodeTest):
 
         mock_sess_maker.assert_called_once_with()
         self.assertEqual(mock_sess_maker.return_value, session)
+
+
+class TestRequestSession(test_base.NodeTest):
+    def test_bound(self):
+        with db.request_session() as session:
+            self.assertIs(session, db.get_writer_session())
+            self.assertIs(session, db.get_reader_session())
+            with db.ensure_transaction() as txn_session:
+                self.assertIs(session, txn_session)
+            with db.request_session() as nested:
+                self.assertIs(session, nested)
+            # still bound after the nested block
+            self.assertIs(session, db.get_writer_session())
+
+        self.assertIsNot(session, db.get_writer_session())
+
+    def test_closed(self):
+        with mock.patch.object(db, 'get_context_manager',
+                               autospec=True) as mock_cnxt_mgr:
+            mock_session = (mock_cnxt_mgr.return_value.writer.
+                            get_sessionmaker.return_value.return_value)
+            with db.request_session():
+                mock_session.close.assert_not_called()
+
+        mock_session.close.assert_called_once_with()
+
+    def test_standalone(self):
+        with db.request_session() as bound:
+            with db.standalone_session() as session:
+                self.assertIsNot(bound, session)
+            self.assertIs(bound, db.get_writer_session())
+
+    def test_standalone_closed(self):
+        with mock.patch.object(db, 'get_context_manager',
+                               autospec=True) as mock_cnxt_mgr:
+            mock_session = (mock_cnxt_mgr.return_value.writer.
+                            get_sessionmaker.return_value.return_value)
+            with db.standalone_session():
+                mock_session.close.assert_not_called()
+
+        mock_session.close.assert_called_once_with()
+
+    def test_unbound_on_failure(self):
+        def _fail():
+            with db.request_session() as session:
+                raise RuntimeError(session)
+
+        exc = self.assertRaises(RuntimeError, _fail)
+
+        self.assertIsNot(exc.args[0], db.get_writer_session())
+
+    def test_decorator(self):
+        @db.with_request_session
+        def func(arg):
+            return arg, db.get_reader_session(), db.get_writer_session()
+
+        arg, reader, writer = func(42)
+
+        self.assertEqual(42, arg)
+        self.assertIs(reader, writer)
+
+    def test_query(self):
+        with db.request_session():
+            with db.ensure_transaction() as session:
+                db.Node(uuid='uuid', state='starting').save(session)
+            row = db.model_query(db.Node).filter_by(uuid='uuid').one()
+            # the same object from the identity map
+            self.assertIs(row, db.model_query(db.Node).get('uuid'))
+
+    def test_expire(self):
+        with db.request_session() as session:
+            with mock.patch.object(session, 'expire_all',
+                                   autospec=True) as mock_expire:
+                db.expire_request_session()
+
+        mock_expire.assert_called_once_with()
+
+    def test_expire_unbound(self):
+        # does nothing
+        db.expire_request_session()
+
+
+@mock.patch.object(db, 'get_reader_session', autospec=True)
+@mock.patch.object(db, 'get_context_manager', autospec=True)
+class TestGetReplicaSession(test_base.BaseTest):
+    def setUp(self):
+        super(TestGetReplicaSession, self).setUp()
+        cfg.CONF.set_override('slave_connection', 'sqlite://', 'database')
+        self.addCleanup(setattr, db, '_LAST_WRITE', db._LAST_WRITE)
+        db._LAST_WRITE = None
+        self.mock_now = self.useFixture(fixtures.MockPatchObject(
+            db.timeutils, 'now', autospec=True)).mock
+        self.mock_now.return_value = 100
+
+    def test_replica(self, mock_cnxt_mgr, mock_reader):
+        mock_sess_maker = (mock_cnxt_mgr.return_value.reader.
+                           get_sessionmaker.return_value)
+
+        session = db.get_replica_session()
+
+        self.assertEqual(mock_sess_maker.return_value, session)
+        mock_reader.assert_not_called()
+
+    def test_no_replica(self, mock_cnxt_mgr, mock_reader):
+        cfg.CONF.clear_override('slave_connection', 'database')
+
+        session = db.get_replica_session()
+
+        self.assertEqual(mock_reader.return_value, session)
+        mock_cnxt_mgr.assert_not_called()
+
+    def test_recent_write(self, mock_cnxt_mgr, mock_reader):
+        db._LAST_WRITE = 95
+
+        session = db.get_replica_session()
+
+        self.assertEqual(mock_reader.return_value, session)
+        mock_cnxt_mgr.assert_not_called()
+
+    def test_old_write(self, mock_cnxt_mgr, mock_reader):
+        db._LAST_WRITE = 89
+
+        db.get_replica_session()
+
+        mock_reader.assert_not_called()
+
+    def test_no_lag(self, mock_cnxt_mgr, mock_reader):
+        cfg.CONF.set_override('database_replica_lag', 0)
+        db._LAST_WRITE = 100
+
+        db.get_replica_session()
+
+        mock_reader.assert_not_called()
@@ -19,13 +19,14 @@ import datetime
 import os
 
 import fixtures
-from ironicclient import exc as ironic_exc
 import mock
 from oslo_config import cfg
 import six
 
 from ironic_inspector.common import ironic as ir_utils
+from ironic_inspector.common import port_cache
 from ironic_inspector import node_cache
+from ironic_inspector.pxe_filter import base as pxe_filter
 from ironic_inspector.pxe_filter import dnsmasq
 from ironic_inspector.test import base as test_base
 
@@ -62,6 +63,9 @@ class TestDnsmasqDriverAPI(DnsmasqTestBase):
         self.driver._tear_down = mock.Mock()
         self.mock__purge_dhcp_hostsdir = self.useFixture(
             fixtures.MockPatchObject(dnsmasq, '_purge_dhcp_hostsdir')).mock
+        self.mock__get_black_white_lists = self.useFixture(
+            fixtures.MockPatchObject(dnsmasq, '_get_black_white_lists')).mock
+        self.mock__get_black_white_lists.return_value = (set(), set())
         self.mock_ironic = mock.Mock()
         get_client_mock = self.useFixture(
             fixtures.MockPatchObject(ir_utils, 'get_client')).mock
@@ -77,16 +81,24 @@ class TestDnsmasqDriverAPI(DnsmasqTestBase):
         self.driver.init_filter()
 
         self.mock__purge_dhcp_hostsdir.assert_called_once_with()
-        self.driver._sync.assert_called_once_with(self.mock_ironic)
+        self.mock__get_black_white_lists.assert_called_once_with()
+        self.assertEqual({}, self.driver._records)
+        self.driver._sync.assert_called_once_with(self.mock_ironic,
+                                                  reload=False)
         self.mock__execute.assert_called_once_with(self.start_command)
 
     def test_sync(self):
         self.driver.init_filter()
         # NOTE(milan) init_filter performs an initial sync
         self.driver._sync.reset_mock()
+        self.driver._gather = mock.Mock(return_value='data')
         self.driver.sync(self.mock_ironic)
 
-        self.driver._sync.assert_called_once_with(self.mock_ironic)
+        self.driver._gather.assert_called_once_with(self.mock_ironic,
+                                                    mock.ANY)
+        self.driver._sync.assert_called_once_with(self.mock_ironic, mock.ANY)
+        gathered = self.driver._sync.call_args[0][1]
+        self.assertEqual('data', gathered.data)
 
     def test_tear_down_filter(self):
         mock_reset = self.useFixture(
@@ -104,6 +116,7 @@ class TestDnsmasqDriverAPI(DnsmasqTestBase):
 
         self.mock__execute.assert_called_once_with(
             self.stop_command, ignore_errors=True)
+        self.assertIsNone(self.driver._records)
 
 
 class TestExclusiveWriteOrPass(test_base.BaseTest):
@@ -251,35 +264,15 @@ class TestMACHandlers(test_base.BaseTest):
             'A %s record for all unknown hosts using wildcard mac '
             'created', 'blacklist')
 
-    def test__configure_removedlist_whitelist(self):
-        self.mock_introspection_active.return_value = True
-        self.mock_stat.return_value.st_size = dnsmasq._MACBL_LEN
-
-        dnsmasq._configure_removedlist({self.mac})
-
-        self.mock_join.assert_called_with(self.dhcp_hostsdir, self.mac)
-        self.mock__exclusive_write_or_pass.assert_called_once_with(
-            self.mock_join.return_value, '%s\n' % self.mac)
-
-    def test__configure_removedlist_blacklist(self):
-        self.mock_introspection_active.return_value = False
-        self.mock_stat.return_value.st_size = dnsmasq._MACWL_LEN
-
-        dnsmasq._configure_removedlist({self.mac})
-
-        self.mock_join.assert_called_with(self.dhcp_hostsdir, self.mac)
-        self.mock__exclusive_write_or_pass.assert_called_once_with(
-            self.mock_join.return_value, '%s,ignore\n' % self.mac)
-
     def test__whitelist_mac(self):
-        dnsmasq._whitelist_mac(self.mac)
+        self.assertTrue(dnsmasq._whitelist_mac(self.mac))
 
         self.mock_join.assert_called_once_with(self.dhcp_hostsdir, self.mac)
         self.mock__exclusive_write_or_pass.assert_called_once_with(
             self.mock_join.return_value, '%s\n' % self.mac)
 
     def test__blacklist_mac(self):
-        dnsmasq._blacklist_mac(self.mac)
+        self.assertTrue(dnsmasq._blacklist_mac(self.mac))
 
         self.mock_join.assert_called_once_with(self.dhcp_hostsdir, self.mac)
         self.mock__exclusive_write_or_pass.assert_called_once_with(
@@ -305,6 +298,10 @@ class TestMACHandlers(test_base.BaseTest):
         self.mock_join.assert_called_with(self.dhcp_hostsdir, self.mac)
         self.mock_stat.assert_called_with(self.mock_join.return_value)
 
+    def test__blacklist_mac_failed(self):
+        self.mock__exclusive_write_or_pass.return_value = False
+        self.assertFalse(dnsmasq._blacklist_mac(self.mac))
+
     def test__get_no_blacklist(self):
         self.mock_listdir.return_value = [self.mac]
         self.mock_stat.return_value.st_size = len('%s\n' % self.mac)
@@ -356,8 +353,6 @@ class TestSync(DnsmasqTestBase):
             fixtures.MockPatchObject(dnsmasq, '_blacklist_mac')).mock
         self.mock__configure_unknown_hosts = self.useFixture(
             fixtures.MockPatchObject(dnsmasq, '_configure_unknown_hosts')).mock
-        self.mock__configure_removedlist = self.useFixture(
-            fixtures.MockPatchObject(dnsmasq, '_configure_removedlist')).mock
 
         self.mock_ironic = mock.Mock()
         self.mock_utcnow = self.useFixture(
@@ -366,6 +361,7 @@ class TestSync(DnsmasqTestBase):
         self.timestamp_end = (self.timestamp_start +
                               datetime.timedelta(seconds=42))
         self.mock_utcnow.side_effect = [self.timestamp_start,
+                                        self.timestamp_start,
                                         self.timestamp_end]
         self.mock_log = self.useFixture(
             fixtures.MockPatchObject(dnsmasq, 'LOG')).mock
@@ -377,11 +373,12 @@ class TestSync(DnsmasqTestBase):
         self.ironic_macs = {'new_mac', 'active_mac'}
         self.active_macs = {'active_mac'}
         self.blacklist = {'gone_mac', 'active_mac'}
-        self.whitelist = {}
+        self.whitelist = set()
         self.mock__get_black_white_lists.return_value = (self.blacklist,
                                                          self.whitelist)
-        self.mock_ironic.port.list.return_value = [
-            mock.Mock(address=address) for address in self.ironic_macs]
+        self.mock_refresh = self.useFixture(
+            fixtures.MockPatchObject(port_cache, 'refresh')).mock
+        self.mock_refresh.return_value.macs.return_value = self.ironic_macs
         self.mock_active_macs.return_value = self.active_macs
         self.mock_should_enable_unknown_hosts = self.useFixture(
             fixtures.MockPatchObject(dnsmasq,
@@ -393,52 +390,317 @@ class TestSync(DnsmasqTestBase):
 
         self.driver._sync(self.mock_ironic)
         self.mock__configure_unknown_hosts.assert_called_once_with()
+        self.mock__whitelist_mac.assert_has_calls([mock.call('active_mac'),
+                                                   mock.call('gone_mac')],
+                                                  any_order=True)
 
     def test__sync_not_enable_unknown_hosts(self):
         self.mock_should_enable_unknown_hosts.return_value = False
 
         self.driver._sync(self.mock_ironic)
         self.mock__configure_unknown_hosts.assert_called_once_with()
+        self.mock__whitelist_mac.assert_called_once_with('active_mac')
+        # already blacklisted
+        self.mock__blacklist_mac.assert_called_once_with('new_mac')
 
     def test__sync(self):
         self.driver._sync(self.mock_ironic)
 
-        self.mock__whitelist_mac.assert_called_once_with('active_mac')
+        self.assertEqual(2, self.mock__whitelist_mac.call_count)
+        self.mock__whitelist_mac.assert_has_calls([mock.call('active_mac'),
+                                                   mock.call('gone_mac')],
+                                                  any_order=True)
         self.mock__blacklist_mac.assert_called_once_with('new_mac')
 
-        self.mock_ironic.port.list.assert_called_once_with(limit=0,
-                                                           fields=['address'])
+        self.mock_refresh.assert_called_once_with(self.mock_ironic)
         self.mock_active_macs.assert_called_once_with()
         self.mock__get_black_white_lists.assert_called_once_with()
         self.mock__configure_unknown_hosts.assert_called_once_with()
-        self.mock__configure_removedlist.assert_called_once_with({'gone_mac'})
         self.mock_log.debug.assert_has_calls([
             mock.call('Syncing the driver'),
             mock.call('The dnsmasq PXE filter was synchronized (took %s)',
                       self.timestamp_end - self.timestamp_start)
         ])
+        self.assertEqual({'active_mac': dnsmasq._WHITELISTED,
+                          'new_mac': dnsmasq._BLACKLISTED,
+                          'gone_mac': dnsmasq._WHITELISTED},
+                         self.driver._records)
+
+    def test__sync_only_writes_changes(self):
+        self.mock_utcnow.side_effect = None
+        self.mock_utcnow.return_value = self.timestamp_start
+        self.driver._sync(self.mock_ironic)
+        self.mock__whitelist_mac.reset_mock()
+        self.mock__blacklist_mac.reset_mock()
 
-    @mock.patch('time.sleep', lambda _x: None)
-    def test__sync_with_port_list_retries(self):
-        self.mock_ironic.port.list.side_effect = [
-            ironic_exc.ConnectionRefused('boom'),
-            [mock.Mock(address=address) for address in self.ironic_macs]
-        ]
         self.driver._sync(self.mock_ironic)
 
-        self.mock__whitelist_mac.assert_called_once_with('active_mac')
+        self.mock__whitelist_mac.assert_not_called()
+        self.mock__blacklist_mac.assert_not_called()
+        # The records are not re-read from the disk
+        self.mock__get_black_white_lists.assert_called_once_with()
+
+        # Introspection finished
+        self.mock_active_macs.return_value = set()
+        self.driver._sync(self.mock_ironic)
+
+        self.mock__whitelist_mac.assert_not_called()
+        self.mock__blacklist_mac.assert_called_once_with('active_mac')
+
+    def test__sync_failed_write_retried(self):
+        self.mock_utcnow.side_effect = None
+        self.mock_utcnow.return_value = self.timestamp_start
+        self.mock__blacklist_mac.return_value = False
+        self.driver._sync(self.mock_ironic)
         self.mock__blacklist_mac.assert_called_once_with('new_mac')
+        self.assertNotIn('new_mac', self.driver._records)
+
+        self.mock__blacklist_mac.return_value = True
+        self.driver._sync(self.mock_ironic)
+        self.assertEqual(2, self.mock__blacklist_mac.call_count)
+        self.assertEqual(dnsmasq._BLACKLISTED,
+                         self.driver._records['new_mac'])
+
+    def test__sync_verify(self):
+        CONF.set_override('verify_interval', 60, 'dnsmasq_pxe_filter')
+        self.mock_utcnow.side_effect = None
+        self.mock_utcnow.return_value = self.timestamp_start
+        self.driver._sync(self.mock_ironic)
+        self.mock__whitelist_mac.reset_mock()
+        self.mock__blacklist_mac.reset_mock()
+
+        # Somebody has removed a record
+        self.mock__get_black_white_lists.return_value = (
+            {'active_mac'}, {'active_mac', 'gone_mac'})
+        self.mock_utcnow.return_value = (self.timestamp_start +
+                                         datetime.timedelta(seconds=61))
+        with mock.patch.object(dnsmasq.timeutils, 'is_older_than',
+                               autospec=True) as mock_older, \
+                mock.patch.object(pxe_filter.metrics_utils,
+                                  'get_metrics_logger',
+                                  autospec=True) as mock_metrics:
+            mock_older.return_value = True
+            self.driver._sync(self.mock_ironic)
+
+        self.assertEqual(2, self.mock__get_black_white_lists.call_count)
+        self.mock__blacklist_mac.assert_called_once_with('new_mac')
+        self.mock__whitelist_mac.assert_not_called()
+        self.assertTrue(self.mock_log.warning.called)
+        mock_metrics.assert_called_once_with(
+            'ironic_inspector.pxe_filter.dnsmasq')
+        metrics = mock_metrics.return_value
+        metrics.send_gauge.assert_called_once_with('drift', 1)
+        metrics.send_counter.assert_has_calls([
+            mock.call('sync.macs_added', 1),
+            mock.call('sync.macs_removed', 0),
+            mock.call('sync.changed', 1)])
+
+    def test__sync_shared_hostsdir(self):
+        CONF.set_override('purge_dhcp_hostsdir', False, 'dnsmasq_pxe_filter')
+        self.mock_utcnow.side_effect = None
+        self.mock_utcnow.return_value = self.timestamp_start
+        self.driver._sync(self.mock_ironic)
+        self.driver._sync(self.mock_ironic)
+
+        self.assertEqual(2, self.mock__get_black_white_lists.call_count)
+
+    def _prepare_update(self, state=pxe_filter.States.initialized):
+        self.mock_utcnow.side_effect = None
+        self.mock_utcnow.return_value = self.timestamp_start
+        mock_fsm = self.useFixture(
+            fixtures.MockPatchObject(dnsmasq.DnsmasqFilter, 'fsm')).mock
+        mock_fsm.current_state = state
+
+    def test_on_introspection_started(self):
+        self._prepare_update()
+
+        self.driver.on_introspection_started(['new_mac', 'active_mac'])
 
-        self.mock_ironic.port.list.assert_called_with(limit=0,
-                                                      fields=['address'])
-        self.mock_active_macs.assert_called_once_with()
         self.mock__get_black_white_lists.assert_called_once_with()
-        self.mock__configure_removedlist.assert_called_once_with({'gone_mac'})
-        self.mock_log.debug.assert_has_calls([
-            mock.call('Syncing the driver'),
-            mock.call('The dnsmasq PXE filter was synchronized (took %s)',
-                      self.timestamp_end - self.timestamp_start)
-        ])
+        self.mock__whitelist_mac.assert_has_calls([mock.call('new_mac'),
+                                                   mock.call('active_mac')],
+                                                  any_order=True)
+        self.mock__blacklist_mac.assert_not_called()
+        self.mock__configure_unknown_hosts.assert_called_once_with()
+        self.mock_refresh.assert_not_called()
+        self.assertEqual({'active_mac': dnsmasq._WHITELISTED,
+                          'new_mac': dnsmasq._WHITELISTED,
+                          'gone_mac': dnsmasq._BLACKLISTED},
+                         self.driver._records)
+
+    def test_on_introspection_finished(self):
+        self._prepare_update()
+        self.driver._sync(self.mock_ironic)
+        self.mock__whitelist_mac.reset_mock()
+        self.mock__blacklist_mac.reset_mock()
+        self.mock__configure_unknown_hosts.reset_mock()
+        # another node on introspection shares the MAC
+        self.mock_active_macs.return_value = {'gone_mac'}
+
+        self.driver.on_introspection_finished(['active_mac', 'gone_mac'])
+
+        self.mock__blacklist_mac.assert_called_once_with('active_mac')
+        self.mock__whitelist_mac.assert_not_called()
+        self.mock__configure_unknown_hosts.assert_called_once_with()
+        self.mock__get_black_white_lists.assert_called_once_with()
+        self.assertEqual(dnsmasq._BLACKLISTED,
+                         self.driver._records['active_mac'])
+
+    def test_on_introspection_started_uninitialized(self):
+        self._prepare_update(pxe_filter.States.uninitialized)
+
+        self.driver.on_introspection_started(['new_mac'])
+
+        self.mock__whitelist_mac.assert_not_called()
+        self.mock__configure_unknown_hosts.assert_not_called()
+
+
+class TestHostsfileMode(DnsmasqTestBase):
+    def setUp(self):
+        super(TestHostsfileMode, self).setUp()
+        self.tempdir = self.useFixture(fixtures.TempDir()).path
+        self.hostsfile = os.path.join(self.tempdir, 'dhcp-hostsfile')
+        CONF.set_override('mode', 'hostsfile', 'dnsmasq_pxe_filter')
+        CONF.set_override('dhcp_hostsfile', self.hostsfile,
+                          'dnsmasq_pxe_filter')
+        CONF.set_override('dnsmasq_reload_command', '/bin/reload',
+                          'dnsmasq_pxe_filter')
+        self.mock__execute = self.useFixture(
+            fixtures.MockPatchObject(dnsmasq, '_execute')).mock
+        self.mock__configure_unknown_hosts = self.useFixture(
+            fixtures.MockPatchObject(dnsmasq, '_configure_unknown_hosts')).mock
+        self.mock_refresh = self.useFixture(
+            fixtures.MockPatchObject(port_cache, 'refresh')).mock
+        self.mock_refresh.return_value.macs.return_value = {'mac1', 'mac2'}
+        self.mock_active_macs = self.useFixture(
+            fixtures.MockPatchObject(node_cache, 'active_macs')).mock
+        self.mock_active_macs.return_value = {'mac2'}
+        self.mock_should_enable_unknown_hosts = self.useFixture(
+            fixtures.MockPatchObject(dnsmasq,
+                                     '_should_enable_unknown_hosts')).mock
+        self.mock_should_enable_unknown_hosts.return_value = False
+        self.mock_ironic = mock.Mock()
+
+    def _read(self):
+        with open(self.hostsfile) as f:
+            return f.read()
+
+    def test__sync(self):
+        self.driver._sync(self.mock_ironic)
+
+        self.assertEqual('mac1,ignore\nmac2\n*:*:*:*:*:*,ignore\n',
+                         self._read())
+        self.assertEqual([self.hostsfile[len(self.tempdir) + 1:]],
+                         os.listdir(self.tempdir))
+        self.mock__execute.assert_called_once_with('/bin/reload')
+        self.mock__configure_unknown_hosts.assert_not_called()
+
+    def test__sync_no_changes(self):
+        self.driver._sync(self.mock_ironic)
+        self.mock__execute.reset_mock()
+
+        with mock.patch.object(dnsmasq, '_write_hostsfile',
+                               autospec=True) as mock_write:
+            self.driver._sync(self.mock_ironic)
+
+        mock_write.assert_not_called()
+        self.mock__execute.assert_not_called()
+
+    def test__sync_unknown_hosts_changed(self):
+        self.driver._sync(self.mock_ironic)
+        self.mock_should_enable_unknown_hosts.return_value = True
+
+        self.driver._sync(self.mock_ironic)
+
+        self.assertEqual('mac1,ignore\nmac2\n*:*:*:*:*:*\n', self._read())
+        self.assertEqual(2, self.mock__execute.call_count)
+
+    def test__sync_existing_file(self):
+        with open(self.hostsfile, 'w') as f:
+            f.write('mac1,ignore\nmac2\nmac3,ignore\n*:*:*:*:*:*,ignore\n')
+        self.mock_should_enable_unknown_hosts.return_value = True
+
+        self.driver._sync(self.mock_ironic)
+
+        self.assertEqual({'mac1': dnsmasq._BLACKLISTED,
+                          'mac2': dnsmasq._WHITELISTED,
+                          'mac3': dnsmasq._WHITELISTED},
+                         self.driver._records)
+        self.assertEqual('mac1,ignore\nmac2\nmac3\n*:*:*:*:*:*\n',
+                         self._read())
+
+    def test__sync_write_failure(self):
+        self.driver._sync(self.mock_ironic)
+        self.mock_active_macs.return_value = set()
+
+        with mock.patch.object(dnsmasq, '_write_hostsfile',
+                               autospec=True) as mock_write:
+            mock_write.side_effect = IOError()
+            self.assertRaises(IOError, self.driver._sync, self.mock_ironic)
+
+        # re-read on the next sync
+        self.assertIsNone(self.driver._records)
+        self.driver._sync(self.mock_ironic)
+        self.assertEqual('mac1,ignore\nmac2,ignore\n*:*:*:*:*:*,ignore\n',
+                         self._read())
+
+    @mock.patch.object(ir_utils, 'get_client', autospec=True)
+    def test_init_filter(self, mock_get_client):
+        with open(self.hostsfile, 'w') as f:
+            f.write('stale,ignore\n')
+
+        self.driver.init_filter()
+
+        self.assertEqual('mac1,ignore\nmac2\n*:*:*:*:*:*,ignore\n',
+                         self._read())
+        mock_get_client.assert_called_once_with()
+
+    @mock.patch.object(ir_utils, 'get_client', autospec=True)
+    def test_init_filter_call_order(self, mock_get_client):
+        CONF.set_override('dnsmasq_start_command', '/bin/start',
+                          'dnsmasq_pxe_filter')
+        calls = []
+
+        def _execute(cmd=None, ignore_errors=False):
+            if cmd == '/bin/reload':
+                # NOTE: dnsmasq is not running yet, so e.g. kill -HUP fails
+                raise dnsmasq.processutils.ProcessExecutionError()
+            calls.append((cmd, os.path.exists(self.hostsfile)))
+
+        self.mock__execute.side_effect = _execute
+
+        self.driver.init_filter()
+
+        # the file is written before dnsmasq is started, without a reload
+        self.assertEqual([('/bin/start', True)], calls)
+        self.mock__execute.assert_called_once_with('/bin/start')
+
+    @mock.patch.object(dnsmasq, 'LOG', autospec=True)
+    @mock.patch.object(ir_utils, 'get_client', autospec=True)
+    def test_init_filter_no_reload_command(self, mock_get_client, mock_log):
+        CONF.set_override('dnsmasq_reload_command', '', 'dnsmasq_pxe_filter')
+
+        self.driver.init_filter()
+
+        mock_log.warning.assert_called_once_with(mock.ANY, self.hostsfile)
+
+    def test_on_introspection_finished(self):
+        self.driver._sync(self.mock_ironic)
+        self.mock__execute.reset_mock()
+        self.mock_active_macs.return_value = set()
+        self.useFixture(fixtures.MockPatchObject(
+            dnsmasq.DnsmasqFilter, 'fsm')).mock.current_state = (
+                pxe_filter.States.initialized)
+
+        with mock.patch.object(dnsmasq, '_write_hostsfile',
+                               autospec=True) as mock_write:
+            self.driver.on_introspection_finished(['mac1', 'mac2'])
+
+        # a single write for all the MACs
+        mock_write.assert_called_once_with(
+            {'mac1': dnsmasq._BLACKLISTED, 'mac2': dnsmasq._BLACKLISTED},
+            dnsmasq._BLACKLIST_UNKNOWN_HOSTS)
+        self.mock__execute.assert_called_once_with('/bin/reload')
 
 
 class Test_Execute(test_base.BaseTest):
@@ -45,6 +45,7 @@ class BaseTest(test_base.NodeTest):
             pxe_filter, 'driver', autospec=True))
         driver_mock = driver_fixture.mock.return_value
         self.sync_filter_mock = driver_mock.sync
+        self.start_filter_mock = driver_mock.on_introspection_started
 
     def _prepare(self, client_mock):
         cli = client_mock.return_value
@@ -72,7 +73,7 @@ class TestIntrospect(BaseTest):
         self.node_info.ports.assert_called_once_with()
         self.node_info.add_attribute.assert_called_once_with('mac',
                                                              self.macs)
-        self.sync_filter_mock.assert_called_with(cli)
+        self.start_filter_mock.assert_called_with(self.macs, cli)
         cli.node.set_boot_device.assert_called_once_with(self.uuid,
                                                          'pxe',
                                                          persistent=False)
@@ -101,7 +102,7 @@ class TestIntrospect(BaseTest):
         self.node_info.ports.assert_called_once_with()
         self.node_info.add_attribute.assert_called_once_with('mac',
                                                              self.macs)
-        self.sync_filter_mock.assert_called_with(cli)
+        self.start_filter_mock.assert_called_with(self.macs, cli)
         cli.node.set_boot_device.assert_called_once_with(self.uuid,
                                                          'pxe',
                                                          persistent=False)
@@ -127,7 +128,7 @@ class TestIntrospect(BaseTest):
         self.node_info.ports.assert_called_once_with()
         self.node_info.add_attribute.assert_called_once_with('mac',
                                                              self.macs)
-        self.sync_filter_mock.assert_called_with(cli)
+        self.start_filter_mock.assert_called_with(self.macs, cli)
         cli.node.set_boot_device.assert_called_once_with(self.uuid,
                                                          'pxe',
                                                          persistent=False)
@@ -175,7 +176,7 @@ class TestIntrospect(BaseTest):
     def test_unexpected_error(self, client_mock, start_mock):
         cli = self._prepare(client_mock)
         start_mock.return_value = self.node_info
-        self.sync_filter_mock.side_effect = RuntimeError()
+        self.start_filter_mock.side_effect = RuntimeError()
 
         introspect.introspect(self.node.uuid)
 
@@ -227,7 +228,7 @@ class TestIntrospect(BaseTest):
                                            manage_boot=True,
                                            ironic=cli)
         self.assertFalse(self.node_info.add_attribute.called)
-        self.assertFalse(self.sync_filter_mock.called)
+        self.assertFalse(self.start_filter_mock.called)
         cli.node.set_boot_device.assert_called_once_with(self.uuid,
                                                          'pxe',
                                                          persistent=False)
@@ -245,7 +246,7 @@ class TestIntrospect(BaseTest):
         self.node_info.ports.assert_called_once_with()
         self.node_info.finished.assert_called_once_with(
             introspect.istate.Events.error, error=mock.ANY)
-        self.assertEqual(0, self.sync_filter_mock.call_count)
+        self.assertEqual(0, self.start_filter_mock.call_count)
         self.assertEqual(0, cli.node.set_power_state.call_count)
         self.node_info.acquire_lock.assert_called_once_with()
         self.node_info.release_lock.assert_called_once_with()
@@ -281,7 +282,7 @@ class TestIntrospect(BaseTest):
                                introspect.introspect, self.uuid)
 
         self.assertEqual(0, self.node_info.ports.call_count)
-        self.assertEqual(0, self.sync_filter_mock.call_count)
+        self.assertEqual(0, self.start_filter_mock.call_count)
         self.assertEqual(0, cli.node.set_power_state.call_count)
         self.assertFalse(start_mock.called)
         self.assertFalse(self.node_info.acquire_lock.called)
@@ -299,7 +300,7 @@ class TestIntrospect(BaseTest):
 
         cli.node.validate.assert_called_once_with(self.uuid)
         self.assertEqual(0, self.node_info.ports.call_count)
-        self.assertEqual(0, self.sync_filter_mock.call_count)
+        self.assertEqual(0, self.start_filter_mock.call_count)
         self.assertEqual(0, cli.node.set_power_state.call_count)
         self.assertFalse(start_mock.called)
         self.assertFalse(self.node_info.acquire_lock.called)
@@ -314,7 +315,7 @@ class TestIntrospect(BaseTest):
             introspect.introspect, self.uuid)
 
         self.assertEqual(0, self.node_info.ports.call_count)
-        self.assertEqual(0, self.sync_filter_mock.call_count)
+        self.assertEqual(0, self.start_filter_mock.call_count)
         self.assertEqual(0, cli.node.set_power_state.call_count)
         self.assertFalse(start_mock.called)
         self.assertFalse(self.node_info.acquire_lock.called)
@@ -387,7 +388,7 @@ class TestIntrospect(BaseTest):
         self.node_info.ports.assert_called_once_with()
         self.node_info.add_attribute.assert_called_once_with('mac',
                                                              self.macs)
-        self.sync_filter_mock.assert_called_with(cli)
+        self.start_filter_mock.assert_called_with(self.macs, cli)
         self.assertFalse(cli.node.validate.called)
         self.assertFalse(cli.node.set_boot_device.called)
         self.assertFalse(cli.node.set_power_state.called)
@@ -417,7 +418,7 @@ class TestAbort(BaseTest):
         get_mock.assert_called_once_with(self.uuid, ironic=cli,
                                          locked=False)
         self.node_info.acquire_lock.assert_called_once_with(blocking=False)
-        self.sync_filter_mock.assert_called_once_with(cli)
+        self.assertFalse(self.sync_filter_mock.called)
         cli.node.set_power_state.assert_called_once_with(self.uuid, 'off')
         self.node_info.finished.assert_called_once_with(
             introspect.istate.Events.abort_end, error='Canceled by operator')
@@ -436,7 +437,7 @@ class TestAbort(BaseTest):
         get_mock.assert_called_once_with(self.uuid, ironic=cli,
                                          locked=False)
         self.node_info.acquire_lock.assert_called_once_with(blocking=False)
-        self.sync_filter_mock.assert_called_once_with(cli)
+        self.assertFalse(self.sync_filter_mock.called)
         self.assertFalse(cli.node.set_power_state.called)
         self.node_info.finished.assert_called_once_with(
             introspect.istate.Events.abort_end, error='Canceled by operator')
@@ -469,25 +470,6 @@ class TestAbort(BaseTest):
         self.assertEqual(0, self.node_info.finshed.call_count)
         self.assertEqual(0, self.node_info.fsm_event.call_count)
 
-    def test_firewall_update_exception(self, client_mock, get_mock):
-        cli = self._prepare(client_mock)
-        get_mock.return_value = self.node_info
-        self.node_info.acquire_lock.return_value = True
-        self.node_info.started_at = time.time()
-        self.node_info.finished_at = None
-        self.sync_filter_mock.side_effect = Exception('Boom')
-
-        introspect.abort(self.uuid)
-
-        get_mock.assert_called_once_with(self.uuid, ironic=cli,
-                                         locked=False)
-        self.node_info.acquire_lock.assert_called_once_with(blocking=False)
-        self.sync_filter_mock.assert_called_once_with(cli)
-        cli.node.set_power_state.assert_called_once_with(self.uuid, 'off')
-        self.node_info.finished.assert_called_once_with(
-            introspect.istate.Events.abort_end, error='Canceled by operator')
-        self.node_info.fsm_event.assert_has_calls(self.fsm_calls)
-
     def test_node_power_off_exception(self, client_mock, get_mock):
         cli = self._prepare(client_mock)
         get_mock.return_value = self.node_info
@@ -501,7 +483,7 @@ class TestAbort(BaseTest):
         get_mock.assert_called_once_with(self.uuid, ironic=cli,
                                          locked=False)
         self.node_info.acquire_lock.assert_called_once_with(blocking=False)
-        self.sync_filter_mock.assert_called_once_with(cli)
+        self.assertFalse(self.sync_filter_mock.called)
         cli.node.set_power_state.assert_called_once_with(self.uuid, 'off')
         self.node_info.finished.assert_called_once_with(
             introspect.istate.Events.abort_end, error='Canceled by operator')
@@ -0,0 +1,182 @@
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import fixtures
+import mock
+from oslo_config import cfg
+
+from ironic_inspector.pxe_filter import base as pxe_filter
+from ironic_inspector.pxe_filter import ipset
+from ironic_inspector.pxe_filter import iptables
+from ironic_inspector.test import base as test_base
+
+
+CONF = cfg.CONF
+
+
+class TestIpsetDriver(test_base.NodeTest):
+    def setUp(self):
+        super(TestIpsetDriver, self).setUp()
+        CONF.set_override('rootwrap_config', '/some/fake/path')
+        self.mock_fsm = self.useFixture(
+            fixtures.MockPatchObject(ipset.IpsetFilter, 'fsm')).mock
+        self.mock_fsm.current_state = pxe_filter.States.initialized
+        self.mock_call = self.useFixture(
+            fixtures.MockPatchObject(ipset.processutils, 'execute')).mock
+        self.mock_should_enable_dhcp = self.useFixture(
+            fixtures.MockPatchObject(iptables, '_should_enable_dhcp')).mock
+        self.mock_should_enable_dhcp.return_value = True
+        self.mock__get_blacklist = self.useFixture(
+            fixtures.MockPatchObject(iptables, '_get_blacklist')).mock
+        self.mock__get_blacklist.return_value = ['mac1', 'mac2']
+        self.driver = ipset.IpsetFilter()
+        self.mock_iptables = self.useFixture(
+            fixtures.MockPatchObject(self.driver, '_iptables')).mock
+        self.mock_restore_chain = self.useFixture(
+            fixtures.MockPatchObject(self.driver, '_restore_chain')).mock
+        self.mock_ironic = mock.Mock()
+        self.ipset_command = ('sudo', 'ironic-inspector-rootwrap',
+                              '/some/fake/path', 'ipset')
+
+    def assert_restore_set(self, *lines):
+        self.mock_call.assert_called_once_with(
+            *(self.ipset_command + ('restore', '-exist')),
+            process_input=''.join('%s\n' % line for line in lines))
+
+    def test_init_filter(self):
+        self.driver.init_filter()
+
+        self.mock_iptables.assert_any_call('-N', self.driver.chain)
+        self.mock_call.assert_has_calls([
+            mock.call(*(self.ipset_command +
+                        ('create', 'ironic-inspector', 'hash:mac',
+                         '-exist'))),
+            mock.call(*(self.ipset_command + ('flush', 'ironic-inspector'))),
+        ])
+
+    def test_reset(self):
+        self.driver.reset()
+
+        self.mock_iptables.assert_any_call('-F', self.driver.chain,
+                                           ignore=True)
+        self.mock_call.assert_called_once_with(
+            *(self.ipset_command + ('destroy', 'ironic-inspector')))
+
+    def test_sync(self):
+        self.driver.sync(self.mock_ironic)
+
+        self.mock_call.assert_called_once_with(
+            *(self.ipset_command + ('restore', '-exist')),
+            process_input=mock.ANY)
+        payload = self.mock_call.call_args[1]['process_input'].splitlines()
+        self.assertEqual('flush ironic-inspector', payload[0])
+        self.assertEqual(['add ironic-inspector mac1',
+                          'add ironic-inspector mac2'], sorted(payload[1:]))
+        self.mock_restore_chain.assert_called_once_with([
+            ('-A', self.driver.chain, '-m', 'set', '--match-set',
+             'ironic-inspector', 'src', '-j', 'DROP'),
+            ('-A', self.driver.chain, '-j', 'ACCEPT'),
+        ])
+        self.assertEqual({'mac1', 'mac2'}, self.driver.blacklist_cache)
+        self.assertTrue(self.driver.enabled)
+
+    def test_sync_incremental(self):
+        self.driver.sync(self.mock_ironic)
+        self.mock_call.reset_mock()
+        self.mock_restore_chain.reset_mock()
+        self.mock__get_blacklist.return_value = ['mac2', 'mac3']
+
+        self.driver.sync(self.mock_ironic)
+
+        self.assert_restore_set('add ironic-inspector mac3',
+                                'del ironic-inspector mac1')
+        self.mock_restore_chain.assert_not_called()
+        self.assertEqual({'mac2', 'mac3'}, self.driver.blacklist_cache)
+
+    def test_sync_no_changes(self):
+        self.driver.sync(self.mock_ironic)
+        self.mock_call.reset_mock()
+        self.mock_restore_chain.reset_mock()
+
+        self.driver.sync(self.mock_ironic)
+
+        self.mock_call.assert_not_called()
+        self.mock_restore_chain.assert_not_called()
+
+    def test_sync_after_disable_dhcp(self):
+        self.mock_should_enable_dhcp.return_value = False
+        self.driver.sync(self.mock_ironic)
+        self.mock_restore_chain.assert_called_once_with(
+            [('-A', self.driver.chain, '-j', 'REJECT')])
+        self.assertFalse(self.driver.enabled)
+        self.mock_restore_chain.reset_mock()
+
+        self.mock_should_enable_dhcp.return_value = True
+        self.driver.sync(self.mock_ironic)
+
+        # the chain is rebuilt with the set match
+        self.assertEqual(1, self.mock_restore_chain.call_count)
+        self.assertTrue(self.driver.enabled)
+
+    def test_sync_failure(self):
+        self.mock_call.side_effect = ipset.processutils.ProcessExecutionError()
+
+        self.assertRaises(ipset.processutils.ProcessExecutionError,
+                          self.driver.sync, self.mock_ironic)
+
+        self.assertIsNone(self.driver.blacklist_cache)
+        self.mock_restore_chain.assert_not_called()
+
+    def test_on_introspection_started(self):
+        self.driver.sync(self.mock_ironic)
+        self.mock_call.reset_mock()
+
+        self.driver.on_introspection_started(['mac1', 'mac3'],
+                                             self.mock_ironic)
+
+        self.assert_restore_set('del ironic-inspector mac1')
+        self.assertEqual({'mac2'}, self.driver.blacklist_cache)
+
+    @mock.patch.object(iptables.node_cache, 'active_macs', autospec=True)
+    def test_on_introspection_finished(self, mock_active_macs):
+        mock_active_macs.return_value = set()
+        self.driver.sync(self.mock_ironic)
+        self.mock_call.reset_mock()
+
+        self.driver.on_introspection_finished(['mac3'], self.mock_ironic)
+
+        self.assert_restore_set('add ironic-inspector mac3')
+        self.assertEqual({'mac1', 'mac2', 'mac3'},
+                         self.driver.blacklist_cache)
+
+    def test_update_failure_falls_back_to_sync(self):
+        self.driver.sync(self.mock_ironic)
+        self.mock_call.side_effect = [
+            ipset.processutils.ProcessExecutionError(), None, None]
+
+        self.driver.on_introspection_started(['mac1'], self.mock_ironic)
+
+        # full rebuild with flush
+        self.assertEqual(2, self.mock_restore_chain.call_count)
+        self.assertEqual({'mac1', 'mac2'}, self.driver.blacklist_cache)
+
+    def test_get_actual_blacklist(self):
+        self.mock_call.return_value = (
+            'create ironic-inspector hash:mac hashsize 1024 maxelem 65536\n'
+            'add ironic-inspector 52:54:00:00:00:01\n'
+            'add ironic-inspector 52:54:00:AA:00:02\n', '')
+
+        self.assertEqual({'52:54:00:00:00:01', '52:54:00:aa:00:02'},
+                         self.driver._get_actual_blacklist())
+        self.mock_call.assert_called_once_with(
+            *(self.ipset_command + ('save', 'ironic-inspector')))
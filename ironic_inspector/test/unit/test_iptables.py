@@ -13,11 +13,15 @@
 # License for the specific language governing permissions and limitations
 # under the License.
 
+import os
+import stat
+import sys
+
 import fixtures
-from ironicclient import exc as ironic_exc
 import mock
 from oslo_config import cfg
 
+from ironic_inspector.common import port_cache
 from ironic_inspector import node_cache
 from ironic_inspector.pxe_filter import base as pxe_filter
 from ironic_inspector.pxe_filter import iptables
@@ -70,6 +74,10 @@ class TestIptablesDriver(test_base.NodeTest):
         expected = ('sudo', 'ironic-inspector-rootwrap', CONF.rootwrap_config,
                     'iptables', '-w')
         self.assertEqual(expected, self.driver.base_command)
+        self.assertEqual(('sudo', 'ironic-inspector-rootwrap',
+                          CONF.rootwrap_config, 'iptables-restore',
+                          '--noflush', '-w'),
+                         self.driver.restore_command)
         self.check_fsm([pxe_filter.Events.initialize])
 
     def test_init_args_old_iptables(self):
@@ -114,171 +122,269 @@ class TestIptablesDriver(test_base.NodeTest):
         self.assertRaisesRegex(MyError, 'Oops!', self.driver.init_filter)
         self.check_fsm([pxe_filter.Events.initialize, pxe_filter.Events.reset])
 
-    def _test__iptables_args(self, expected_port):
+    def test_init_args_old_iptables_restore(self):
+        def _execute(*cmd, **kwargs):
+            if 'iptables-restore' in cmd:
+                raise iptables.processutils.ProcessExecutionError(2, '')
+
+        self.mock_call.side_effect = _execute
+        self.driver.init_filter()
+
+        self.mock_call.assert_any_call(
+            'sudo', 'ironic-inspector-rootwrap', CONF.rootwrap_config,
+            'iptables-restore', '--noflush', '-w', '--test',
+            process_input='*filter\nCOMMIT\n')
+        self.assertEqual(('sudo', 'ironic-inspector-rootwrap',
+                          CONF.rootwrap_config, 'iptables-restore',
+                          '--noflush'),
+                         self.driver.restore_command)
+        self.assertEqual(('sudo', 'ironic-inspector-rootwrap',
+                          CONF.rootwrap_config, 'iptables', '-w'),
+                         self.driver.base_command)
+
+    def _payload(self, rules, expected_port=None):
+        lines = ['*filter', ':%s - [0:0]' % self.driver.chain]
+        lines.extend(rules)
+        if expected_port:
+            lines.append('-I INPUT -i br-ctlplane -p udp --dport %s -j %s' %
+                         (expected_port, self.driver.chain))
+        lines.append('COMMIT')
+        return '\n'.join(lines) + '\n'
+
+    def _prepare_sync(self, jump_exists=False):
+        def _execute(*cmd, **kwargs):
+            if '-C' in cmd and not jump_exists:
+                raise iptables.processutils.ProcessExecutionError(1, '')
+            return '', ''
+
         self.driver = iptables.IptablesFilter()
         self.mock_iptables = self.useFixture(
             fixtures.MockPatchObject(self.driver, '_iptables')).mock
+        self.mock_call.side_effect = _execute
         self.mock_should_enable_dhcp.return_value = True
 
-        _iptables_expected_args = [
-            ('-D', 'INPUT', '-i', 'br-ctlplane', '-p', 'udp', '--dport',
-             expected_port, '-j', self.driver.new_chain),
-            ('-F', self.driver.new_chain),
-            ('-X', self.driver.new_chain),
-            ('-N', self.driver.new_chain),
-            ('-A', self.driver.new_chain, '-j', 'ACCEPT'),
-            ('-I', 'INPUT', '-i', 'br-ctlplane', '-p', 'udp', '--dport',
-             expected_port, '-j', self.driver.new_chain),
-            ('-D', 'INPUT', '-i', 'br-ctlplane', '-p', 'udp', '--dport',
-             expected_port, '-j', self.driver.chain),
-            ('-F', self.driver.chain),
-            ('-X', self.driver.chain),
-            ('-E', self.driver.new_chain, self.driver.chain)
-        ]
+    def _test_sync(self, expected_port, restore_cmd):
+        self._prepare_sync()
+        self.mock__get_blacklist.return_value = ['AA:BB:CC:DD:EE:FF']
 
         self.driver.sync(self.mock_ironic)
-        call_args_list = self.mock_iptables.call_args_list
 
-        for (args, call) in zip(_iptables_expected_args,
-                                call_args_list):
-            self.assertEqual(args, call[0])
-        self.mock__get_blacklist.assert_called_once_with(self.mock_ironic)
         self.check_fsm([pxe_filter.Events.sync])
+        self.mock__get_blacklist.assert_called_once_with(self.mock_ironic,
+                                                         mock.ANY)
+        self.mock_call.assert_called_with(
+            'sudo', 'ironic-inspector-rootwrap', CONF.rootwrap_config,
+            restore_cmd, '--noflush',
+            process_input=self._payload(
+                ['-A %s -m mac --mac-source AA:BB:CC:DD:EE:FF -j DROP' %
+                 self.driver.chain,
+                 '-A %s -j ACCEPT' % self.driver.chain],
+                expected_port))
+        # A single iptables-restore call besides the jump check
+        self.assertEqual(2, self.mock_call.call_count)
+        self.mock_iptables.assert_not_called()
+        self.assertEqual({'AA:BB:CC:DD:EE:FF'}, self.driver.blacklist_cache)
+
+        # check caching
+        self.mock_call.reset_mock()
+        self.mock__get_blacklist.reset_mock()
+        self.driver.sync(self.mock_ironic)
+        self.mock__get_blacklist.assert_called_once_with(self.mock_ironic,
+                                                         mock.ANY)
+        self.mock_call.assert_not_called()
 
-    def test__iptables_args_ipv4(self):
+    def test_sync_ipv4(self):
         CONF.set_override('ip_version', '4', 'iptables')
-        self._test__iptables_args('67')
+        self._test_sync('67', 'iptables-restore')
 
-    def test__iptables_args_ipv6(self):
+    def test_sync_ipv6(self):
         CONF.set_override('ip_version', '6', 'iptables')
-        self._test__iptables_args('547')
+        self._test_sync('547', 'ip6tables-restore')
 
-    def test__iptables_kwargs(self):
-        _iptables_expected_kwargs = [
-            {'ignore': True},
-            {'ignore': True},
-            {'ignore': True},
-            {},
-            {},
-            {},
-            {'ignore': True},
-            {'ignore': True},
-            {'ignore': True}
-        ]
+    def test_sync_jump_exists(self):
+        self._prepare_sync(jump_exists=True)
 
         self.driver.sync(self.mock_ironic)
-        call_args_list = self.mock_iptables.call_args_list
 
-        for (kwargs, call) in zip(_iptables_expected_kwargs,
-                                  call_args_list):
-            self.assertEqual(kwargs, call[1])
-        self.check_fsm([pxe_filter.Events.sync])
+        self.mock_call.assert_called_with(
+            *self.driver.restore_command,
+            process_input=self._payload(['-A %s -j ACCEPT' %
+                                         self.driver.chain]))
 
-    def _test_sync_with_blacklist(self, expected_port):
-        self.driver = iptables.IptablesFilter()
-        self.mock_iptables = self.useFixture(
-            fixtures.MockPatchObject(self.driver, '_iptables')).mock
+    def test_sync_disable_dhcp(self):
+        self._prepare_sync()
+        self.mock_should_enable_dhcp.return_value = False
+
+        self.driver.sync(self.mock_ironic)
+
+        self.mock_call.assert_called_with(
+            *self.driver.restore_command,
+            process_input=self._payload(['-A %s -j REJECT' %
+                                         self.driver.chain], '67'))
+        self.assertFalse(self.driver.enabled)
+        self.mock__get_blacklist.assert_not_called()
+
+        # DHCP is already disabled
+        self.mock_call.reset_mock()
+        self.driver.sync(self.mock_ironic)
+        self.mock_call.assert_not_called()
+
+    def test_sync_clean_cache_on_error(self):
+        self._prepare_sync()
         self.mock__get_blacklist.return_value = ['AA:BB:CC:DD:EE:FF']
-        self.mock_should_enable_dhcp.return_value = True
+        self.mock_call.side_effect = (
+            iptables.processutils.ProcessExecutionError())
 
-        _iptables_expected_args = [
-            ('-D', 'INPUT', '-i', 'br-ctlplane', '-p', 'udp', '--dport',
-             expected_port, '-j', self.driver.new_chain),
-            ('-F', self.driver.new_chain),
-            ('-X', self.driver.new_chain),
-            ('-N', self.driver.new_chain),
-            # Blacklist
-            ('-A', self.driver.new_chain, '-m', 'mac', '--mac-source',
-             self.mock__get_blacklist.return_value[0], '-j', 'DROP'),
-            ('-A', self.driver.new_chain, '-j', 'ACCEPT'),
-            ('-I', 'INPUT', '-i', 'br-ctlplane', '-p', 'udp', '--dport',
-             expected_port, '-j', self.driver.new_chain),
-            ('-D', 'INPUT', '-i', 'br-ctlplane', '-p', 'udp', '--dport',
-             expected_port, '-j', self.driver.chain),
-            ('-F', self.driver.chain),
-            ('-X', self.driver.chain),
-            ('-E', self.driver.new_chain, self.driver.chain)
-        ]
+        self.assertRaises(iptables.processutils.ProcessExecutionError,
+                          self.driver.sync, self.mock_ironic)
+
+        self.check_fsm([pxe_filter.Events.sync, pxe_filter.Events.reset])
+        self.assertIsNone(self.driver.blacklist_cache)
 
+        self.mock_call.side_effect = None
+        self.mock_call.reset_mock()
+        self.mock_fsm.reset_mock()
         self.driver.sync(self.mock_ironic)
         self.check_fsm([pxe_filter.Events.sync])
-        call_args_list = self.mock_iptables.call_args_list
+        self.mock_call.assert_called_with(
+            *self.driver.restore_command, process_input=mock.ANY)
 
-        for (args, call) in zip(_iptables_expected_args,
-                                call_args_list):
-            self.assertEqual(args, call[0])
-        self.mock__get_blacklist.assert_called_once_with(self.mock_ironic)
+    def _prepare_verify(self, rules):
+        self._prepare_sync(jump_exists=True)
+        CONF.set_override('verify_interval', 60, 'iptables')
+        self.mock__get_blacklist.return_value = ['aa:bb:cc:dd:ee:ff']
+        self.driver.sync(self.mock_ironic)
+        self.mock_call.reset_mock()
+        self.mock_call.side_effect = None
+        self.mock_call.return_value = ('\n'.join(rules) + '\n', '')
+        self.mock_sync_stats = self.useFixture(
+            fixtures.MockPatchObject(pxe_filter, 'sync_stats')).mock
+        self.stats = pxe_filter.SyncStats()
+        self.mock_sync_stats.return_value.__enter__.return_value = self.stats
+        self.useFixture(fixtures.MockPatchObject(
+            iptables.timeutils, 'is_older_than', return_value=True))
+
+    def test_sync_verify(self):
+        self._prepare_verify([
+            '-N %s' % self.driver.chain,
+            '-A %s -m mac --mac-source AA:BB:CC:DD:EE:FF -j DROP' %
+            self.driver.chain,
+            '-A %s -j ACCEPT' % self.driver.chain])
 
-        # check caching
+        self.driver.sync(self.mock_ironic)
+
+        self.mock_call.assert_called_once_with(
+            *(self.driver.base_command + ('-S', self.driver.chain)))
+        self.assertEqual(0, self.stats.drift)
+        self.assertFalse(self.stats.changed)
+        self.mock_sync_stats.assert_called_once_with('iptables')
+
+    def test_sync_verify_drift(self):
+        self._prepare_verify(['-N %s' % self.driver.chain])
 
-        self.mock_iptables.reset_mock()
-        self.mock__get_blacklist.reset_mock()
         self.driver.sync(self.mock_ironic)
-        self.mock__get_blacklist.assert_called_once_with(self.mock_ironic)
-        self.assertFalse(self.mock_iptables.called)
 
-    def test_sync_with_blacklist_ipv4(self):
-        CONF.set_override('ip_version', '4', 'iptables')
-        self._test_sync_with_blacklist('67')
+        self.assertEqual(1, self.stats.drift)
+        # the chain is rebuilt
+        self.mock_call.assert_called_with(
+            *self.driver.restore_command, process_input=mock.ANY)
+        self.assertTrue(self.stats.changed)
+        self.assertEqual(1, self.stats.added)
+        self.assertEqual({'aa:bb:cc:dd:ee:ff'}, self.driver.blacklist_cache)
 
-    def test_sync_with_blacklist_ipv6(self):
-        CONF.set_override('ip_version', '6', 'iptables')
-        self._test_sync_with_blacklist('547')
+    def test_sync_verify_disabled(self):
+        self._prepare_verify([])
+        CONF.set_override('verify_interval', 0, 'iptables')
 
-    def _test__iptables_clean_cache_on_error(self, expected_port):
-        self.driver = iptables.IptablesFilter()
-        self.mock_iptables = self.useFixture(
-            fixtures.MockPatchObject(self.driver, '_iptables')).mock
-        self.mock__get_blacklist.return_value = ['AA:BB:CC:DD:EE:FF']
+        self.driver.sync(self.mock_ironic)
+
+        self.mock_call.assert_not_called()
+        self.assertIsNone(self.stats.drift)
+
+    def _prepare_update(self, blacklist):
+        self.mock_fsm.current_state = pxe_filter.States.initialized
         self.mock_should_enable_dhcp.return_value = True
+        self.driver.blacklist_cache = set(blacklist)
+        self.mock_sync = self.useFixture(
+            fixtures.MockPatchObject(self.driver, '_sync')).mock
 
-        self.mock_iptables.side_effect = [None, None, RuntimeError('Oops!'),
-                                          None, None, None, None, None, None]
-        self.assertRaises(RuntimeError, self.driver.sync, self.mock_ironic)
-        self.check_fsm([pxe_filter.Events.sync, pxe_filter.Events.reset])
-        self.mock__get_blacklist.assert_called_once_with(self.mock_ironic)
+    def test_on_introspection_started(self):
+        self._prepare_update(['mac1', 'mac2', 'mac3'])
 
-        # check caching
-        syncs_expected_args = [
-            # driver reset
-            ('-D', 'INPUT', '-i', 'br-ctlplane', '-p', 'udp', '--dport',
-             expected_port, '-j', self.driver.new_chain),
-            ('-F', self.driver.new_chain),
-            ('-X', self.driver.new_chain),
-            ('-N', self.driver.new_chain),
-            # Blacklist
-            ('-A', self.driver.new_chain, '-m', 'mac', '--mac-source',
-             self.mock__get_blacklist.return_value[0], '-j', 'DROP'),
-            ('-A', self.driver.new_chain, '-j', 'ACCEPT'),
-            ('-I', 'INPUT', '-i', 'br-ctlplane', '-p', 'udp', '--dport',
-             expected_port, '-j', self.driver.new_chain),
-            ('-D', 'INPUT', '-i', 'br-ctlplane', '-p', 'udp', '--dport',
-             expected_port, '-j', self.driver.chain),
-            ('-F', self.driver.chain),
-            ('-X', self.driver.chain),
-            ('-E', self.driver.new_chain, self.driver.chain)
-        ]
+        self.driver.on_introspection_started(['mac1', 'mac4'],
+                                             self.mock_ironic)
 
-        self.mock_iptables.reset_mock()
-        self.mock_iptables.side_effect = None
-        self.mock__get_blacklist.reset_mock()
-        self.mock_fsm.reset_mock()
-        self.driver.sync(self.mock_ironic)
+        self.mock_iptables.assert_called_once_with(
+            '-D', self.driver.chain, '-m', 'mac', '--mac-source', 'mac1',
+            '-j', 'DROP')
+        self.assertEqual({'mac2', 'mac3'}, self.driver.blacklist_cache)
+        self.mock_sync.assert_not_called()
         self.check_fsm([pxe_filter.Events.sync])
-        call_args_list = self.mock_iptables.call_args_list
 
-        for (idx, (args, call)) in enumerate(zip(syncs_expected_args,
-                                                 call_args_list)):
-            self.assertEqual(args, call[0], 'idx: %s' % idx)
-        self.mock__get_blacklist.assert_called_once_with(self.mock_ironic)
+    def test_on_introspection_started_disabled(self):
+        self._prepare_update([])
+        self.driver.enabled = False
 
-    def test__iptables_clean_cache_on_error_ipv4(self):
-        CONF.set_override('ip_version', '4', 'iptables')
-        self._test__iptables_clean_cache_on_error('67')
+        self.driver.on_introspection_started(['mac1'], self.mock_ironic)
 
-    def test__iptables_clean_cache_on_error_ipv6(self):
-        CONF.set_override('ip_version', '6', 'iptables')
-        self._test__iptables_clean_cache_on_error('547')
+        self.mock_sync.assert_called_once_with(self.mock_ironic)
+        self.mock_iptables.assert_not_called()
+
+    def test_on_introspection_started_ethoib(self):
+        CONF.set_override('ethoib_interfaces', ['eth0'], 'iptables')
+        self._prepare_update(['mac1'])
+
+        self.driver.on_introspection_started(['mac1'], self.mock_ironic)
+
+        self.mock_sync.assert_called_once_with(self.mock_ironic)
+        self.mock_iptables.assert_not_called()
+
+    def test_on_introspection_started_failure(self):
+        self._prepare_update(['mac1'])
+        self.mock_iptables.side_effect = (
+            iptables.processutils.ProcessExecutionError())
+
+        self.driver.on_introspection_started(['mac1'], self.mock_ironic)
+
+        self.mock_sync.assert_called_once_with(self.mock_ironic)
+        self.assertIsNone(self.driver.blacklist_cache)
+
+    def test_on_introspection_started_uninitialized(self):
+        self._prepare_update(['mac1'])
+        self.mock_fsm.current_state = pxe_filter.States.uninitialized
+
+        self.driver.on_introspection_started(['mac1'], self.mock_ironic)
+
+        self.mock_iptables.assert_not_called()
+        self.mock_sync.assert_not_called()
+        self.check_fsm([])
+
+    @mock.patch.object(node_cache, 'active_macs', autospec=True)
+    def test_on_introspection_finished(self, mock_active_macs):
+        mock_active_macs.return_value = {'mac2'}
+        self._prepare_update(['mac3'])
+
+        self.driver.on_introspection_finished(['mac1', 'mac2', 'mac3'],
+                                              self.mock_ironic)
+
+        self.mock_iptables.assert_called_once_with(
+            '-I', self.driver.chain, '1', '-m', 'mac', '--mac-source', 'mac1',
+            '-j', 'DROP')
+        self.assertEqual({'mac1', 'mac3'}, self.driver.blacklist_cache)
+        self.mock_sync.assert_not_called()
+        self.check_fsm([pxe_filter.Events.sync])
+
+    def test_on_introspection_finished_disable_dhcp(self):
+        self._prepare_update(['mac3'])
+        self.mock_should_enable_dhcp.return_value = False
+        mock_disable_dhcp = self.useFixture(
+            fixtures.MockPatchObject(self.driver, '_disable_dhcp')).mock
+
+        self.driver.on_introspection_finished(['mac1'], self.mock_ironic)
+
+        mock_disable_dhcp.assert_called_once_with()
+        self.mock_iptables.assert_not_called()
+        self.mock_sync.assert_not_called()
 
     def test_iptables_command_ipv4(self):
         CONF.set_override('ip_version', '4', 'iptables')
@@ -291,6 +397,65 @@ class TestIptablesDriver(test_base.NodeTest):
         self.assertEqual(driver._cmd_iptables, 'ip6tables')
 
 
+_FAKE_BINARY = """#!%s
+import sys
+with open(%r, 'a') as fp:
+    fp.write(' '.join(sys.argv[1:]) + '\\n')
+    if '-C' in sys.argv:
+        sys.exit(1)
+    if 'restore' in sys.argv[0]:
+        fp.write(sys.stdin.read())
+"""
+
+
+class TestIptablesRestoreBinary(test_base.NodeTest):
+    """Run the driver against fake iptables and iptables-restore binaries."""
+
+    def setUp(self):
+        super(TestIptablesRestoreBinary, self).setUp()
+        self.useFixture(
+            fixtures.MockPatchObject(iptables.IptablesFilter, 'fsm'))
+        self.useFixture(fixtures.MockPatchObject(
+            iptables, '_should_enable_dhcp', return_value=True))
+        self.mock__get_blacklist = self.useFixture(
+            fixtures.MockPatchObject(iptables, '_get_blacklist')).mock
+        tempdir = self.useFixture(fixtures.TempDir()).path
+        self.output = os.path.join(tempdir, 'output')
+        self.driver = iptables.IptablesFilter()
+        self.driver.base_command = (self._binary(tempdir, 'iptables'),)
+        self.driver.restore_command = (
+            self._binary(tempdir, 'iptables-restore'), '--noflush')
+
+    def _binary(self, tempdir, name):
+        path = os.path.join(tempdir, name)
+        with open(path, 'w') as fp:
+            fp.write(_FAKE_BINARY % (sys.executable, self.output))
+        os.chmod(path, stat.S_IRWXU)
+        return path
+
+    def test_sync(self):
+        macs = ['52:54:00:00:%02x:%02x' % (i // 256, i % 256)
+                for i in range(1000)]
+        self.mock__get_blacklist.return_value = macs
+
+        self.driver.sync(mock.Mock())
+
+        with open(self.output) as fp:
+            output = fp.read().splitlines()
+        chain = self.driver.chain
+        expected = (
+            ['-C INPUT -i br-ctlplane -p udp --dport 67 -j %s' % chain,
+             '--noflush',
+             '*filter',
+             ':%s - [0:0]' % chain] +
+            ['-A %s -m mac --mac-source %s -j DROP' % (chain, mac)
+             for mac in macs] +
+            ['-A %s -j ACCEPT' % chain,
+             '-I INPUT -i br-ctlplane -p udp --dport 67 -j %s' % chain,
+             'COMMIT'])
+        self.assertEqual(expected, output)
+
+
 class Test_ShouldEnableDhcp(test_base.BaseTest):
     def setUp(self):
         super(Test_ShouldEnableDhcp, self).setUp()
@@ -333,6 +498,11 @@ class TestIBMapping(test_base.BaseTest):
         self.ports = [self.ib_port, self.port]
         self.expected_rmac = '02:00:00:61:00:02'
         self.fileobj = mock.mock_open(read_data=self.ib_data)
+        self.useFixture(fixtures.MockPatchObject(iptables, '_NEIGHS_CACHE',
+                                                 {}))
+        self.mock_stat = self.useFixture(
+            fixtures.MockPatchObject(iptables.os, 'stat')).mock
+        self.mock_stat.return_value.st_mtime = 1
 
     def test_matching_ib(self):
         with mock.patch('six.moves.builtins.open', self.fileobj,
@@ -365,6 +535,54 @@ class TestIBMapping(test_base.BaseTest):
         mock_open.assert_called_once_with('/sys/class/net/eth0/eth/neighs',
                                           'r')
 
+    def test_stat_no_such_file(self):
+        self.mock_stat.side_effect = OSError()
+        with mock.patch('six.moves.builtins.open', self.fileobj,
+                        create=True) as mock_open:
+            iptables._ib_mac_to_rmac_mapping(self.ports)
+
+        self.assertEqual(self.ib_address, self.ib_port.address)
+        mock_open.assert_not_called()
+
+    def test_parsed_once(self):
+        mock_regex = self.useFixture(fixtures.MockPatchObject(
+            iptables, '_NEIGH_REGEX', wraps=iptables._NEIGH_REGEX)).mock
+        ib_port2 = mock.Mock(address=self.ib_address,
+                             extra={'client-id': self.client_id},
+                             spec=['address', 'extra'])
+        with mock.patch('six.moves.builtins.open', self.fileobj,
+                        create=True):
+            iptables._ib_mac_to_rmac_mapping(self.ports)
+            iptables._ib_mac_to_rmac_mapping([ib_port2])
+
+        self.assertEqual(self.expected_rmac, ib_port2.address)
+        mock_regex.findall.assert_called_once_with(self.ib_data)
+
+    def test_parsed_again_on_change(self):
+        with mock.patch('six.moves.builtins.open', self.fileobj,
+                        create=True):
+            iptables._ib_mac_to_rmac_mapping(self.ports)
+
+        self.ib_port.address = self.ib_address
+        new_data = self.ib_data.replace(self.expected_rmac,
+                                        '02:00:00:61:00:03')
+        with mock.patch('six.moves.builtins.open',
+                        mock.mock_open(read_data=new_data), create=True):
+            iptables._ib_mac_to_rmac_mapping(self.ports)
+
+        self.assertEqual('02:00:00:61:00:03', self.ib_port.address)
+
+    def test_parsed_again_on_mtime_change(self):
+        mock_regex = self.useFixture(fixtures.MockPatchObject(
+            iptables, '_NEIGH_REGEX', wraps=iptables._NEIGH_REGEX)).mock
+        with mock.patch('six.moves.builtins.open', self.fileobj,
+                        create=True):
+            iptables._ib_mac_to_rmac_mapping(self.ports)
+            self.mock_stat.return_value.st_mtime = 2
+            iptables._ib_mac_to_rmac_mapping(self.ports)
+
+        self.assertEqual(2, mock_regex.findall.call_count)
+
     def test_no_interfaces(self):
         CONF.set_override('ethoib_interfaces', [], 'iptables')
         with mock.patch('six.moves.builtins.open', self.fileobj,
@@ -384,39 +602,22 @@ class TestGetBlacklist(test_base.BaseTest):
         self.mock_active_macs = self.useFixture(
             fixtures.MockPatchObject(node_cache, 'active_macs')).mock
         self.mock_ironic = mock.Mock()
+        self.mock_refresh = self.useFixture(
+            fixtures.MockPatchObject(port_cache, 'refresh')).mock
 
     def test_active_port(self):
-        mock_ports_list = [
-            mock.Mock(address='foo'),
-            mock.Mock(address='bar'),
-        ]
-        self.mock_ironic.port.list.return_value = mock_ports_list
-        self.mock_active_macs.return_value = {'foo'}
-
-        ports = iptables._get_blacklist(self.mock_ironic)
-        # foo is an active address so we expect the blacklist contains only bar
-        self.assertEqual(['bar'], ports)
-        self.mock_ironic.port.list.assert_called_once_with(
-            limit=0, fields=['address', 'extra'])
-        self.mock__ib_mac_to_rmac_mapping.assert_called_once_with(
-            [mock_ports_list[1]])
-
-    @mock.patch('time.sleep', lambda _x: None)
-    def test_retry_on_port_list_failure(self):
-        mock_ports_list = [
-            mock.Mock(address='foo'),
-            mock.Mock(address='bar'),
-        ]
-        self.mock_ironic.port.list.side_effect = [
-            ironic_exc.ConnectionRefused('boom'),
-            mock_ports_list
+        self.mock_refresh.return_value.ports.return_value = [
+            port_cache.Port('uuid1', 'foo'),
+            port_cache.Port('uuid2', 'bar'),
         ]
         self.mock_active_macs.return_value = {'foo'}
 
         ports = iptables._get_blacklist(self.mock_ironic)
         # foo is an active address so we expect the blacklist contains only bar
         self.assertEqual(['bar'], ports)
-        self.mock_ironic.port.list.assert_called_with(
-            limit=0, fields=['address', 'extra'])
-        self.mock__ib_mac_to_rmac_mapping.assert_called_once_with(
-            [mock_ports_list[1]])
+        self.mock_refresh.assert_called_once_with(self.mock_ironic)
+        mapped, = self.mock__ib_mac_to_rmac_mapping.call_args[0]
+        self.assertEqual(['bar'], [port.address for port in mapped])
+        # the cached ports are not modified by the mapping
+        self.assertIsNot(
+            self.mock_refresh.return_value.ports.return_value[1], mapped[0])
@@ -25,6 +25,7 @@ from ironic_inspector.common import rpc
 from ironic_inspector.common import swift
 import ironic_inspector.conf
 from ironic_inspector.conf import opts as conf_opts
+from ironic_inspector import db
 from ironic_inspector import introspection_state as istate
 from ironic_inspector import main
 from ironic_inspector import node_cache
@@ -136,6 +137,18 @@ class TestApiContinue(BaseAPITest):
         process_mock.assert_called_once_with({"foo": "bar"})
         self.assertEqual({"result": 42}, json.loads(res.data.decode()))
 
+    def test_continue_session(self, process_mock):
+        sessions = []
+        process_mock.side_effect = lambda data: sessions.extend(
+            [db.get_reader_session(), db.get_writer_session()]) or {}
+
+        res = self.app.post('/v1/continue', data='{"foo": "bar"}')
+
+        self.assertEqual(200, res.status_code)
+        self.assertIs(sessions[0], sessions[1])
+        # unbound after the request
+        self.assertIsNot(sessions[0], db.get_writer_session())
+
     def test_continue_failed(self, process_mock):
         process_mock.side_effect = utils.Error("boom")
         res = self.app.post('/v1/continue', data='{"foo": "bar"}')
@@ -260,6 +273,7 @@ class TestApiGetStatus(GetStatusAPIBaseTest):
         get_mock.return_value = self.unfinished_node
         res = self.app.get('/v1/introspection/%s' % self.uuid)
         self.assertEqual(200, res.status_code)
+        get_mock.assert_called_once_with(self.uuid, replica=True)
         self.assertEqual(self.unfinished_node.status,
                          json.loads(res.data.decode('utf-8')))
 
@@ -333,7 +347,7 @@ class TestApiGetData(BaseAPITest):
         db_store.get.return_value = json.dumps(self.introspection_data)
         res = self.app.get('/v1/introspection/%s/data' % self.uuid)
         db_store.get.assert_called_once_with(self.uuid, processed=True,
-                                             get_json=False)
+                                             get_json=False, replica=True)
         self.assertEqual(200, res.status_code)
         self.assertEqual(self.introspection_data,
                          json.loads(res.data.decode('utf-8')))
@@ -355,6 +369,35 @@ class TestApiGetData(BaseAPITest):
                          json.loads(res.data.decode('utf-8')))
         get_mock.assert_called_once_with('name1', fields=['uuid'])
 
+    @mock.patch.object(intros_data_plugin, 'DatabaseStore',
+                       autospec=True)
+    def test_fields(self, db_mock):
+        CONF.set_override('store_data', 'database', 'processing')
+        db_store = db_mock.return_value
+        db_store.get.return_value = json.dumps({'cpus': 2})
+        headers = {conf_opts.VERSION_HEADER: main._format_version((1, 18))}
+
+        res = self.app.get('/v1/introspection/%s/data?fields=cpus,'
+                           '/interfaces/em1' % self.uuid, headers=headers)
+
+        self.assertEqual(200, res.status_code)
+        self.assertEqual({'cpus': 2}, json.loads(res.data.decode('utf-8')))
+        db_store.get.assert_called_once_with(
+            self.uuid, processed=True, get_json=False,
+            fields=[('cpus',), ('interfaces', 'em1')], replica=True)
+
+    @mock.patch.object(main.process, 'get_introspection_data', autospec=True)
+    def test_fields_old_version(self, process_mock):
+        headers = {conf_opts.VERSION_HEADER: main._format_version((1, 17))}
+
+        res = self.app.get('/v1/introspection/%s/data?fields=cpus' %
+                           self.uuid, headers=headers)
+
+        self.assertEqual(406, res.status_code)
+        self.assertEqual('Selecting fields of introspection data requires '
+                         'API version 1.18 or newer', _get_error(res))
+        self.assertFalse(process_mock.called)
+
 
 class TestApiReapply(BaseAPITest):
 
@@ -453,7 +496,7 @@ class TestApiRules(BaseAPITest):
                            ]}]
             },
             json.loads(res.data.decode('utf-8')))
-        get_all_mock.assert_called_once_with()
+        get_all_mock.assert_called_once_with(replica=True)
         for m in get_all_mock.return_value:
             m.as_dict.assert_called_with(short=True)
 
@@ -535,6 +578,153 @@ class TestApiRules(BaseAPITest):
         delete_mock.assert_called_once_with(self.uuid)
 
 
+class TestApiRulesBulk(BaseAPITest):
+    def setUp(self):
+        super(TestApiRulesBulk, self).setUp()
+        self.headers = {conf_opts.VERSION_HEADER:
+                        main._format_version((1, 16))}
+        self.rules_json = [{'uuid': self.uuid, 'conditions': 'cond',
+                            'actions': 'act'}]
+        self.rule_mock = mock.Mock(spec=rules.IntrospectionRule,
+                                   **{'as_dict.return_value':
+                                      {'uuid': self.uuid,
+                                       'description': None}})
+
+    @mock.patch.object(rules, 'import_rules', autospec=True)
+    def test_import(self, import_mock):
+        import_mock.return_value = [self.rule_mock]
+
+        res = self.app.put('/v1/rules', headers=self.headers,
+                           data=json.dumps({'rules': self.rules_json}))
+        self.assertEqual(200, res.status_code)
+        import_mock.assert_called_once_with(self.rules_json, replace=True)
+        self.assertEqual(
+            {'rules': [{'uuid': self.uuid, 'description': None,
+                        'links': [{'href': '/v1/rules/%s' % self.uuid,
+                                   'rel': 'self'}]}]},
+            json.loads(res.data.decode('utf-8')))
+        self.rule_mock.as_dict.assert_called_once_with(short=True)
+
+    @mock.patch.object(rules, 'import_rules', autospec=True)
+    def test_import_merge(self, import_mock):
+        import_mock.return_value = [self.rule_mock]
+
+        res = self.app.put('/v1/rules', headers=self.headers,
+                           data=json.dumps({'rules': self.rules_json,
+                                            'mode': 'merge'}))
+        self.assertEqual(200, res.status_code)
+        import_mock.assert_called_once_with(self.rules_json, replace=False)
+
+    @mock.patch.object(rules, 'import_rules', autospec=True)
+    def test_import_invalid_mode(self, import_mock):
+        res = self.app.put('/v1/rules', headers=self.headers,
+                           data=json.dumps({'rules': self.rules_json,
+                                            'mode': 'append'}))
+        self.assertEqual(400, res.status_code)
+        self.assertFalse(import_mock.called)
+
+    @mock.patch.object(rules, 'import_rules', autospec=True)
+    def test_import_old_api(self, import_mock):
+        headers = {conf_opts.VERSION_HEADER: main._format_version((1, 15))}
+        res = self.app.put('/v1/rules', headers=headers,
+                           data=json.dumps({'rules': self.rules_json}))
+        self.assertEqual(406, res.status_code)
+        self.assertEqual('Bulk import of rules requires API version 1.16 '
+                         'or newer', _get_error(res))
+        self.assertFalse(import_mock.called)
+
+    @mock.patch.object(rules, 'export', autospec=True)
+    def test_export(self, export_mock):
+        rule_mock2 = mock.Mock(spec=rules.IntrospectionRule,
+                               **{'as_dict.return_value': {'uuid': 'foo'}})
+        export_mock.return_value = iter([self.rule_mock, rule_mock2])
+
+        res = self.app.get('/v1/rules/export', headers=self.headers)
+        self.assertEqual(200, res.status_code)
+        self.assertEqual('application/json', res.mimetype)
+        self.assertEqual({'rules': [{'uuid': self.uuid, 'description': None},
+                                    {'uuid': 'foo'}]},
+                         json.loads(res.data.decode('utf-8')))
+        self.rule_mock.as_dict.assert_called_once_with(short=False)
+
+    @mock.patch.object(rules, 'export', autospec=True)
+    def test_export_streamed(self, export_mock):
+        loaded = []
+
+        def _export():
+            for rule in (self.rule_mock, self.rule_mock):
+                loaded.append(rule)
+                yield rule
+
+        export_mock.side_effect = _export
+
+        res = self.app.get('/v1/rules/export', headers=self.headers,
+                           buffered=False)
+        self.assertEqual(200, res.status_code)
+        chunks = iter(res.response)
+        self.assertEqual(b'{"rules": [', next(chunks))
+        # nothing is loaded before the first chunk is sent
+        self.assertEqual([], loaded)
+        next(chunks)
+        self.assertEqual(1, len(loaded))
+        b''.join(chunks)
+        self.assertEqual(2, len(loaded))
+
+    @mock.patch.object(rules, 'export', autospec=True)
+    def test_export_empty(self, export_mock):
+        export_mock.return_value = iter([])
+
+        res = self.app.get('/v1/rules/export', headers=self.headers)
+        self.assertEqual(200, res.status_code)
+        self.assertEqual({'rules': []}, json.loads(res.data.decode('utf-8')))
+
+    @mock.patch.object(rules, 'export', autospec=True)
+    @mock.patch.object(rules, 'get', autospec=True)
+    def test_export_old_api(self, get_mock, export_mock):
+        headers = {conf_opts.VERSION_HEADER: main._format_version((1, 15))}
+        res = self.app.get('/v1/rules/export', headers=headers)
+        self.assertEqual(406, res.status_code)
+        self.assertEqual('Export of rules requires API version 1.16 or newer',
+                         _get_error(res))
+        self.assertFalse(export_mock.called)
+        self.assertFalse(get_mock.called)
+
+
+class TestApiRulesEvaluate(BaseAPITest):
+    def setUp(self):
+        super(TestApiRulesEvaluate, self).setUp()
+        self.result = {'nodes': 1, 'nodes_without_data': 0, 'errors': [],
+                       'rules': [{'uuid': self.uuid, 'matches': 1,
+                                  'nodes': [self.uuid]}]}
+
+    @mock.patch.object(rules, 'evaluate', autospec=True)
+    def test_evaluate(self, evaluate_mock):
+        evaluate_mock.return_value = self.result
+
+        res = self.app.post('/v1/rules/evaluate',
+                            data=json.dumps({'rules': ['rule']}))
+        self.assertEqual(200, res.status_code)
+        self.assertEqual(self.result, json.loads(res.data.decode('utf-8')))
+        evaluate_mock.assert_called_once_with(['rule'])
+
+    @mock.patch.object(rules, 'evaluate', autospec=True)
+    def test_evaluate_stored(self, evaluate_mock):
+        evaluate_mock.return_value = self.result
+
+        res = self.app.post('/v1/rules/evaluate')
+        self.assertEqual(200, res.status_code)
+        evaluate_mock.assert_called_once_with(None)
+
+    @mock.patch.object(rules, 'evaluate', autospec=True)
+    def test_evaluate_old_api(self, evaluate_mock):
+        headers = {conf_opts.VERSION_HEADER: main._format_version((1, 16))}
+        res = self.app.post('/v1/rules/evaluate', headers=headers)
+        self.assertEqual(406, res.status_code)
+        self.assertEqual('Evaluation of rules requires API version 1.17 or '
+                         'newer', _get_error(res))
+        self.assertFalse(evaluate_mock.called)
+
+
 class TestApiMisc(BaseAPITest):
     @mock.patch.object(node_cache, 'get_node', autospec=True)
     def test_404_expected(self, get_mock):
@@ -11,7 +11,12 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import datetime
+import gzip
 import json
+import os
+import shutil
+import tempfile
 
 import fixtures
 from ironic_lib import mdns
@@ -23,6 +28,7 @@ from ironic_inspector.common import swift
 from ironic_inspector.conductor import manager
 import ironic_inspector.conf
 from ironic_inspector import introspect
+from ironic_inspector import node_cache
 from ironic_inspector import process
 from ironic_inspector.test import base as test_base
 from ironic_inspector import utils
@@ -110,6 +116,17 @@ class TestManagerInitHost(BaseManagerTest):
         self.assert_periodics()
         self.assertFalse(mock_zc.called)
 
+    def test_init_host_purge(self):
+        CONF.set_override('retention_days', 30, 'purge')
+
+        self.manager.init_host()
+
+        self.mock_periodic.assert_any_call(spacing=CONF.purge.period)
+        self.mock_periodic.return_value.assert_any_call(
+            manager.periodic_purge)
+        callables = self.mock_PeriodicWorker.call_args[1]['callables']
+        self.assertEqual(3, len(callables))
+
     def test_init_host_validate_processing_hooks_exception(self):
         class MyError(Exception):
             pass
@@ -449,3 +466,50 @@ class TestManagerReapply(BaseManagerTest):
         store_mock.assert_called_once_with(self.uuid, self.data,
                                            processed=False)
         self.assertFalse(get_mock.called)
+
+
+@mock.patch.object(node_cache, 'purge_finished', autospec=True)
+class TestPurgeFinished(test_base.BaseTest):
+    def setUp(self):
+        super(TestPurgeFinished, self).setUp()
+        CONF.set_override('retention_days', 30, 'purge')
+        self.now = datetime.datetime(2019, 3, 1, 12, 0, 0)
+        self.useFixture(fixtures.MockPatchObject(
+            manager.timeutils, 'utcnow', return_value=self.now))
+        self.threshold = self.now - datetime.timedelta(days=30)
+
+    def _archive_dir(self):
+        path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, path)
+        CONF.set_override('archive_dir', path, 'purge')
+        return path
+
+    def test_purge(self, mock_purge):
+        mock_purge.return_value = 2
+
+        self.assertEqual(2, manager.purge_finished())
+
+        mock_purge.assert_called_once_with(self.threshold, batch_size=100)
+
+    def test_archive(self, mock_purge):
+        path = self._archive_dir()
+
+        def _purge(older_than, batch_size, archive):
+            archive.write(b'{"node": {}}\n')
+            return 1
+
+        mock_purge.side_effect = _purge
+
+        self.assertEqual(1, manager.purge_finished())
+
+        name = os.path.join(path, 'ironic-inspector-20190301120000.jsonl.gz')
+        with gzip.open(name, 'rb') as archive:
+            self.assertEqual(b'{"node": {}}\n', archive.read())
+
+    def test_archive_nothing_purged(self, mock_purge):
+        path = self._archive_dir()
+        mock_purge.return_value = 0
+
+        self.assertEqual(0, manager.purge_finished())
+
+        self.assertEqual([], os.listdir(path))
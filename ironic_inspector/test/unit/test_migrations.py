@@ -454,6 +454,41 @@ class MigrationCheckersMixin(object):
         self.assertIsInstance(introspection_data.c.data.type,
                               sqlalchemy.types.Text)
 
+    def _check_c3e2a1f0b9d7(self, engine, data):
+        rule_set_version = db_utils.get_table(engine, 'rule_set_version')
+        col_names = [column.name for column in rule_set_version.c]
+        self.assertIn('id', col_names)
+        self.assertIn('version', col_names)
+        self.assertIsInstance(rule_set_version.c.version.type,
+                              sqlalchemy.types.Integer)
+
+        row = rule_set_version.select().execute().first()
+        self.assertEqual(1, row['id'])
+        self.assertEqual(0, row['version'])
+
+    def _pre_upgrade_a91b3c5d7e2f(self, engine):
+        rules = db_utils.get_table(engine, 'rules')
+        # NOTE: the second rule was created earlier than the first one
+        data = [{'uuid': uuidutils.generate_uuid(),
+                 'created_at': datetime.datetime(2019, 1, 1, 12, 0, 1),
+                 'disabled': False},
+                {'uuid': uuidutils.generate_uuid(),
+                 'created_at': datetime.datetime(2019, 1, 1, 12, 0, 0),
+                 'disabled': False}]
+        for rule in data:
+            rules.insert().execute(rule)
+        return [rule['uuid'] for rule in data]
+
+    def _check_a91b3c5d7e2f(self, engine, data):
+        rules = db_utils.get_table(engine, 'rules')
+        self.assertIn('position', [column.name for column in rules.c])
+        self.assertIsInstance(rules.c.position.type, sqlalchemy.types.Integer)
+
+        positions = {row['uuid']: row['position']
+                     for row in rules.select().execute()}
+        self.assertEqual(1, positions[data[0]])
+        self.assertEqual(0, positions[data[1]])
+
     def test_upgrade_and_version(self):
         with patch_with_engine(self.engine):
             self.migration_ext.upgrade('head')
@@ -0,0 +1,208 @@
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import fixtures
+import mock
+from oslo_config import cfg
+
+from ironic_inspector.common import port_cache
+from ironic_inspector.pxe_filter import base as pxe_filter
+from ironic_inspector.pxe_filter import iptables
+from ironic_inspector.pxe_filter import nftables
+from ironic_inspector.test import base as test_base
+
+
+CONF = cfg.CONF
+
+_TABLE_HEADER = [
+    'add table inet ironic_inspector',
+    'delete table inet ironic_inspector',
+    'table inet ironic_inspector {',
+    '    set blacklist {',
+    '        type ether_addr',
+]
+
+
+def _ruleset(rule=None, elements=None):
+    lines = list(_TABLE_HEADER)
+    if elements:
+        lines.append('        elements = { %s }' % elements)
+    lines.extend([
+        '    }',
+        '    chain input {',
+        '        type filter hook input priority 0; policy accept;',
+    ])
+    if rule:
+        lines.append('        ' + rule)
+    lines.extend(['    }', '}'])
+    return '\n'.join(lines) + '\n'
+
+
+class TestNftablesDriver(test_base.NodeTest):
+    def setUp(self):
+        super(TestNftablesDriver, self).setUp()
+        CONF.set_override('rootwrap_config', '/some/fake/path')
+        self.mock_fsm = self.useFixture(
+            fixtures.MockPatchObject(nftables.NftablesFilter, 'fsm')).mock
+        self.mock_fsm.current_state = pxe_filter.States.initialized
+        self.mock_call = self.useFixture(
+            fixtures.MockPatchObject(nftables.processutils, 'execute')).mock
+        self.mock_should_enable_dhcp = self.useFixture(
+            fixtures.MockPatchObject(iptables, '_should_enable_dhcp')).mock
+        self.mock_should_enable_dhcp.return_value = True
+        self.mock__get_blacklist = self.useFixture(
+            fixtures.MockPatchObject(iptables, '_get_blacklist')).mock
+        self.mock__get_blacklist.return_value = ['52:54:00:00:00:02',
+                                                 '52:54:00:00:00:01']
+        self.driver = nftables.NftablesFilter()
+        self.mock_ironic = mock.Mock()
+        self.command = ('sudo', 'ironic-inspector-rootwrap',
+                        '/some/fake/path', 'nft', '-f', '-')
+
+    def assert_nft(self, payload):
+        self.mock_call.assert_called_once_with(*self.command,
+                                               process_input=payload)
+
+    def test_init_filter(self):
+        self.driver.init_filter()
+
+        self.assert_nft(_ruleset())
+
+    def test_reset(self):
+        self.driver.reset()
+
+        self.assert_nft('add table inet ironic_inspector\n'
+                        'delete table inet ironic_inspector\n')
+
+    def test_sync(self):
+        self.driver.sync(self.mock_ironic)
+
+        self.assert_nft(_ruleset(
+            'iifname "br-ctlplane" udp dport { 67, 547 } '
+            'ether saddr @blacklist drop',
+            '52:54:00:00:00:01, 52:54:00:00:00:02'))
+        self.assertEqual({'52:54:00:00:00:01', '52:54:00:00:00:02'},
+                         self.driver.blacklist_cache)
+
+    def test_sync_incremental(self):
+        self.driver.sync(self.mock_ironic)
+        self.mock_call.reset_mock()
+        self.mock__get_blacklist.return_value = ['52:54:00:00:00:02',
+                                                 '52:54:00:00:00:03']
+
+        self.driver.sync(self.mock_ironic)
+
+        self.assert_nft('add element inet ironic_inspector blacklist '
+                        '{ 52:54:00:00:00:03 }\n'
+                        'delete element inet ironic_inspector blacklist '
+                        '{ 52:54:00:00:00:01 }\n')
+
+    def test_sync_no_changes(self):
+        self.driver.sync(self.mock_ironic)
+        self.mock_call.reset_mock()
+
+        self.driver.sync(self.mock_ironic)
+
+        self.mock_call.assert_not_called()
+
+    def test_sync_disable_dhcp(self):
+        self.mock_should_enable_dhcp.return_value = False
+
+        self.driver.sync(self.mock_ironic)
+        self.driver.sync(self.mock_ironic)
+
+        self.assert_nft(_ruleset(
+            'iifname "br-ctlplane" udp dport { 67, 547 } reject'))
+        self.assertFalse(self.driver.enabled)
+        self.mock__get_blacklist.assert_not_called()
+
+    def test_sync_failure(self):
+        self.mock_call.side_effect = (
+            nftables.processutils.ProcessExecutionError())
+
+        self.assertRaises(nftables.processutils.ProcessExecutionError,
+                          self.driver.sync, self.mock_ironic)
+
+        self.assertIsNone(self.driver.blacklist_cache)
+
+    def test_on_introspection_started(self):
+        self.driver.sync(self.mock_ironic)
+        self.mock_call.reset_mock()
+
+        self.driver.on_introspection_started(
+            ['52:54:00:00:00:01', '52:54:00:00:00:09'], self.mock_ironic)
+
+        self.assert_nft('delete element inet ironic_inspector blacklist '
+                        '{ 52:54:00:00:00:01 }\n')
+        self.assertEqual({'52:54:00:00:00:02'}, self.driver.blacklist_cache)
+
+    @mock.patch.object(nftables.node_cache, 'active_macs', autospec=True)
+    def test_on_introspection_finished(self, mock_active_macs):
+        mock_active_macs.return_value = {'52:54:00:00:00:04'}
+        self.driver.sync(self.mock_ironic)
+        self.mock_call.reset_mock()
+
+        self.driver.on_introspection_finished(
+            ['52:54:00:00:00:03', '52:54:00:00:00:04'], self.mock_ironic)
+
+        self.assert_nft('add element inet ironic_inspector blacklist '
+                        '{ 52:54:00:00:00:03 }\n')
+
+    def test_update_failure_falls_back_to_sync(self):
+        self.driver.sync(self.mock_ironic)
+        self.mock_call.reset_mock()
+        self.mock_call.side_effect = [
+            nftables.processutils.ProcessExecutionError(), ('', '')]
+
+        self.driver.on_introspection_started(['52:54:00:00:00:01'],
+                                             self.mock_ironic)
+
+        self.assertEqual(2, self.mock_call.call_count)
+        self.assertIn('table inet ironic_inspector {',
+                      self.mock_call.call_args[1]['process_input'])
+
+    def test_on_introspection_started_uninitialized(self):
+        self.mock_fsm.current_state = pxe_filter.States.uninitialized
+
+        self.driver.on_introspection_started(['52:54:00:00:00:01'])
+
+        self.mock_call.assert_not_called()
+
+
+class TestMapMacs(test_base.BaseTest):
+    def setUp(self):
+        super(TestMapMacs, self).setUp()
+        self.mock_mapping = self.useFixture(fixtures.MockPatchObject(
+            iptables, '_ib_mac_to_rmac_mapping')).mock
+
+    def test_no_ethoib(self):
+        self.assertEqual(['mac1'], nftables._map_macs(['mac1']))
+        self.mock_mapping.assert_not_called()
+
+    def test_ethoib(self):
+        CONF.set_override('ethoib_interfaces', ['eth0'], 'iptables')
+        cached = port_cache.Port('uuid1', 'mac1',
+                                 extra={'client-id': 'client-id'})
+        port_cache.cache()._by_mac = {'mac1': cached}
+
+        def _map(ports):
+            ports[0].address = 'emac1'
+
+        self.mock_mapping.side_effect = _map
+
+        self.assertEqual(['emac1', 'mac2'],
+                         nftables._map_macs(['mac1', 'mac2']))
+        ports, = self.mock_mapping.call_args[0]
+        self.assertEqual({'client-id': 'client-id'}, ports[0].extra)
+        # the cached port is not modified
+        self.assertEqual('mac1', cached.address)
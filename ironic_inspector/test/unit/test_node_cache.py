@@ -28,6 +28,7 @@ from ironic_inspector.common import ironic as ir_utils
 from ironic_inspector import db
 from ironic_inspector import introspection_state as istate
 from ironic_inspector import node_cache
+from ironic_inspector.pxe_filter import base as pxe_filter
 from ironic_inspector.test import base as test_base
 from ironic_inspector import utils
 
@@ -422,6 +423,111 @@ class TestNodeCacheCleanUp(test_base.NodeTest):
                 res)
 
 
+class TestNodeCachePurgeFinished(test_base.NodeTest):
+    def setUp(self):
+        super(TestNodeCachePurgeFinished, self).setUp()
+        self.now = datetime.datetime.utcnow()
+        self.old = self.now - datetime.timedelta(days=10)
+        self.uuids = sorted(uuidutils.generate_uuid() for _i in range(3))
+        session = db.get_writer_session()
+        with session.begin():
+            for uuid in self.uuids:
+                self._add(session, uuid, self.old)
+            # finished recently
+            self.recent = uuidutils.generate_uuid()
+            self._add(session, self.recent, self.now)
+            # not finished
+            db.Node(uuid=self.uuid, state=istate.States.waiting,
+                    started_at=self.old).save(session)
+        self.threshold = self.now - datetime.timedelta(days=1)
+
+    def _add(self, session, uuid, finished_at):
+        db.Node(uuid=uuid, state=istate.States.finished,
+                started_at=finished_at, finished_at=finished_at).save(session)
+        db.Attribute(uuid=uuidutils.generate_uuid(), name='mac',
+                     value='mac-%s' % uuid, node_uuid=uuid).save(session)
+        db.Option(uuid=uuid, name='foo', value='"bar"').save(session)
+        db.IntrospectionData(uuid=uuid, processed=True,
+                             data={'fake': uuid}).save(session)
+
+    def _remaining(self, model, column):
+        return {getattr(row, column) for row in db.model_query(model)}
+
+    def test_purge(self):
+        self.assertEqual(3, node_cache.purge_finished(self.threshold,
+                                                      batch_size=2))
+
+        self.assertEqual({self.recent, self.uuid},
+                         self._remaining(db.Node, 'uuid'))
+        self.assertEqual({self.recent},
+                         self._remaining(db.Attribute, 'node_uuid'))
+        self.assertEqual({self.recent}, self._remaining(db.Option, 'uuid'))
+        self.assertEqual({self.recent},
+                         self._remaining(db.IntrospectionData, 'uuid'))
+
+    def test_nothing_to_purge(self):
+        self.assertEqual(0, node_cache.purge_finished(self.old))
+
+        self.assertEqual(5, db.model_query(db.Node).count())
+
+    @mock.patch.object(node_cache, '_purge_batch', autospec=True)
+    def test_batches(self, mock_purge):
+        mock_purge.side_effect = lambda uuids, *_args: len(uuids)
+
+        self.assertEqual(3, node_cache.purge_finished(self.threshold,
+                                                      batch_size=2))
+
+        mock_purge.assert_has_calls([
+            mock.call(self.uuids[:2], self.threshold, None),
+            mock.call(self.uuids[2:], self.threshold, None),
+        ])
+        self.assertEqual(2, mock_purge.call_count)
+
+    def test_locked(self):
+        node_info = node_cache.NodeInfo(self.uuids[0])
+        node_info.acquire_lock()
+        self.addCleanup(node_info.release_lock)
+
+        self.assertEqual(2, node_cache.purge_finished(self.threshold))
+
+        self.assertEqual({self.uuids[0], self.recent, self.uuid},
+                         self._remaining(db.Node, 'uuid'))
+
+    def test_archive(self):
+        archive = mock.Mock(spec=['write', 'flush'])
+
+        node_cache.purge_finished(self.threshold, batch_size=2,
+                                  archive=archive)
+
+        records = [json.loads(call[0][0].decode('utf-8'))
+                   for call in archive.write.call_args_list]
+        self.assertEqual(self.uuids,
+                         [record['node']['uuid'] for record in records])
+        record = records[0]
+        self.assertEqual(self.old.isoformat(),
+                         record['node']['finished_at'])
+        self.assertEqual([('mac', 'mac-%s' % self.uuids[0])],
+                         [(attr['name'], attr['value'])
+                          for attr in record['attributes']])
+        self.assertEqual([{'uuid': self.uuids[0], 'name': 'foo',
+                           'value': '"bar"'}], record['options'])
+        self.assertEqual([{'uuid': self.uuids[0], 'processed': True,
+                           'data': {'fake': self.uuids[0]}}],
+                         record['introspection_data'])
+        self.assertEqual(2, archive.flush.call_count)
+
+    def test_archive_failure(self):
+        archive = mock.Mock(spec=['write', 'flush'])
+        archive.write.side_effect = IOError('disk full')
+
+        self.assertRaises(IOError, node_cache.purge_finished,
+                          self.threshold, archive=archive)
+
+        # nothing is deleted
+        self.assertEqual(5, db.model_query(db.Node).count())
+        self.assertEqual(4, db.model_query(db.Attribute).count())
+
+
 class TestNodeCacheGetNode(test_base.NodeTest):
     def test_ok(self):
         started_at = (datetime.datetime.utcnow() -
@@ -459,6 +565,65 @@ class TestNodeCacheGetNode(test_base.NodeTest):
         self.assertRaises(utils.Error, node_cache.get_node,
                           uuidutils.generate_uuid())
 
+    @mock.patch.object(db, 'get_replica_session', autospec=True)
+    def test_replica(self, mock_replica):
+        mock_replica.side_effect = db.get_writer_session
+        session = db.get_writer_session()
+        with session.begin():
+            db.Node(uuid=self.uuid, state=istate.States.finished,
+                    finished_at=datetime.datetime.utcnow()).save(session)
+
+        with mock.patch.object(db, 'get_reader_session',
+                               autospec=True) as mock_reader:
+            info = node_cache.get_node(self.uuid, replica=True)
+
+        self.assertEqual(self.uuid, info.uuid)
+        mock_replica.assert_called_once_with()
+        mock_reader.assert_not_called()
+
+    @mock.patch.object(db, 'get_replica_session', autospec=True)
+    def test_replica_not_finished(self, mock_replica):
+        mock_replica.side_effect = db.get_writer_session
+        session = db.get_writer_session()
+        with session.begin():
+            db.Node(uuid=self.uuid,
+                    state=istate.States.starting).save(session)
+
+        with mock.patch.object(db, 'get_reader_session', autospec=True,
+                               side_effect=db.get_writer_session
+                               ) as mock_reader:
+            info = node_cache.get_node(self.uuid, replica=True)
+
+        self.assertEqual(self.uuid, info.uuid)
+        mock_replica.assert_called_once_with()
+        mock_reader.assert_called_once_with()
+
+    @mock.patch.object(db, 'get_replica_session', autospec=True)
+    def test_replica_missing(self, mock_replica):
+        (mock_replica.return_value.query.return_value.filter_by.return_value
+         .first.return_value) = None
+        session = db.get_writer_session()
+        with session.begin():
+            db.Node(uuid=self.uuid,
+                    state=istate.States.starting).save(session)
+
+        info = node_cache.get_node(self.uuid, replica=True)
+
+        self.assertEqual(self.uuid, info.uuid)
+        self.assertEqual(istate.States.starting, info.state)
+
+    @mock.patch.object(db, 'get_replica_session', autospec=True)
+    def test_replica_locked(self, mock_replica):
+        session = db.get_writer_session()
+        with session.begin():
+            db.Node(uuid=self.uuid,
+                    state=istate.States.starting).save(session)
+
+        info = node_cache.get_node(self.uuid, locked=True, replica=True)
+        self.addCleanup(info.release_lock)
+
+        mock_replica.assert_not_called()
+
     def test_with_name(self):
         started_at = (datetime.datetime.utcnow() -
                       datetime.timedelta(seconds=42))
@@ -523,6 +688,24 @@ class TestNodeInfoFinished(test_base.NodeTest):
         self.node_info.finished(istate.Events.finish)
         self.assertFalse(self.node_info._locked)
 
+    @mock.patch.object(pxe_filter, 'driver', autospec=True)
+    def test_pxe_filter_updated(self, mock_driver):
+        self.node_info.finished(istate.Events.finish)
+
+        hook = mock_driver.return_value.on_introspection_finished
+        hook.assert_called_once_with(mock.ANY, None)
+        self.assertEqual(sorted(self.macs), sorted(hook.call_args[0][0]))
+
+    @mock.patch.object(pxe_filter, 'driver', autospec=True)
+    def test_pxe_filter_update_failed(self, mock_driver):
+        hook = mock_driver.return_value.on_introspection_finished
+        hook.side_effect = RuntimeError('boom')
+
+        self.node_info.finished(istate.Events.error, error='boom')
+
+        hook.assert_called_once_with(mock.ANY, None)
+        self.assertEqual([], db.model_query(db.Attribute).all())
+
 
 class TestNodeInfoOptions(test_base.NodeTest):
     def setUp(self):
@@ -830,6 +1013,160 @@ class TestUpdate(test_base.NodeTest):
                                           node_info=self.node_info)
 
 
+class TestBatchedUpdates(test_base.NodeTest):
+    def setUp(self):
+        super(TestBatchedUpdates, self).setUp()
+        self.ironic = mock.Mock()
+        self.ironic.node.update.return_value = mock.sentinel.node
+        self.node.properties['capabilities'] = 'foo:bar'
+        self.node_info = node_cache.NodeInfo(uuid=self.uuid,
+                                             started_at=0,
+                                             node=self.node,
+                                             ironic=self.ironic)
+
+    def test_single_update(self):
+        with self.node_info.batched_updates():
+            self.node_info.update_properties(memory_mb=1024)
+            self.node_info.update_capabilities(x='1')
+            self.node_info.update_capabilities(y='2')
+            self.node_info.replace_field('/extra/foo', lambda v: v + [1],
+                                         default=[])
+            self.node_info.replace_field('/extra/foo', lambda v: v + [2])
+            self.node_info.patch([{'op': 'add', 'path': 'driver_info/x',
+                                   'value': 'y'}])
+            self.node_info.update_properties(memory_mb=2048)
+            # The cached node reflects the changes
+            self.assertEqual([1, 2], self.node_info.get_by_path('extra/foo'))
+            self.assertFalse(self.ironic.node.update.called)
+
+        self.ironic.node.update.assert_called_once_with(self.uuid, mock.ANY)
+        patches = self.ironic.node.update.call_args[0][1]
+        self.assertEqual(
+            [{'op': 'add', 'path': '/properties/memory_mb', 'value': 2048},
+             {'op': 'add', 'path': '/properties/capabilities',
+              'value': mock.ANY},
+             {'op': 'add', 'path': '/extra/foo', 'value': [1, 2]},
+             {'op': 'add', 'path': '/driver_info/x', 'value': 'y'}],
+            patches)
+        self.assertEqual({'foo': 'bar', 'x': '1', 'y': '2'},
+                         ir_utils.capabilities_to_dict(patches[1]['value']))
+        self.assertIs(mock.sentinel.node, self.node_info.node())
+
+    def test_no_updates(self):
+        with self.node_info.batched_updates():
+            pass
+        self.assertFalse(self.ironic.node.update.called)
+        self.assertFalse(self.ironic.node.get_traits.called)
+
+    def test_related_paths_not_merged(self):
+        with self.node_info.batched_updates():
+            self.node_info.patch([
+                {'op': 'add', 'path': '/extra/foo', 'value': {'a': 1}},
+                {'op': 'add', 'path': '/extra/foo/b', 'value': 2},
+                {'op': 'add', 'path': '/extra/foo', 'value': {'c': 3}},
+            ])
+
+        self.ironic.node.update.assert_called_once_with(self.uuid, [
+            {'op': 'add', 'path': '/extra/foo', 'value': {'a': 1}},
+            {'op': 'add', 'path': '/extra/foo/b', 'value': 2},
+            {'op': 'add', 'path': '/extra/foo', 'value': {'c': 3}},
+        ])
+
+    def test_patch_with_args(self):
+        with self.node_info.batched_updates():
+            self.node_info.update_properties(memory_mb=1024)
+            self.node_info.patch([{'op': 'add', 'path': '/driver',
+                                   'value': 'ipmi'}], reset_interfaces=True)
+            self.node_info.update_properties(local_gb=42)
+
+        self.assertEqual([
+            mock.call(self.uuid, [{'op': 'add',
+                                   'path': '/properties/memory_mb',
+                                   'value': 1024}]),
+            mock.call(self.uuid, [{'op': 'add', 'path': '/driver',
+                                   'value': 'ipmi'}],
+                      reset_interfaces=True),
+            mock.call(self.uuid, [{'op': 'add', 'path': '/properties/local_gb',
+                                   'value': 42}]),
+        ], self.ironic.node.update.call_args_list)
+
+    def test_patch_not_applicable_locally(self):
+        with self.node_info.batched_updates():
+            self.node_info.update_properties(memory_mb=1024)
+            self.node_info.patch([{'op': 'add', 'path': '/extra/a/b',
+                                   'value': 42}])
+            self.ironic.node.update.assert_called_once_with(self.uuid, [
+                {'op': 'add', 'path': '/properties/memory_mb',
+                 'value': 1024},
+                {'op': 'add', 'path': '/extra/a/b', 'value': 42},
+            ])
+
+    def test_error_inside(self):
+        def _update():
+            with self.node_info.batched_updates():
+                self.node_info.update_properties(memory_mb=1024)
+                self.node_info.add_trait('CUSTOM_FOO')
+                raise utils.Error('boom')
+
+        self.assertRaisesRegex(utils.Error, 'boom', _update)
+        self.ironic.node.update.assert_called_once_with(self.uuid, [
+            {'op': 'add', 'path': '/properties/memory_mb', 'value': 1024}])
+        self.ironic.node.add_trait.assert_called_once_with(self.uuid,
+                                                           'CUSTOM_FOO')
+
+    def test_update_failure(self):
+        self.ironic.node.update.side_effect = RuntimeError('boom')
+
+        def _update():
+            with self.node_info.batched_updates():
+                self.node_info.update_properties(memory_mb=1024)
+
+        self.assertRaisesRegex(RuntimeError, 'boom', _update)
+        # The cached node is dropped since it does not match Ironic
+        self.assertIsNone(self.node_info._node)
+
+    def test_nested(self):
+        with self.node_info.batched_updates():
+            self.node_info.update_properties(memory_mb=1024)
+            with self.node_info.batched_updates():
+                self.node_info.update_properties(local_gb=42)
+            self.assertFalse(self.ironic.node.update.called)
+
+        self.ironic.node.update.assert_called_once_with(self.uuid, mock.ANY)
+
+    def test_single_trait(self):
+        with self.node_info.batched_updates():
+            self.node_info.remove_trait('CUSTOM_FOO')
+
+        self.ironic.node.remove_trait.assert_called_once_with(self.uuid,
+                                                              'CUSTOM_FOO')
+        self.assertFalse(self.ironic.node.set_traits.called)
+
+    def test_several_traits(self):
+        self.ironic.node.get_traits.return_value = ['CUSTOM_A', 'CUSTOM_B']
+
+        with self.node_info.batched_updates():
+            self.node_info.add_trait('CUSTOM_C')
+            self.node_info.remove_trait('CUSTOM_A')
+            self.node_info.remove_trait('CUSTOM_MISSING')
+            self.node_info.add_trait('CUSTOM_B')
+
+        self.ironic.node.set_traits.assert_called_once_with(
+            self.uuid, ['CUSTOM_B', 'CUSTOM_C'])
+        self.assertFalse(self.ironic.node.add_trait.called)
+        self.assertFalse(self.ironic.node.remove_trait.called)
+
+    def test_several_traits_no_changes(self):
+        self.ironic.node.get_traits.return_value = ['CUSTOM_A']
+
+        with self.node_info.batched_updates():
+            self.node_info.add_trait('CUSTOM_A')
+            self.node_info.remove_trait('CUSTOM_B')
+
+        self.ironic.node.get_traits.assert_called_once_with(self.uuid)
+        self.assertFalse(self.ironic.node.set_traits.called)
+
+
 class TestNodeCacheGetByPath(test_base.NodeTest):
     def setUp(self):
         super(TestNodeCacheGetByPath, self).setUp()
@@ -862,6 +1199,16 @@ class TestLock(test_base.NodeTest):
         self.assertTrue(node_info._locked)
         get_lock_mock.return_value.acquire.assert_called_once_with(True)
 
+    @mock.patch.object(db, 'expire_request_session', autospec=True)
+    def test_acquire_expires_session(self, mock_expire, get_lock_mock):
+        node_info = node_cache.NodeInfo(self.uuid)
+        self.addCleanup(node_info.release_lock)
+
+        node_info.acquire_lock()
+        node_info.acquire_lock()
+
+        mock_expire.assert_called_once_with()
+
     def test_release(self, get_lock_mock):
         node_info = node_cache.NodeInfo(self.uuid)
         node_info.acquire_lock()
@@ -1301,6 +1648,62 @@ class TestIntrospectionDataDbStore(test_base.NodeTest):
         self.assertRaises(utils.IntrospectionDataNotFound,
                           node_cache.get_introspection_data, self.node.uuid)
 
+    @mock.patch.object(db, 'get_replica_session', autospec=True)
+    def test_get_primary(self, mock_replica):
+        node_cache.store_introspection_data(self.node.uuid, self.data)
+
+        stored_data = node_cache.get_introspection_data(self.node.uuid)
+
+        self.assertEqual(self.data, stored_data)
+        mock_replica.assert_not_called()
+
+    @mock.patch.object(db, 'get_replica_session', autospec=True)
+    def test_get_replica(self, mock_replica):
+        mock_replica.side_effect = db.get_writer_session
+        node_cache.store_introspection_data(self.node.uuid, self.data)
+
+        stored_data = node_cache.get_introspection_data(self.node.uuid,
+                                                        replica=True)
+
+        self.assertEqual(self.data, stored_data)
+        mock_replica.assert_called_once_with()
+
+    def test_get_fields(self):
+        node_cache.store_introspection_data(self.node.uuid, self.data)
+
+        stored_data = node_cache.get_introspection_data(
+            self.node.uuid, fields=[('inventory', 'disks'), ('foo',)])
+
+        self.assertEqual({'inventory': {'disks': self.data['inventory']
+                                        ['disks']}},
+                         stored_data)
+
+    def test_get_string(self):
+        node_cache.store_introspection_data(self.node.uuid, self.data)
+
+        with mock.patch.object(json, 'loads', autospec=True) as mock_loads:
+            stored_data = node_cache.get_introspection_data(self.node.uuid,
+                                                            get_json=False)
+
+        self.assertIsInstance(stored_data, six.string_types)
+        self.assertEqual(self.data, json.loads(stored_data))
+        # the stored string is not decoded
+        mock_loads.assert_not_called()
+
+    def test_get_fields_string(self):
+        node_cache.store_introspection_data(self.node.uuid, self.data)
+
+        stored_data = node_cache.get_introspection_data(
+            self.node.uuid, fields=[('boot_interface',)], get_json=False)
+
+        self.assertEqual({'boot_interface': self.data['boot_interface']},
+                         json.loads(stored_data))
+
+    def test_get_string_no_data_available(self):
+        self.assertRaises(utils.IntrospectionDataNotFound,
+                          node_cache.get_introspection_data, self.node.uuid,
+                          get_json=False)
+
     def test_store_proc_and_unproc(self):
         unproc_data = {'s': 'value', 'b': True, 'i': 42}
         node_cache.store_introspection_data(self.node.uuid,
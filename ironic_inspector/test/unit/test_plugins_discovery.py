@@ -114,6 +114,20 @@ class TestEnrollNodeNotFoundHook(test_base.NodeTest):
                           discovery._check_existing_nodes,
                           introspection_data, node_driver_info, self.ironic)
 
+    def test__check_existing_nodes_lookup_per_mac(self):
+        self.ironic.port.list.return_value = []
+        introspection_data = {
+            'all_interfaces': {'eth%d' % i: {'mac': m}
+                               for i, m in enumerate(self.macs)}
+        }
+
+        discovery._check_existing_nodes(introspection_data, {}, self.ironic)
+
+        self.assertEqual(
+            sorted(self.macs),
+            sorted(call[1]['address']
+                   for call in self.ironic.port.list.call_args_list))
+
     def test__check_existing_nodes_new_node(self):
         self.ironic.node.list.return_value = [mock.MagicMock(
             driver_info={'ipmi_address': '1.2.4.3'}, uuid='fake_node')]
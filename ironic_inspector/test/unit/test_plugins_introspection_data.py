@@ -62,6 +62,16 @@ class TestSwiftStore(BaseTest):
         swift_conn.get_object.assert_called_once_with(name)
         self.assertEqual(self.data, json.loads(res_data))
 
+    def test_get_data_fields(self, swift_mock):
+        swift_conn = swift_mock.return_value
+        swift_conn.get_object.return_value = json.dumps(self.data)
+
+        res_data = self.driver.get(self.uuid, get_json=True,
+                                   fields=[('inventory', 'bmc_address')])
+
+        self.assertEqual({'inventory': {'bmc_address': self.bmc_address}},
+                         res_data)
+
     def test_store_data(self, swift_mock):
         swift_conn = swift_mock.return_value
         name = 'inspector_data-%s' % self.uuid
@@ -94,3 +104,12 @@ class TestDatabaseStore(BaseTest):
         res_data = self.driver.get(self.node_info.uuid)
 
         self.assertEqual(self.data, json.loads(res_data))
+
+    def test_get_data_fields(self):
+        self.driver.save(self.node_info.uuid, self.data)
+
+        res_data = self.driver.get(self.node_info.uuid,
+                                   fields=[('boot_interface',)])
+
+        self.assertEqual({'boot_interface': self.data['boot_interface']},
+                         json.loads(res_data))
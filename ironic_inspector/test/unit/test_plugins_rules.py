@@ -16,6 +16,7 @@
 
 from ironicclient import exceptions
 import mock
+import netaddr
 
 from ironic_inspector.common import ironic as ir_utils
 from ironic_inspector import node_cache
@@ -37,6 +38,8 @@ class TestSimpleConditions(test_base.BaseTest):
 
     def _test(self, cond, expected, value, ref):
         self.assertIs(expected, cond.check(None, value, {'value': ref}))
+        compiled = cond.compile({'value': ref})
+        self.assertIs(expected, cond.check(None, value, compiled))
 
     def test_eq(self):
         cond = rules_plugins.EqCondition()
@@ -92,6 +95,8 @@ class TestReConditions(test_base.BaseTest):
                                 (r'^(foo|bar)$', 'foo', True),
                                 (r'fo', 'foo', False)]:
             self.assertEqual(res, cond.check(None, field, {'value': reg}))
+            self.assertEqual(res, cond.check(None, field,
+                                             cond.compile({'value': reg})))
 
     def test_contains(self):
         cond = rules_plugins.ContainsCondition()
@@ -101,6 +106,17 @@ class TestReConditions(test_base.BaseTest):
                                 (r'[1-9]*', 42, True),
                                 (r'bar', 'foo', False)]:
             self.assertEqual(res, cond.check(None, field, {'value': reg}))
+            self.assertEqual(res, cond.check(None, field,
+                                             cond.compile({'value': reg})))
+
+    def test_compile(self):
+        params = {'value': 'fo+'}
+        for cond, pattern in [(rules_plugins.MatchesCondition(), 'fo+$'),
+                              (rules_plugins.ContainsCondition(), 'fo+')]:
+            compiled = cond.compile(params)
+            self.assertEqual('fo+', compiled['value'])
+            self.assertEqual(pattern, compiled['_regexp'].pattern)
+        self.assertEqual({'value': 'fo+'}, params)
 
 
 class TestNetCondition(test_base.BaseTest):
@@ -116,6 +132,30 @@ class TestNetCondition(test_base.BaseTest):
         self.assertFalse(self.cond.check(None, '192.1.2.4',
                                          {'value': '192.0.2.1/24'}))
 
+    def test_check_compiled(self):
+        params = self.cond.compile({'value': '192.0.2.1/24'})
+        with mock.patch.object(netaddr, 'IPNetwork',
+                               autospec=True) as mock_network:
+            self.assertTrue(self.cond.check(None, '192.0.2.4', params))
+            self.assertFalse(self.cond.check(None, '192.1.2.4', params))
+            self.assertFalse(mock_network.called)
+
+    def test_check_compiled_ipv6(self):
+        params = self.cond.compile({'value': '2001:db8::/32'})
+        # NOTE: the truth value of a large network must not be used, the
+        # length of such a network cannot be computed with some netaddr
+        # versions
+        network = mock.MagicMock()
+        network.__len__.side_effect = IndexError('too large')
+        network.__bool__ = network.__nonzero__ = mock.Mock(
+            side_effect=IndexError('too large'))
+        network.__contains__.return_value = True
+        params['_network'] = network
+        with mock.patch.object(netaddr, 'IPNetwork',
+                               autospec=True) as mock_network:
+            self.assertTrue(self.cond.check(None, '2001:db8::1', params))
+            self.assertFalse(mock_network.called)
+
 
 class TestEmptyCondition(test_base.BaseTest):
     cond = rules_plugins.EmptyCondition()
@@ -0,0 +1,152 @@
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import datetime
+
+import fixtures
+from ironicclient import exc as ironic_exc
+import mock
+from oslo_config import cfg
+
+from ironic_inspector.common import port_cache
+from ironic_inspector.test import base as test_base
+
+
+CONF = cfg.CONF
+
+
+def _port(uuid, address, created_at, updated_at=None):
+    return mock.Mock(uuid=uuid, address=address, extra={}, node_uuid='node',
+                     created_at=created_at, updated_at=updated_at,
+                     spec=['uuid', 'address', 'extra', 'node_uuid',
+                           'created_at', 'updated_at'])
+
+
+class TestPortCache(test_base.BaseTest):
+    def setUp(self):
+        super(TestPortCache, self).setUp()
+        self.ironic = mock.Mock()
+        self.ports = [
+            _port('uuid1', 'mac1', '2019-01-01T00:00:00+00:00'),
+            _port('uuid2', 'mac2', '2019-01-01T00:00:01+00:00',
+                  '2019-01-01T00:00:02+00:00'),
+        ]
+        self.ironic.port.list.return_value = self.ports
+        self.cache = port_cache.refresh(self.ironic)
+        self.ironic.port.list.reset_mock()
+
+    def _set_pages(self, created, updated):
+        def _list(sort_key=None, **kwargs):
+            return created if sort_key == 'created_at' else updated
+
+        self.ironic.port.list.side_effect = _list
+
+    def test_load(self):
+        self.assertEqual({'mac1', 'mac2'}, self.cache.macs())
+        self.assertEqual('uuid2', self.cache.get_by_mac('mac2').uuid)
+        self.assertIsNone(self.cache.get_by_mac('mac3'))
+        self.assertEqual({'uuid1', 'uuid2'},
+                         {port.uuid for port in self.cache.ports()})
+        self.assertIs(self.cache, port_cache.cache())
+
+    def test_update(self):
+        new = _port('uuid3', 'mac3', '2019-01-02T00:00:00+00:00')
+        updated = _port('uuid1', 'mac4', '2019-01-01T00:00:00+00:00',
+                        '2019-01-02T00:00:01+00:00')
+        self._set_pages([new] + self.ports[::-1],
+                        [updated, self.ports[1], self.ports[0]])
+
+        port_cache.refresh(self.ironic)
+
+        self.assertEqual({'mac2', 'mac3', 'mac4'}, self.cache.macs())
+        self.assertEqual('uuid1', self.cache.get_by_mac('mac4').uuid)
+        self.ironic.port.list.assert_has_calls([
+            mock.call(limit=100, marker=None, sort_key='created_at',
+                      sort_dir='desc', fields=port_cache._FIELDS),
+            mock.call(limit=100, marker=None, sort_key='updated_at',
+                      sort_dir='desc', fields=port_cache._FIELDS),
+        ])
+        self.assertEqual(2, self.ironic.port.list.call_count)
+
+    def test_update_pagination(self):
+        CONF.set_override('port_cache_page_size', 1, 'ironic')
+        pages = {
+            ('created_at', None): [
+                _port('uuid4', 'mac4', '2019-01-02T00:00:01+00:00')],
+            ('created_at', 'uuid4'): [
+                _port('uuid3', 'mac3', '2019-01-02T00:00:00+00:00')],
+            ('created_at', 'uuid3'): [self.ports[1]],
+            ('updated_at', None): [self.ports[1]],
+            # never updated ports are not newer
+            ('updated_at', 'uuid2'): [self.ports[0]],
+        }
+        self.ironic.port.list.side_effect = (
+            lambda sort_key, marker, **kw: pages[sort_key, marker])
+
+        port_cache.refresh(self.ironic)
+
+        self.assertEqual({'mac1', 'mac2', 'mac3', 'mac4'}, self.cache.macs())
+        # stops at the first port older than the newest known one
+        self.assertEqual(5, self.ironic.port.list.call_count)
+
+    def test_update_never_updated_first(self):
+        CONF.set_override('port_cache_page_size', 1, 'ironic')
+        # NOTE: some databases sort NULL values first in descending order
+        pages = {
+            ('created_at', None): [self.ports[1]],
+            ('updated_at', None): [self.ports[0]],
+            ('updated_at', 'uuid1'): [self.ports[1]],
+        }
+        self.ironic.port.list.side_effect = (
+            lambda sort_key, marker, **kw: pages[sort_key, marker])
+
+        port_cache.refresh(self.ironic)
+
+        self.assertEqual({'mac1', 'mac2'}, self.cache.macs())
+        # does not page through the never updated ports
+        self.assertEqual(2, self.ironic.port.list.call_count)
+
+    def test_full_reload(self):
+        CONF.set_override('port_cache_refresh_interval', 60, 'ironic')
+        self.ironic.port.list.return_value = self.ports[1:]
+        self.useFixture(fixtures.MockPatchObject(
+            port_cache.timeutils, 'utcnow',
+            return_value=self.cache._loaded_at + datetime.timedelta(
+                seconds=61)))
+
+        port_cache.refresh(self.ironic)
+
+        self.assertEqual({'mac2'}, self.cache.macs())
+        self.ironic.port.list.assert_called_once_with(
+            limit=0, fields=port_cache._FIELDS)
+
+    def test_invalidate(self):
+        self.ironic.port.list.return_value = self.ports[1:]
+
+        self.cache.invalidate()
+        port_cache.refresh(self.ironic)
+
+        self.assertEqual({'mac2'}, self.cache.macs())
+
+    @mock.patch('time.sleep', lambda _x: None)
+    def test_retry_on_port_list_failure(self):
+        port_cache._CACHE = None
+        self.ironic.port.list.side_effect = [
+            ironic_exc.ConnectionRefused('boom'),
+            self.ports
+        ]
+
+        cache = port_cache.refresh(self.ironic)
+
+        self.assertEqual({'mac1', 'mac2'}, cache.macs())
+        self.assertEqual(2, self.ironic.port.list.call_count)
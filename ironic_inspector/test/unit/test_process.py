@@ -215,6 +215,90 @@ class TestProcess(BaseProcessTest):
                                process.process, self.data)
 
 
+class TestDuplicateSubmissions(BaseProcessTest):
+    def setUp(self):
+        super(TestDuplicateSubmissions, self).setUp()
+        db.Node(uuid=self.uuid, state=istate.States.waiting,
+                started_at=self.started_at).save(self.session)
+        self.duplicate = copy.deepcopy(self.data)
+
+    def test_duplicate_returns_cached_result(self):
+        self.assertEqual(self.fake_result_json, process.process(self.data))
+        self.assertEqual(self.fake_result_json,
+                         process.process(self.duplicate))
+
+        self.find_mock.assert_called_once_with(bmc_address=self.bmc_address,
+                                               mac=mock.ANY)
+        self.process_mock.assert_called_once_with(
+            self.node_info, self.node, mock.ANY)
+
+    def test_different_payload(self):
+        process.process(self.data)
+        self.duplicate['inventory']['memory']['physical_mb'] = 4096
+        process.process(self.duplicate)
+
+        self.assertEqual(2, self.find_mock.call_count)
+        self.assertEqual(2, self.process_mock.call_count)
+
+    def test_failure_not_cached(self):
+        self.process_mock.side_effect = [utils.Error('boom'),
+                                         self.fake_result_json]
+        self.assertRaisesRegex(utils.Error, 'boom',
+                               process.process, self.data)
+        self.assertEqual(self.fake_result_json,
+                         process.process(self.duplicate))
+        self.assertEqual(2, self.process_mock.call_count)
+
+    def test_new_introspection_invalidates(self):
+        process.process(self.data)
+        (db.model_query(db.Node).filter_by(uuid=self.uuid).
+         update({'started_at': timeutils.utcnow()}))
+        process.process(self.duplicate)
+
+        self.assertEqual(2, self.find_mock.call_count)
+        self.assertEqual(2, self.process_mock.call_count)
+
+    def test_disabled(self):
+        CONF.set_override('continue_cache_ttl', 0, 'processing')
+        process.process(self.data)
+        process.process(self.duplicate)
+
+        self.assertEqual(2, self.find_mock.call_count)
+        self.assertEqual(2, self.process_mock.call_count)
+
+    def test_in_flight_duplicate_waits(self):
+        threads = []
+
+        def _process_node(*args):
+            threads.append(eventlet.spawn(process.process, self.duplicate))
+            # let the duplicate start waiting
+            eventlet.sleep(0)
+            return self.fake_result_json
+
+        self.process_mock.side_effect = _process_node
+        self.assertEqual(self.fake_result_json, process.process(self.data))
+        self.assertEqual(self.fake_result_json, threads[0].wait())
+        self.find_mock.assert_called_once_with(bmc_address=self.bmc_address,
+                                               mac=mock.ANY)
+        self.process_mock.assert_called_once_with(
+            self.node_info, self.node, mock.ANY)
+
+    def test_in_flight_duplicate_gets_error(self):
+        threads = []
+
+        def _process_node(*args):
+            threads.append(eventlet.spawn(process.process, self.duplicate))
+            eventlet.sleep(0)
+            raise utils.Error('boom')
+
+        self.process_mock.side_effect = _process_node
+        self.assertRaisesRegex(utils.Error, 'boom',
+                               process.process, self.data)
+        self.assertRaisesRegex(utils.Error, 'boom', threads[0].wait)
+        self.process_mock.assert_called_once_with(
+            self.node_info, self.node, mock.ANY)
+
+
 @mock.patch.object(example_plugin, 'example_not_found_hook',
                    autospec=True)
 class TestNodeNotFoundHook(BaseProcessTest):
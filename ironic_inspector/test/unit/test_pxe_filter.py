@@ -12,6 +12,7 @@
 # limitations under the License.
 
 from automaton import exceptions as automaton_errors
+import eventlet
 from eventlet import semaphore
 import fixtures
 from futurist import periodics
@@ -37,6 +38,7 @@ class TestDriverManager(test_base.BaseTest):
         self.stevedore_driver_mock = stevedore_driver_fixture.mock
 
     def test_default(self):
+        CONF.clear_default('driver', 'pxe_filter')
         driver_manager = pxe_filter._driver_manager()
         self.stevedore_driver_mock.assert_called_once_with(
             pxe_filter._STEVEDORE_DRIVER_NAMESPACE,
@@ -137,6 +139,165 @@ class TestLockedDriverEvent(BaseFilterBaseTest):
         self.mock_fsm.process_event.assert_called_once_with(event)
         self.assert_driver_was_locked_once()
 
+    def test_locked_driver_update(self):
+        self.mock_fsm.current_state = pxe_filter.States.initialized
+
+        @pxe_filter.locked_driver_update
+        def fun(driver, *args, **kwargs):
+            self.assertIs(self.driver, driver)
+            self.assertEqual(self.expected_args, args)
+            self.assertEqual(self.expected_kwargs, kwargs)
+            self.assert_driver_is_locked()
+            return 42
+
+        self.assertEqual(
+            42, fun(self.driver, *self.expected_args, **self.expected_kwargs))
+
+        self.mock_fsm_reset_on_error.assert_called_once_with()
+        self.mock_fsm.process_event.assert_called_once_with(
+            pxe_filter.Events.sync)
+        self.assert_driver_was_locked_once()
+
+    def test_locked_driver_update_uninitialized(self):
+        self.mock_fsm.current_state = pxe_filter.States.uninitialized
+        fun = mock.Mock(__name__='fun')
+
+        pxe_filter.locked_driver_update(fun)(self.driver)
+
+        fun.assert_not_called()
+        self.mock_fsm_reset_on_error.assert_not_called()
+        self.mock_fsm.process_event.assert_not_called()
+        self.assert_driver_was_locked_once()
+
+    def test_locked_driver_update_generation(self):
+        self.mock_fsm.current_state = pxe_filter.States.initialized
+
+        pxe_filter.locked_driver_update(mock.Mock(__name__='fun'))(
+            self.driver)
+
+        self.assertEqual(1, self.driver._generation)
+
+
+class TestGatheredDriverSync(BaseFilterBaseTest):
+    def setUp(self):
+        super(TestGatheredDriverSync, self).setUp()
+        self.mock_fsm_reset_on_error = self.useFixture(
+            fixtures.MockPatchObject(self.driver, 'fsm_reset_on_error')).mock
+        self.mock_fsm = self.useFixture(
+            fixtures.MockPatchObject(self.driver, 'fsm')).mock
+        self.mock_fsm.current_state = pxe_filter.States.initialized
+        (self.driver.fsm_reset_on_error.return_value.
+            __enter__.return_value) = self.mock_fsm
+        self.mock_gather = self.useFixture(
+            fixtures.MockPatchObject(self.driver, '_gather')).mock
+        self.mock_gather.side_effect = self._gather
+        self.mock_apply = mock.Mock(__name__='apply')
+        self.sync = pxe_filter.gathered_driver_sync(self.mock_apply)
+        self.ironic = mock.Mock()
+
+    def _gather(self, ironic, stats):
+        self.assertIs(self.ironic, ironic)
+        with stats.phase('fetch'):
+            return 'data%d' % self.mock_gather.call_count
+
+    def test_sync(self):
+        def _gather(ironic, stats):
+            self.assert_driver_was_not_locked()
+            return 'data'
+
+        self.mock_gather.side_effect = _gather
+
+        self.sync(self.driver, self.ironic)
+
+        self.mock_gather.assert_called_once_with(self.ironic, mock.ANY)
+        self.mock_fsm.process_event.assert_called_once_with(
+            pxe_filter.Events.sync)
+        self.mock_apply.assert_called_once_with(self.driver, self.ironic,
+                                                mock.ANY)
+        gathered = self.mock_apply.call_args[0][2]
+        self.assertEqual('data', gathered.data)
+        self.assertEqual(1, gathered.sequence)
+        self.assert_driver_was_locked_once()
+
+    def test_sync_updated_while_gathering(self):
+        def _gather(ironic, stats):
+            if self.mock_gather.call_count == 1:
+                # an incremental update in the meantime
+                self.driver._generation += 1
+            return 'data%d' % self.mock_gather.call_count
+
+        self.mock_gather.side_effect = _gather
+
+        self.sync(self.driver, self.ironic)
+
+        self.assertEqual(2, self.mock_gather.call_count)
+        gathered = self.mock_apply.call_args[0][2]
+        self.assertEqual('data2', gathered.data)
+
+    def test_sync_uninitialized(self):
+        self.mock_fsm.current_state = pxe_filter.States.uninitialized
+        self.mock_fsm.process_event.side_effect = (
+            pxe_filter.InvalidFilterDriverState())
+
+        self.assertRaises(pxe_filter.InvalidFilterDriverState,
+                          self.sync, self.driver, self.ironic)
+
+        self.mock_gather.assert_not_called()
+        self.mock_apply.assert_not_called()
+
+    def test_sync_outdated(self):
+        old = self.driver._gather_timed(self.ironic)
+        self.sync(self.driver, self.ironic)
+        self.mock_apply.reset_mock()
+        self.driver._shared_gather = mock.Mock(return_value=old)
+
+        self.sync(self.driver, self.ironic)
+
+        self.mock_apply.assert_not_called()
+
+    def test_sync_gather_failure(self):
+        self.mock_gather.side_effect = RuntimeError('boom')
+
+        self.assertRaises(RuntimeError, self.sync, self.driver, self.ironic)
+
+        self.mock_apply.assert_not_called()
+        self.assert_driver_was_not_locked()
+        self.assertIsNone(self.driver._flight)
+
+    def test_shared_gather(self):
+        def _gather(ironic, stats):
+            # let the other green thread join
+            eventlet.sleep(0)
+            return 'data%d' % self.mock_gather.call_count
+
+        self.mock_gather.side_effect = _gather
+
+        threads = [eventlet.spawn(self.driver._shared_gather, self.ironic)
+                   for _i in range(3)]
+        results = [thread.wait() for thread in threads]
+
+        self.mock_gather.assert_called_once_with(self.ironic, mock.ANY)
+        self.assertEqual(['data1'] * 3, [result.data for result in results])
+        self.assertIsNone(self.driver._flight)
+
+        # the next gather is not shared
+        self.assertEqual('data2',
+                         self.driver._shared_gather(self.ironic).data)
+
+    def test_shared_gather_failure(self):
+        def _gather(ironic, stats):
+            eventlet.sleep(0)
+            raise RuntimeError('boom')
+
+        self.mock_gather.side_effect = _gather
+
+        threads = [eventlet.spawn(self.driver._shared_gather, self.ironic)
+                   for _i in range(2)]
+
+        for thread in threads:
+            self.assertRaises(RuntimeError, thread.wait)
+        self.mock_gather.assert_called_once_with(self.ironic, mock.ANY)
+
 
 class TestBaseFilterFsmPrecautions(BaseFilterBaseTest):
     def setUp(self):
@@ -213,6 +374,29 @@ class TestBaseFilterInterface(BaseFilterBaseTest):
 
         self.mock_reset.assert_not_called()
 
+    def test_on_introspection_started_noop(self):
+        self.driver.on_introspection_started(['mac'])
+
+        self.mock_get_client.assert_not_called()
+        self.assert_driver_was_not_locked()
+
+    def test_on_introspection_finished_noop(self):
+        self.driver.on_introspection_finished(['mac'])
+
+        self.mock_get_client.assert_not_called()
+        self.assert_driver_was_not_locked()
+
+    def test_on_introspection_default_sync(self):
+        sync_mock = self.useFixture(
+            fixtures.MockPatchObject(self.driver, 'sync')).mock
+
+        pxe_filter.BaseFilter.on_introspection_started(self.driver, ['mac'])
+        pxe_filter.BaseFilter.on_introspection_finished(
+            self.driver, ['mac'], mock.sentinel.ironic)
+
+        sync_mock.assert_has_calls([mock.call(self.mock_ironic),
+                                    mock.call(mock.sentinel.ironic)])
+
     def test_tear_down_filter(self):
         self.assert_driver_was_not_locked()
         self.driver.tear_down_filter()
@@ -277,6 +461,57 @@ class TestDriverReset(BaseFilterBaseTest):
             pxe_filter.Events.reset)
 
 
+class TestSyncStats(test_base.BaseTest):
+    def setUp(self):
+        super(TestSyncStats, self).setUp()
+        self.mock_get_metrics_logger = self.useFixture(
+            fixtures.MockPatchObject(pxe_filter.metrics_utils,
+                                     'get_metrics_logger',
+                                     autospec=True)).mock
+        self.metrics = self.mock_get_metrics_logger.return_value
+
+    def test_phase(self):
+        stats = pxe_filter.SyncStats()
+        with stats.phase('fetch'):
+            pass
+        with stats.phase('fetch'):
+            pass
+
+        self.assertEqual(['fetch'], list(stats.timings))
+        self.assertGreaterEqual(stats.timings['fetch'], 0)
+        self.assertFalse(stats.changed)
+
+    def test_report(self):
+        with pxe_filter.sync_stats('foo') as stats:
+            stats.timings['fetch'] = 0.5
+            stats.record(added=2, removed=1)
+            stats.drift = 3
+
+        self.mock_get_metrics_logger.assert_called_once_with(
+            'ironic_inspector.pxe_filter.foo')
+        self.metrics.send_timer.assert_called_once_with('sync.fetch', 500)
+        self.metrics.send_counter.assert_has_calls([
+            mock.call('sync.macs_added', 2),
+            mock.call('sync.macs_removed', 1),
+            mock.call('sync.changed', 1)])
+        self.metrics.send_gauge.assert_called_once_with('drift', 3)
+
+    def test_report_noop(self):
+        with pxe_filter.sync_stats('foo'):
+            pass
+
+        self.metrics.send_counter.assert_called_with('sync.noop', 1)
+        self.metrics.send_gauge.assert_not_called()
+
+    def test_report_failed(self):
+        def _sync():
+            with pxe_filter.sync_stats('foo'):
+                raise RuntimeError('boom')
+
+        self.assertRaises(RuntimeError, _sync)
+        self.metrics.send_counter.assert_called_with('sync.failed', 1)
+
+
 class TestDriver(test_base.BaseTest):
     def setUp(self):
         super(TestDriver, self).setUp()
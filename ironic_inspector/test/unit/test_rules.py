@@ -13,15 +13,24 @@
 # under the License.
 
 """Tests for introspection rules."""
+import datetime
+
+import jsonpath_rw as jsonpath
 import mock
+from oslo_config import cfg
 from oslo_utils import uuidutils
 
 from ironic_inspector import db
+from ironic_inspector import introspection_state as istate
+from ironic_inspector import node_cache
 from ironic_inspector.plugins import base as plugins_base
+from ironic_inspector.plugins import rules as rules_plugins
 from ironic_inspector import rules
 from ironic_inspector.test import base as test_base
 from ironic_inspector import utils
 
+CONF = cfg.CONF
+
 
 class BaseTest(test_base.NodeTest):
     def setUp(self):
@@ -210,6 +219,251 @@ class TestDeleteRule(BaseTest):
         self.assertFalse(db.model_query(db.RuleAction).all())
 
 
+class TestImportRules(BaseTest):
+    def setUp(self):
+        super(TestImportRules, self).setUp()
+        self.uuid2 = uuidutils.generate_uuid()
+        self.uuid3 = uuidutils.generate_uuid()
+        rules.create(self.conditions_json, self.actions_json, uuid=self.uuid)
+        rules.create(self.conditions_json, self.actions_json, uuid=self.uuid2)
+        self.rules_json = [
+            {'uuid': self.uuid3, 'description': 'new',
+             'conditions': self.conditions_json,
+             'actions': self.actions_json},
+            {'uuid': self.uuid2, 'description': 'updated',
+             'conditions': [], 'actions': self.actions_json},
+        ]
+
+    def _descriptions(self):
+        return [(r.as_dict()['uuid'], r.as_dict()['description'])
+                for r in rules.get_all()]
+
+    def test_replace(self):
+        version = rules._get_rule_set_version()
+        result = rules.import_rules(self.rules_json)
+
+        self.assertEqual([self.uuid3, self.uuid2],
+                         [r.as_dict()['uuid'] for r in result])
+        self.assertEqual([(self.uuid3, 'new'), (self.uuid2, 'updated')],
+                         self._descriptions())
+        self.assertEqual([], rules.get(self.uuid2).as_dict()['conditions'])
+        self.assertEqual(2, db.model_query(db.RuleCondition).count())
+        self.assertEqual(version + 1, rules._get_rule_set_version())
+
+    def test_merge(self):
+        version = rules._get_rule_set_version()
+        rules.import_rules(self.rules_json, replace=False)
+
+        # The replaced rule keeps its position
+        self.assertEqual([(self.uuid, None), (self.uuid2, 'updated'),
+                          (self.uuid3, 'new')],
+                         self._descriptions())
+        self.assertEqual(4, db.model_query(db.RuleCondition).count())
+        self.assertEqual(3, db.model_query(db.RuleAction).count())
+        self.assertEqual(version + 1, rules._get_rule_set_version())
+
+    @mock.patch.object(rules.timeutils, 'utcnow', autospec=True)
+    def test_keeps_order(self, mock_now):
+        # NOTE: the creation time may not have sub-second precision
+        mock_now.return_value = datetime.datetime(2019, 3, 4, 12, 0, 0)
+        uuids = sorted((uuidutils.generate_uuid() for _ in range(5)),
+                       reverse=True)
+        rules.import_rules([{'uuid': uuid, 'actions': self.actions_json,
+                             'conditions': self.conditions_json}
+                            for uuid in uuids])
+        rules.create(self.conditions_json, self.actions_json,
+                     uuid=self.uuid)
+
+        self.assertEqual(uuids + [self.uuid],
+                         [r.as_dict()['uuid'] for r in rules.get_all()])
+        self.assertEqual(uuids + [self.uuid],
+                         [r.as_dict()['uuid'] for r in rules.export()])
+
+    def test_generates_uuid(self):
+        del self.rules_json[0]['uuid']
+        result = rules.import_rules(self.rules_json)
+
+        self.assertTrue(uuidutils.is_uuid_like(result[0].as_dict()['uuid']))
+
+    def test_invalid_rule_keeps_old_rules(self):
+        version = rules._get_rule_set_version()
+        self.rules_json[1]['conditions'] = [{'op': 'foobar',
+                                             'field': 'memory_mb'}]
+
+        self.assertRaisesRegex(utils.Error, r'Rule #1 .* is invalid',
+                               rules.import_rules, self.rules_json)
+        self.assertEqual([(self.uuid, None), (self.uuid2, None)],
+                         self._descriptions())
+        self.assertEqual(version, rules._get_rule_set_version())
+
+    def test_duplicate_uuid(self):
+        self.rules_json[1]['uuid'] = self.uuid3
+
+        self.assertRaisesRegex(utils.Error, 'more than once',
+                               rules.import_rules, self.rules_json)
+
+    def test_invalid_uuid(self):
+        self.rules_json[1]['uuid'] = 'foobar'
+
+        self.assertRaisesRegex(utils.Error, 'Invalid UUID',
+                               rules.import_rules, self.rules_json)
+
+    def test_not_a_list(self):
+        self.assertRaisesRegex(utils.Error, 'Expected a list',
+                               rules.import_rules, {'rules': []})
+
+    def test_empty_replace(self):
+        rules.import_rules([])
+
+        self.assertEqual([], rules.get_all())
+
+
+class TestExportRules(BaseTest):
+    def test_export(self):
+        uuids = sorted(uuidutils.generate_uuid() for _ in range(5))
+        rules.import_rules([{'uuid': uuid, 'actions': self.actions_json,
+                             'conditions': self.conditions_json}
+                            for uuid in uuids])
+
+        exported = [r.as_dict() for r in rules.export(batch_size=2)]
+
+        self.assertEqual(uuids, [r['uuid'] for r in exported])
+        self.assertEqual(self.actions_json, exported[0]['actions'])
+        # The result can be imported back
+        rules.import_rules(exported)
+        self.assertEqual(exported,
+                         [r.as_dict() for r in rules.export()])
+
+    @mock.patch.object(db, 'standalone_session', autospec=True,
+                       side_effect=db.standalone_session)
+    def test_session_per_batch(self, mock_session):
+        rules.import_rules([{'actions': self.actions_json,
+                             'conditions': self.conditions_json}
+                            for _ in range(5)])
+
+        with db.request_session():
+            exported = rules.export(batch_size=2)
+        # consumed after the request session is closed
+        self.assertEqual(5, len(list(exported)))
+        self.assertEqual(3, mock_session.call_count)
+
+    def test_empty(self):
+        self.assertEqual([], list(rules.export()))
+
+
+class TestRuleSetCache(BaseTest):
+    def setUp(self):
+        super(TestRuleSetCache, self).setUp()
+        rules.create(self.conditions_json, self.actions_json, uuid=self.uuid)
+
+    @mock.patch.object(rules, 'get_all', autospec=True,
+                       side_effect=rules.get_all)
+    def test_cached(self, mock_get_all):
+        first = rules.get_rule_set()
+        self.assertEqual([self.uuid],
+                         [r.as_dict()['uuid'] for r in first.rules])
+        self.assertIs(first, rules.get_rule_set())
+        mock_get_all.assert_called_once_with(mock.ANY)
+
+    @mock.patch.object(db, 'get_replica_session', autospec=True)
+    @mock.patch.object(rules, '_get_rule_set_version', autospec=True,
+                       side_effect=rules._get_rule_set_version)
+    @mock.patch.object(rules, 'get_all', autospec=True,
+                       side_effect=rules.get_all)
+    def test_primary_session(self, mock_get_all, mock_version,
+                             mock_replica):
+        rules.get_rule_set()
+
+        session, = mock_version.call_args[0]
+        mock_get_all.assert_called_once_with(session)
+        mock_replica.assert_not_called()
+
+    def test_version_bumped(self):
+        self.assertEqual(1, rules._get_rule_set_version())
+        uuid2 = uuidutils.generate_uuid()
+        rules.create(self.conditions_json, self.actions_json, uuid=uuid2)
+        self.assertEqual(2, rules._get_rule_set_version())
+        rules.delete(uuid2)
+        self.assertEqual(3, rules._get_rule_set_version())
+        self.assertRaises(utils.Error, rules.delete, uuid2)
+        self.assertEqual(3, rules._get_rule_set_version())
+        rules.delete_all()
+        self.assertEqual(4, rules._get_rule_set_version())
+
+    def test_invalidated_on_change(self):
+        self.assertEqual(1, len(rules.get_rule_set().rules))
+        uuid2 = uuidutils.generate_uuid()
+        rules.create(self.conditions_json, self.actions_json, uuid=uuid2)
+        self.assertEqual([self.uuid, uuid2],
+                         [r.as_dict()['uuid']
+                          for r in rules.get_rule_set().rules])
+        rules.delete_all()
+        self.assertEqual([], rules.get_rule_set().rules)
+
+    @mock.patch.object(rules, 'get_all', autospec=True,
+                       side_effect=rules.get_all)
+    def test_invalidated_by_other_process(self, mock_get_all):
+        rules.get_rule_set()
+        # Emulate a change made by another process
+        with db.ensure_transaction() as session:
+            rules._bump_rule_set_version(session)
+        rules.get_rule_set()
+        self.assertEqual(2, mock_get_all.call_count)
+
+
+class TestCompilePath(BaseTest):
+    path_data = {
+        'local_gb': 42,
+        'inventory': {
+            'cpu': {'count': 4, 'flags': ['vmx', 'sse']},
+            'interfaces': [{'name': 'eth0', 'mac_address': '11:22'},
+                           {'name': 'eth1', 'mac_address': None}],
+            'system-vendor': 'Dell',
+            'bmc_address': '',
+        },
+        'extra': 'value',
+        'matrix': [[1, 2], [3]],
+    }
+
+    def test_simple(self):
+        for path in ('local_gb', 'inventory.cpu.count',
+                     'inventory.interfaces[1].mac_address',
+                     'inventory.system-vendor', 'matrix[0][1]',
+                     'inventory.cpu.flags[5]', 'inventory.missing.field',
+                     'extra.field', 'extra[1]', 'local_gb.field',
+                     'inventory.interfaces.name', 'inventory.bmc_address',
+                     'matrix[1]', '_private'):
+            expr = rules._compile_path(path)
+            self.assertIsInstance(expr, rules._SimplePath, path)
+            self.assertEqual(
+                [x.value for x in jsonpath.parse(path).find(self.path_data)],
+                expr.find_values(self.path_data), path)
+
+    def test_same_exceptions(self):
+        for path in ('local_gb[0]', 'inventory.cpu[0]'):
+            expr = rules._compile_path(path)
+            self.assertIsInstance(expr, rules._SimplePath, path)
+            parsed = jsonpath.parse(path)
+            try:
+                parsed.find(self.path_data)
+            except Exception as exc:
+                self.assertRaises(type(exc), expr.find_values, self.path_data)
+            else:
+                self.fail('jsonpath_rw did not raise for %s' % path)
+
+    def test_complex(self):
+        for path in ('inventory.interfaces[*].name', 'inventory.*',
+                     '$.local_gb', 'inventory..count', 'matrix[0:1]',
+                     "inventory.'system-vendor'", 'local_gb ',
+                     'inventory.interfaces[-1]', 'local_gb\n'):
+            self.assertIsInstance(rules._compile_path(path),
+                                  rules._JsonPath, path)
+
+    def test_complex_values(self):
+        expr = rules._compile_path('inventory.interfaces[*].name')
+        self.assertEqual(['eth0', 'eth1'], expr.find_values(self.path_data))
+
+
 @mock.patch.object(plugins_base, 'rule_conditions_manager', autospec=True)
 class TestCheckConditions(BaseTest):
     def setUp(self):
@@ -219,6 +473,7 @@ class TestCheckConditions(BaseTest):
                                  actions_json=self.actions_json)
         self.cond_mock = mock.Mock(spec=plugins_base.RuleConditionPlugin)
         self.cond_mock.ALLOW_NONE = False
+        self.cond_mock.compile.side_effect = lambda params, **kwargs: params
         self.ext_mock = mock.Mock(spec=['obj'], obj=self.cond_mock)
 
     def test_ok(self, mock_ext_mgr):
@@ -289,6 +544,29 @@ class TestCheckConditions(BaseTest):
                                                      {'value': 1024})
         self.assertFalse(res)
 
+    def test_compiled_once(self, mock_ext_mgr):
+        mock_ext_mgr.return_value.__getitem__.return_value = self.ext_mock
+        self.cond_mock.compile.side_effect = (
+            lambda params, **kwargs: dict(params, compiled=True))
+        self.cond_mock.check.return_value = True
+
+        for _ in range(3):
+            self.assertTrue(self.rule.check_conditions(self.node_info,
+                                                       self.data))
+
+        self.cond_mock.compile.assert_has_calls([
+            mock.call({'value': 1024}),
+            mock.call({'value': 60}),
+        ])
+        self.assertEqual(2, self.cond_mock.compile.call_count)
+        self.cond_mock.check.assert_any_call(
+            self.node_info, 1024, {'value': 1024, 'compiled': True})
+        # stored parameters are not changed
+        self.assertEqual(
+            [BaseTest.condition_defaults(cond)
+             for cond in self.conditions_json],
+            self.rule.as_dict()['conditions'])
+
 
 class TestCheckConditionsMultiple(BaseTest):
     def setUp(self):
@@ -396,6 +674,33 @@ class TestCheckConditionsSchemePath(BaseTest):
             self.assertIs(res,
                           rule.check_conditions(self.node_info, self.data))
 
+    def test_shared_context(self):
+        conditions = [
+            {'op': 'eq', 'field': 'node://driver_info.ipmi_address',
+             'value': self.bmc_address},
+            {'op': 'eq', 'field': 'node://driver', 'value': 'ipmi'},
+        ]
+        rule1 = rules.create(conditions_json=conditions,
+                             actions_json=self.actions_json)
+        rule2 = rules.create(conditions_json=conditions[:1],
+                             actions_json=self.actions_json)
+        finds = []
+        for rule in (rule1, rule2):
+            for cond in rule.compile():
+                cond.expression = mock.Mock(wraps=cond.expression)
+                finds.append(cond.expression.find_values)
+
+        context = rules._EvaluationContext(self.node_info, self.data)
+        self.assertTrue(rule1.check_conditions(self.node_info, self.data,
+                                               context=context))
+        self.assertTrue(rule2.check_conditions(self.node_info, self.data,
+                                               context=context))
+
+        self.node_info.node.assert_called_once_with()
+        self.node.to_dict.assert_called_once_with()
+        # the IPMI address path is looked up once for both rules
+        self.assertEqual([1, 1, 0], [find.call_count for find in finds])
+
 
 @mock.patch.object(plugins_base, 'rule_actions_manager', autospec=True)
 class TestApplyActions(BaseTest):
@@ -517,6 +822,24 @@ class TestApplyActions(BaseTest):
         self.assertRaises(utils.Error, self.rule.apply_actions,
                           self.node_info, data=self.data)
 
+    def test_apply_does_not_modify_rule(self, mock_ext_mgr):
+        self.rule = rules.create(actions_json=[
+            {'action': 'set-attribute',
+             'path': '/driver_info/ipmi_address',
+             'value': '{data[memory_mb]}'}],
+            conditions_json=self.conditions_json
+        )
+        mock_ext_mgr.return_value.__getitem__.return_value = self.ext_mock
+
+        self.rule.apply_actions(self.node_info, data=self.data)
+
+        self.act_mock.apply.assert_called_once_with(self.node_info, {
+            'value': '1024',
+            'path': '/driver_info/ipmi_address'
+        })
+        self.assertEqual('{data[memory_mb]}',
+                         self.rule.as_dict()['actions'][0]['value'])
+
     def test_apply_data_non_format_value(self, mock_ext_mgr):
         self.rule = rules.create(actions_json=[
             {'action': 'set-attribute',
@@ -531,30 +854,328 @@ class TestApplyActions(BaseTest):
         self.assertEqual(1, self.act_mock.apply.call_count)
 
 
-@mock.patch.object(rules, 'get_all', autospec=True)
+class TestCompileValue(BaseTest):
+    def setUp(self):
+        super(TestCompileValue, self).setUp()
+        self.data.update({'outer': {'inner': 'baz', 'list': [1, 2]},
+                          'flag': False})
+
+    def test_same_as_format_value(self):
+        for value in ['{data[memory_mb]}', 'x{data[outer][inner]}y',
+                      '{data[local_gb]:05d}', '{data[outer][inner]!r}',
+                      '{data[outer][list][1]}', '{{{data[flag]}}}',
+                      '{data[local_gb]:>{data[outer][list][1]}}',
+                      {'{data[outer][inner]}': ['{data[memory_mb]}', 1]},
+                      ['static', ['{data[outer][inner]}'], {'a': 'b'}],
+                      {42: {True: [3.14, 'foo', '{data[flag]}']}}]:
+            template = rules._compile_value(value)
+            self.assertIsNotNone(template, value)
+            self.assertEqual(rules._format_value(value, self.data),
+                             template(self.data), value)
+
+    def test_static(self):
+        for value in ['static', '{{data[memory_mb]}}', 42, None,
+                      {'a': ['b', {'c': 1}]}, []]:
+            self.assertIsNone(rules._compile_value(value), value)
+
+    def test_missing_key(self):
+        template = rules._compile_value(['{data[outer][nonexistent]}'])
+        self.assertRaisesRegex(utils.Error, 'nonexistent',
+                               template, self.data)
+
+    def test_invalid(self):
+        for value in ['{0}', '{}']:
+            template = rules._compile_value(value)
+            self.assertRaises(IndexError, template, self.data)
+        template = rules._compile_value('{')
+        self.assertRaises(ValueError, template, self.data)
+
+    @mock.patch.object(plugins_base, 'rule_actions_manager', autospec=True)
+    def test_rule_shared_between_nodes(self, mock_ext_mgr):
+        act_mock = mock.Mock(spec=plugins_base.RuleActionPlugin)
+        act_mock.FORMATTED_PARAMS = ['value']
+        mock_ext_mgr.return_value.__getitem__.return_value = mock.Mock(
+            spec=['obj'], obj=act_mock)
+        rule = rules.create(actions_json=[
+            {'action': 'set-attribute', 'path': '/extra/foo',
+             'value': '{data[memory_mb]}'},
+            {'action': 'set-attribute', 'path': '/extra/bar',
+             'value': '{{static}}'}],
+            conditions_json=self.conditions_json)
+
+        with mock.patch.object(rules, '_format_value', autospec=True,
+                               side_effect=rules._format_value) as mock_fmt:
+            rule.apply_actions(self.node_info, data={'memory_mb': 1024})
+            rule.apply_actions(self.node_info, data={'memory_mb': 2048})
+            # Only the static value was formatted, once at compile time
+            mock_fmt.assert_called_once_with('{{static}}', None)
+
+        self.assertEqual([
+            mock.call(self.node_info, {'path': '/extra/foo',
+                                       'value': '1024'}),
+            mock.call(self.node_info, {'path': '/extra/bar',
+                                       'value': '{static}'}),
+            mock.call(self.node_info, {'path': '/extra/foo',
+                                       'value': '2048'}),
+            mock.call(self.node_info, {'path': '/extra/bar',
+                                       'value': '{static}'}),
+        ], act_mock.apply.call_args_list)
+        self.assertEqual('{data[memory_mb]}',
+                         rule.as_dict()['actions'][0]['value'])
+
+
+@mock.patch.object(rules, 'get_rule_set', autospec=True)
 class TestApply(BaseTest):
     def setUp(self):
         super(TestApply, self).setUp()
         self.rules = [mock.Mock(spec=rules.IntrospectionRule),
                       mock.Mock(spec=rules.IntrospectionRule)]
+        for rule in self.rules:
+            rule.compile.return_value = []
 
-    def test_no_rules(self, mock_get_all):
-        mock_get_all.return_value = []
+    def test_no_rules(self, mock_get_rule_set):
+        mock_get_rule_set.return_value = rules._RuleSet(1, [])
 
         rules.apply(self.node_info, self.data)
 
-    def test_apply(self, mock_get_all):
-        mock_get_all.return_value = self.rules
+    def test_apply(self, mock_get_rule_set):
+        mock_get_rule_set.return_value = rules._RuleSet(1, self.rules)
         for idx, rule in enumerate(self.rules):
             rule.check_conditions.return_value = not bool(idx)
 
         rules.apply(self.node_info, self.data)
 
         for idx, rule in enumerate(self.rules):
-            rule.check_conditions.assert_called_once_with(self.node_info,
-                                                          self.data)
+            rule.check_conditions.assert_called_once_with(
+                self.node_info, self.data, context=mock.ANY)
             if rule.check_conditions.return_value:
                 rule.apply_actions.assert_called_once_with(
                     self.node_info, data=self.data)
             else:
                 self.assertFalse(rule.apply_actions.called)
+
+    def test_apply_batched(self, mock_get_rule_set):
+        mock_get_rule_set.return_value = rules._RuleSet(1, self.rules)
+        batching = mock.MagicMock()
+
+        def _apply_actions(*args, **kwargs):
+            batching.return_value.__enter__.assert_called_once_with()
+            self.assertFalse(batching.return_value.__exit__.called)
+
+        for rule in self.rules:
+            rule.check_conditions.return_value = True
+            rule.apply_actions.side_effect = _apply_actions
+
+        with mock.patch.object(self.node_info, 'batched_updates', batching):
+            rules.apply(self.node_info, self.data)
+
+        batching.assert_called_once_with()
+        batching.return_value.__exit__.assert_called_once_with(None, None,
+                                                               None)
+        for rule in self.rules:
+            rule.apply_actions.assert_called_once_with(self.node_info,
+                                                       data=self.data)
+
+
+class TestRuleSetIndex(BaseTest):
+    def setUp(self):
+        super(TestRuleSetIndex, self).setUp()
+        self.data = {
+            'inventory': {'system_vendor': {'manufacturer': 'Dell Inc.'},
+                          'cpu': {'count': '4'}},
+            'auto_discovered': True,
+        }
+
+    def _rule(self, *conditions):
+        return rules.create(conditions_json=list(conditions),
+                            actions_json=self.actions_json)
+
+    def _candidates(self, rule_list, data=None):
+        rule_set = rules._RuleSet(1, rule_list)
+        context = rules._EvaluationContext(self.node_info, data or self.data)
+        return rule_set.candidates(context)
+
+    def test_candidates(self):
+        dell = self._rule({'op': 'eq', 'value': 'Dell Inc.',
+                           'field': 'inventory.system_vendor.manufacturer'})
+        hp = self._rule({'op': 'eq', 'value': 'HP',
+                         'field': 'inventory.system_vendor.manufacturer'})
+        unguarded = self._rule({'op': 'gt', 'value': 2,
+                                'field': 'inventory.cpu.count'})
+        discovered = self._rule({'op': 'eq', 'value': True,
+                                 'field': 'auto_discovered'})
+        cpus = self._rule({'op': 'eq', 'value': 4,
+                           'field': 'inventory.cpu.count'},
+                          {'op': 'eq', 'value': 'HP',
+                           'field': 'inventory.system_vendor.manufacturer'})
+        dell2 = self._rule({'op': 'eq', 'value': 'Dell Inc.',
+                            'field': 'inventory.system_vendor.manufacturer'})
+        all_rules = [dell, hp, unguarded, discovered, cpus, dell2]
+
+        self.assertEqual([dell, unguarded, discovered, cpus, dell2],
+                         self._candidates(all_rules))
+        self.assertEqual(
+            [rule for rule in all_rules if rule.check_conditions(
+                self.node_info, self.data)],
+            [rule for rule in self._candidates(all_rules)
+             if rule.check_conditions(self.node_info, self.data)])
+
+    def test_not_indexed(self):
+        all_rules = [
+            self._rule({'op': 'eq', 'value': 'HP', 'invert': True,
+                        'field': 'inventory.system_vendor.manufacturer'}),
+            self._rule({'op': 'eq', 'value': 'HP',
+                        'field': 'inventory.*.manufacturer'}),
+            self._rule({'op': 'eq', 'value': ['HP'],
+                        'field': 'inventory.system_vendor.manufacturer'}),
+            self._rule({'op': 'ne', 'value': 'HP',
+                        'field': 'inventory.system_vendor.manufacturer'}),
+        ]
+        self.assertEqual(all_rules, self._candidates(all_rules))
+
+    def test_missing_field(self):
+        rule = self._rule({'op': 'eq', 'value': 'Dell Inc.',
+                           'field': 'inventory.system_vendor.manufacturer'})
+        del self.data['inventory']['system_vendor']
+        self.assertEqual([], self._candidates([rule]))
+
+    def test_coercion_failure(self):
+        rule = self._rule({'op': 'eq', 'value': 4,
+                           'field': 'inventory.cpu.count'})
+        self.data['inventory']['cpu']['count'] = 'many'
+        self.assertEqual([rule], self._candidates([rule]))
+        # The condition check still reports the problem as before
+        self.assertRaises(ValueError, rule.check_conditions,
+                          self.node_info, self.data)
+
+    def test_unhashable_field(self):
+        rule = self._rule({'op': 'eq', 'value': 'Dell Inc.',
+                           'field': 'inventory.system_vendor'})
+        self.assertEqual([], self._candidates([rule]))
+
+    def test_coercion_from_condition(self):
+        rule = self._rule({'op': 'eq', 'value': 4,
+                           'field': 'inventory.cpu.count'})
+        compile_ = rules_plugins.EqCondition.compile
+
+        def _compile(plugin, params, **kwargs):
+            compiled = compile_(plugin, params, **kwargs)
+            compiled['_coercion'] = float
+            return compiled
+
+        with mock.patch.object(rules_plugins.EqCondition, 'compile',
+                               autospec=True, side_effect=_compile):
+            rule_set = rules._RuleSet(1, [rule])
+
+        key, = rule_set._guards
+        self.assertIs(float, key[2])
+
+    @mock.patch.object(rules.IntrospectionRule, 'check_conditions',
+                       autospec=True, return_value=False)
+    def test_apply_checks_candidates(self, mock_check):
+        self._rule({'op': 'eq', 'value': 'HP',
+                    'field': 'inventory.system_vendor.manufacturer'})
+        dell = self._rule({'op': 'eq', 'value': 'Dell Inc.',
+                           'field': 'inventory.system_vendor.manufacturer'})
+
+        rules.apply(self.node_info, self.data)
+
+        mock_check.assert_called_once_with(mock.ANY, self.node_info,
+                                           self.data, context=mock.ANY)
+        self.assertEqual(dell.as_dict(),
+                         mock_check.call_args[0][0].as_dict())
+
+
+class TestEvaluate(BaseTest):
+    def setUp(self):
+        super(TestEvaluate, self).setUp()
+        CONF.set_override('store_data', 'database', 'processing')
+        self.uuids = sorted(uuidutils.generate_uuid() for _ in range(5))
+        session = db.get_writer_session()
+        with session.begin():
+            for uuid in self.uuids:
+                db.Node(uuid=uuid,
+                        state=istate.States.finished).save(session)
+        # The first node has no data, the rest have growing memory
+        for index, uuid in enumerate(self.uuids[1:]):
+            node_cache.store_introspection_data(
+                uuid, {'memory_mb': 1024 * (index + 1), 'local_gb': 60},
+                processed=True)
+        self.rules_json = [
+            {'uuid': self.uuid, 'actions': self.actions_json,
+             'conditions': [{'op': 'ge', 'field': 'memory_mb',
+                             'value': 2048}]},
+            {'uuid': uuidutils.generate_uuid(), 'description': 'none',
+             'actions': self.actions_json,
+             'conditions': [{'op': 'eq', 'field': 'local_gb',
+                             'value': 40}]},
+        ]
+
+    @mock.patch.object(rules.IntrospectionRule, 'apply_actions',
+                       autospec=True)
+    def test_evaluate(self, apply_mock):
+        result = rules.evaluate(self.rules_json, batch_size=2)
+
+        self.assertEqual(5, result['nodes'])
+        self.assertEqual(1, result['nodes_without_data'])
+        self.assertEqual([], result['errors'])
+        self.assertEqual(
+            [{'uuid': self.uuid, 'description': None, 'matches': 3,
+              'nodes': self.uuids[2:]},
+             {'uuid': self.rules_json[1]['uuid'], 'description': 'none',
+              'matches': 0, 'nodes': []}],
+            result['rules'])
+        self.assertFalse(apply_mock.called)
+        # Nothing is stored
+        self.assertEqual([], rules.get_all())
+
+    @mock.patch.object(utils, 'executor', autospec=True)
+    @mock.patch.object(rules.futurist, 'GreenThreadPoolExecutor',
+                       autospec=True,
+                       side_effect=rules.futurist.GreenThreadPoolExecutor)
+    def test_evaluate_dedicated_pool(self, mock_pool, mock_executor):
+        result = rules.evaluate(self.rules_json, batch_size=2)
+
+        self.assertEqual(3, result['rules'][0]['matches'])
+        mock_pool.assert_called_once_with(
+            max_workers=rules._EVALUATION_WORKERS)
+        # the shared executor is left to introspection and processing
+        mock_executor.assert_not_called()
+
+    def test_evaluate_stored(self):
+        rules.import_rules(self.rules_json)
+
+        result = rules.evaluate()
+
+        self.assertEqual([3, 0], [r['matches'] for r in result['rules']])
+
+    @mock.patch.object(rules.IntrospectionRule, 'check_conditions',
+                       autospec=True)
+    def test_evaluate_error(self, check_mock):
+        # The second rule is never checked because of its eq guard
+        check_mock.side_effect = [RuntimeError('boom'), True, False, False]
+
+        result = rules.evaluate(self.rules_json)
+
+        self.assertEqual([{'node': self.uuids[1], 'rule': self.uuid,
+                           'error': 'boom'}],
+                         result['errors'])
+        self.assertEqual([self.uuids[2]], result['rules'][0]['nodes'])
+        self.assertEqual(4, check_mock.call_count)
+
+    @mock.patch.object(rules._RuleSet, 'candidates', autospec=True)
+    def test_evaluate_candidates_error(self, candidates_mock):
+        candidates_mock.side_effect = [RuntimeError('boom'), [], [], []]
+
+        result = rules.evaluate(self.rules_json)
+
+        self.assertEqual([{'node': self.uuids[1], 'rule': None,
+                           'error': 'boom'}],
+                         result['errors'])
+        self.assertEqual(5, result['nodes'])
+        self.assertEqual(4, candidates_mock.call_count)
+
+    def test_evaluate_invalid(self):
+        self.rules_json[0]['conditions'][0]['op'] = 'foobar'
+
+        self.assertRaises(utils.Error, rules.evaluate, self.rules_json)
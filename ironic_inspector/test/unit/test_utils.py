@@ -154,3 +154,35 @@ class TestIsoTimestamp(base.BaseTest):
 
     def test_none(self):
         self.assertIsNone(utils.iso_timestamp(None))
+
+
+class TestProjectData(base.BaseTest):
+    data = {
+        'root_disk': {'name': '/dev/sda', 'size': 42},
+        'inventory': {'disks': [{'name': '/dev/sda'}],
+                      'cpu': {'count': 2}},
+        'logs': 'a lot of data',
+    }
+
+    def test_project(self):
+        self.assertEqual(
+            {'root_disk': {'name': '/dev/sda', 'size': 42},
+             'inventory': {'disks': [{'name': '/dev/sda'}]}},
+            utils.project_data(self.data, [('root_disk',),
+                                           ('inventory', 'disks')]))
+
+    def test_nested(self):
+        self.assertEqual(
+            {'inventory': {'disks': [{'name': '/dev/sda'}],
+                           'cpu': {'count': 2}}},
+            utils.project_data(self.data, [('inventory', 'cpu', 'count'),
+                                           ('inventory',),
+                                           ('inventory', 'disks')]))
+
+    def test_missing(self):
+        self.assertEqual(
+            {'root_disk': {'name': '/dev/sda'}},
+            utils.project_data(self.data, [('root_disk', 'name'),
+                                           ('root_disk', 'name', 'foo'),
+                                           ('inventory', 'disks', '0'),
+                                           ('foo',)]))
@@ -238,3 +238,35 @@ def iso_timestamp(timestamp=None, tz=pytz.timezone('utc')):
         return None
     date = datetime.datetime.fromtimestamp(timestamp, tz=tz)
     return date.isoformat()
+
+
+def project_data(data, paths):
+    """Select parts of introspection data.
+
+    :param data: introspection data, a dictionary.
+    :param paths: a list of paths, each a tuple of keys of nested
+        dictionaries, e.g. ``('inventory', 'disks')``.
+    :returns: a dictionary with the same structure as data, only containing
+        the selected values. Paths that do not exist are skipped.
+    """
+    result = {}
+    selected = set()
+    # NOTE: shorter paths first, so that a path selecting a whole subtree
+    # takes precedence over the paths inside it
+    for path in sorted(set(paths), key=len):
+        if any(path[:i] in selected for i in range(1, len(path))):
+            continue
+
+        value = data
+        for key in path:
+            if not isinstance(value, dict) or key not in value:
+                break
+            value = value[key]
+        else:
+            target = result
+            for key in path[:-1]:
+                target = target.setdefault(key, {})
+            target[path[-1]] = value
+            selected.add(path)
+
+    return result
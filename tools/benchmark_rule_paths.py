@@ -0,0 +1,81 @@
+#!/usr/bin/env python
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""Compare evaluation of simple rule paths with jsonpath_rw."""
+
+from __future__ import print_function
+
+import optparse
+import timeit
+
+import jsonpath_rw as jsonpath
+
+from ironic_inspector import rules
+
+
+DATA = {
+    'local_gb': 40,
+    'memory_mb': 12288,
+    'inventory': {
+        'cpu': {'count': 4, 'architecture': 'x86_64'},
+        'memory': {'physical_mb': 12288},
+        'system_vendor': {'manufacturer': 'Dell Inc.',
+                          'product_name': 'PowerEdge R630'},
+        'interfaces': [
+            {'name': 'eth%d' % i,
+             'mac_address': '52:54:00:00:00:%02x' % i,
+             'ipv4_address': '192.0.2.%d' % i}
+            for i in range(8)
+        ],
+        'bmc_address': '192.0.2.100',
+    },
+}
+
+PATHS = [
+    'local_gb',
+    'inventory.cpu.count',
+    'inventory.system_vendor.manufacturer',
+    'inventory.interfaces[3].mac_address',
+    'inventory.missing.field',
+]
+
+
+def _per_call(func, number):
+    return min(timeit.repeat(func, number=number, repeat=3)) / number
+
+
+def main():
+    parser = optparse.OptionParser()
+    parser.add_option("-n", "--number", dest="number", type="int",
+                      default=20000,
+                      help="number of evaluations per measurement")
+    options, _args = parser.parse_args()
+
+    print('%-40s %12s %12s %8s' % ('path', 'jsonpath us', 'native us',
+                                   'speedup'))
+    for path in PATHS:
+        parsed = jsonpath.parse(path)
+        compiled = rules._compile_path(path)
+        assert isinstance(compiled, rules._SimplePath), path
+        assert ([x.value for x in parsed.find(DATA)] ==
+                compiled.find_values(DATA)), path
+
+        old = _per_call(lambda: [x.value for x in parsed.find(DATA)],
+                        options.number)
+        new = _per_call(lambda: compiled.find_values(DATA), options.number)
+        print('%-40s %12.3f %12.3f %7.1fx' % (path, old * 1e6, new * 1e6,
+                                              old / new))
+
+
+if __name__ == '__main__':
+    main()
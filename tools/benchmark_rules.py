@@ -0,0 +1,338 @@
+#!/usr/bin/env python
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""Micro-benchmarks for the introspection rules engine.
+
+Synthetic rule sets of different sizes are stored in an in-memory SQLite
+database and applied to generated introspection data. Nodes are real
+NodeInfo objects backed by a fake Ironic client, which counts the calls
+instead of sending them anywhere.
+
+The results are printed as JSON, so that they can be stored and compared
+between releases, e.g.::
+
+    tools/benchmark_rules.py --sizes 10,100,1000 --output before.json
+"""
+
+from __future__ import print_function
+
+import collections
+import datetime
+import gc
+import json
+import optparse
+import platform
+import sys
+import time
+
+try:
+    import tracemalloc
+except ImportError:  # Python 2
+    tracemalloc = None
+
+from oslo_config import cfg
+from oslo_utils import uuidutils
+
+from ironic_inspector.conf import opts as conf_opts
+from ironic_inspector import db
+from ironic_inspector import node_cache
+from ironic_inspector.plugins import base as plugins_base
+from ironic_inspector import rules
+
+
+CONF = cfg.CONF
+
+# Sample checks for every condition plugin: (field value, parameters)
+PLUGIN_SAMPLES = {
+    'eq': (4096, {'value': 4096}),
+    'ne': (4096, {'value': 2048}),
+    'lt': (4096, {'value': 8192}),
+    'le': (4096, {'value': 4096}),
+    'gt': (4096, {'value': 2048}),
+    'ge': (4096, {'value': 4096}),
+    'in-net': ('192.0.2.42', {'value': '192.0.2.0/24'}),
+    'matches': ('eth3', {'value': 'eth[0-9]+'}),
+    'contains': ('PowerEdge R630', {'value': 'R6'}),
+    'is-empty': ('', {}),
+}
+
+
+class FakeNode(object):
+    """Ironic node with the fields used by the rule actions."""
+
+    def __init__(self, uuid):
+        self.uuid = uuid
+        self.driver = 'ipmi'
+        self.driver_info = {'ipmi_address': '192.0.2.100'}
+        self.properties = {'cpu_arch': 'x86_64', 'capabilities': 'boot_mode:'
+                           'uefi'}
+        self.extra = {}
+        self.traits = []
+
+    def to_dict(self):
+        return {'uuid': self.uuid, 'driver': self.driver,
+                'driver_info': self.driver_info,
+                'properties': self.properties, 'extra': self.extra}
+
+
+class FakeNodeManager(object):
+    """Counts calls to the Ironic node API."""
+
+    def __init__(self, node, calls):
+        self._node = node
+        self._calls = calls
+
+    def get(self, uuid, **kwargs):
+        self._calls['node.get'] += 1
+        return self._node
+
+    def update(self, uuid, patches, **kwargs):
+        self._calls['node.update'] += 1
+        for patch in patches:
+            try:
+                node_cache._apply_patch(self._node, patch)
+            except (AttributeError, KeyError, IndexError, TypeError):
+                pass
+        return self._node
+
+    def get_traits(self, uuid):
+        self._calls['node.get_traits'] += 1
+        return list(self._node.traits)
+
+    def set_traits(self, uuid, traits):
+        self._calls['node.set_traits'] += 1
+        self._node.traits = list(traits)
+
+    def add_trait(self, uuid, trait):
+        self._calls['node.add_trait'] += 1
+        self._node.traits.append(trait)
+
+    def remove_trait(self, uuid, trait):
+        self._calls['node.remove_trait'] += 1
+        self._node.traits.remove(trait)
+
+
+class FakeIronic(object):
+    def __init__(self, node, calls):
+        self.node = FakeNodeManager(node, calls)
+
+
+def make_rules(count, models):
+    """Generate a rule set with a mix of indexed and generic rules."""
+    result = []
+    for index in range(count):
+        model = 'model-%d' % (index % models)
+        conditions = [
+            {'op': 'ge', 'field': 'memory_mb', 'value': 4096},
+            {'op': 'matches', 'field': 'inventory.interfaces[*].name',
+             'value': 'eth[0-9]+', 'multiple': 'all'},
+            {'op': 'in-net', 'field': 'inventory.bmc_address',
+             'value': '192.0.2.0/24'},
+        ]
+        if index % 5:
+            conditions.insert(0, {'op': 'eq',
+                                  'field': 'inventory.system_vendor.'
+                                           'product_name',
+                                  'value': model})
+        else:
+            conditions.insert(0, {'op': 'contains',
+                                  'field': 'inventory.system_vendor.'
+                                           'manufacturer',
+                                  'value': 'Dell'})
+            conditions.append({'op': 'eq',
+                               'field': 'node://properties.cpu_arch',
+                               'value': 'x86_64'})
+        result.append({
+            'description': 'rule %d' % index,
+            'conditions': conditions,
+            'actions': [
+                {'action': 'set-capability', 'name': 'profile',
+                 'value': model},
+                {'action': 'set-attribute', 'path': '/extra/rule_%d' % index,
+                 'value': '{data[inventory][cpu][count]}'},
+                {'action': 'add-trait', 'name': 'CUSTOM_RULE_%d' % index},
+            ],
+        })
+    return result
+
+
+def make_data(index, models):
+    """Generate processed introspection data for one node."""
+    interfaces = [{'name': 'eth%d' % i,
+                   'mac_address': '52:54:00:%02x:00:%02x' % (index % 256, i),
+                   'ipv4_address': '10.%d.%d.%d' % (i, index // 256,
+                                                    index % 256),
+                   'has_carrier': True}
+                  for i in range(4)]
+    return {
+        'memory_mb': 16384,
+        'local_gb': 930,
+        'cpus': 16,
+        'cpu_arch': 'x86_64',
+        'ipmi_address': '192.0.2.%d' % (index % 250 + 1),
+        'boot_interface': interfaces[0]['mac_address'],
+        'macs': [iface['mac_address'] for iface in interfaces],
+        'interfaces': {iface['name']: {'mac': iface['mac_address'],
+                                       'ip': iface['ipv4_address']}
+                       for iface in interfaces},
+        'inventory': {
+            'bmc_address': '192.0.2.%d' % (index % 250 + 1),
+            'cpu': {'count': 16, 'architecture': 'x86_64',
+                    'model_name': 'Intel(R) Xeon(R) CPU E5-2630 v4',
+                    'flags': ['fpu', 'vme', 'de', 'pse', 'tsc', 'msr', 'pae',
+                              'vmx', 'sse4_2', 'avx2']},
+            'memory': {'physical_mb': 16384, 'total': 17179869184},
+            'disks': [{'name': '/dev/sd%s' % letter, 'size': 1000204886016,
+                       'rotational': True, 'model': 'ST1000NX0423',
+                       'serial': 'Z%07d%s' % (index, letter)}
+                      for letter in 'ab'],
+            'interfaces': interfaces,
+            'system_vendor': {'manufacturer': 'Dell Inc.',
+                              'product_name': 'model-%d' % (index % models),
+                              'serial_number': 'SN%06d' % index},
+        },
+        'root_disk': {'name': '/dev/sda', 'size': 1000204886016},
+    }
+
+
+def make_node(calls):
+    node = FakeNode(uuidutils.generate_uuid())
+    return node_cache.NodeInfo(uuid=node.uuid,
+                               started_at=datetime.datetime.utcnow(),
+                               node=node, ironic=FakeIronic(node, calls))
+
+
+def setup_database():
+    conf_opts.parse_args([], default_config_files=[])
+    CONF.set_override('connection', 'sqlite:///', 'database')
+    engine = db.get_writer_session().get_bind()
+    db.Base.metadata.create_all(engine)
+
+
+def _timed(func, items):
+    """Run func on every item, return seconds per item."""
+    start = time.time()
+    for item in items:
+        func(*item)
+    return (time.time() - start) / len(items)
+
+
+def _check_only(node_info, data):
+    rule_set = rules.get_rule_set()
+    context = rules._EvaluationContext(node_info, data)
+    for rule in rule_set.candidates(context):
+        rule.check_conditions(node_info, data, context=context)
+
+
+def benchmark_rule_set(size, nodes, repeat):
+    models = max(10, size // 10)
+    rules.import_rules(make_rules(size, models))
+    # Load the rule set cache outside of the measurements
+    rule_set = rules.get_rule_set()
+    dataset = [make_data(index, models) for index in range(nodes)]
+
+    calls = collections.Counter()
+    result = {'rules': size, 'nodes': nodes}
+    result['candidates_per_node'] = sum(
+        len(rule_set.candidates(
+            rules._EvaluationContext(make_node(calls), data)))
+        for data in dataset) / float(nodes)
+
+    check_times = []
+    apply_times = []
+    for _attempt in range(repeat):
+        items = [(make_node(calls), data) for data in dataset]
+        check_times.append(_timed(_check_only, items))
+
+        calls.clear()
+        items = [(make_node(calls), data) for data in dataset]
+        apply_times.append(_timed(rules.apply, items))
+
+    result['check_us_per_node'] = min(check_times) * 1e6
+    result['apply_us_per_node'] = min(apply_times) * 1e6
+    result['ironic_calls_per_node'] = {
+        name: count / float(nodes) for name, count in sorted(calls.items())}
+
+    if tracemalloc is not None:
+        items = [(make_node(collections.Counter()), data)
+                 for data in dataset]
+        gc.collect()
+        tracemalloc.start()
+        before = tracemalloc.take_snapshot()
+        _timed(rules.apply, items)
+        after = tracemalloc.take_snapshot()
+        _current, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        stats = after.compare_to(before, 'filename')
+        result['alloc_peak_kib'] = peak / 1024.0
+        result['alloc_retained_bytes_per_node'] = sum(
+            stat.size_diff for stat in stats) / float(nodes)
+        result['alloc_blocks_per_node'] = sum(
+            stat.count_diff for stat in stats) / float(nodes)
+
+    return result
+
+
+def benchmark_plugins(number):
+    result = {}
+    for ext in plugins_base.rule_conditions_manager():
+        if ext.name not in PLUGIN_SAMPLES:
+            continue
+        value, params = PLUGIN_SAMPLES[ext.name]
+        plugin = ext.obj
+        compiled = plugin.compile(dict(params))
+        start = time.time()
+        for _i in range(number):
+            plugin.check(None, value, compiled)
+        result[ext.name] = (time.time() - start) / number * 1e6
+    return result
+
+
+def main():
+    parser = optparse.OptionParser()
+    parser.add_option("-s", "--sizes", dest="sizes", default="10,100,1000",
+                      help="comma-separated numbers of rules to benchmark")
+    parser.add_option("-n", "--nodes", dest="nodes", type="int", default=100,
+                      help="number of introspection data sets per run")
+    parser.add_option("-r", "--repeat", dest="repeat", type="int", default=3,
+                      help="number of runs, the fastest one is reported")
+    parser.add_option("-p", "--plugin-checks", dest="plugin_checks",
+                      type="int", default=20000,
+                      help="number of checks per condition plugin")
+    parser.add_option("-o", "--output", dest="output",
+                      help="file to write results to instead of stdout")
+    options, _args = parser.parse_args()
+
+    setup_database()
+    results = {
+        'python': platform.python_version(),
+        'timestamp': datetime.datetime.utcnow().isoformat(),
+        'options': {'nodes': options.nodes, 'repeat': options.repeat},
+        'rule_sets': [
+            benchmark_rule_set(int(size), options.nodes, options.repeat)
+            for size in options.sizes.split(',')
+        ],
+        'condition_plugins_us_per_check': benchmark_plugins(
+            options.plugin_checks),
+    }
+
+    if options.output:
+        with open(options.output, 'w') as fp:
+            json.dump(results, fp, indent=2, sort_keys=True)
+    else:
+        json.dump(results, sys.stdout, indent=2, sort_keys=True)
+        print()
+
+
+if __name__ == '__main__':
+    main()